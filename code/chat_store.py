@@ -0,0 +1,837 @@
+"""
+Shared SQLite access layer for persistent chat history.
+
+Every ChatWithMemory instance in a process shares one SQLAlchemy engine (and
+connection pool) per database file. Connections run in WAL mode with
+synchronous=NORMAL, and the schema is migrated once when the engine is created.
+
+Alongside LangChain's `message_store` table, a `sessions` catalog keeps each
+session's message count, token total and activity times. It is updated in the
+same transaction as every write, so listing sessions never scans messages.
+
+Writes are synchronous by default. `WriteBehindWriter` optionally moves them
+to a background thread that commits queued turns in batched transactions.
+
+Idle sessions can be compacted into `session_archive`, one zlib-compressed blob
+per session. Reads fall back to the archive transparently, and writing to an
+archived session restores it first. Archived messages leave the full-text index.
+"""
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_community.chat_message_histories.sql import SQLChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Connection, Engine
+
+from paths import CHAT_HISTORY_DB_FPATH
+from utils import count_tokens
+
+
+def _backfill_sessions(conn: Connection) -> None:
+    """Populates the sessions catalog from messages already in message_store."""
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(message_store)"))}
+    created_at = "created_at" if "created_at" in columns else "CURRENT_TIMESTAMP"
+
+    stats = defaultdict(lambda: {"count": 0, "tokens": 0, "first": None, "last": None})
+    rows = conn.execute(
+        text(f"SELECT session_id, message, {created_at} FROM message_store ORDER BY id")
+    )
+    for session_id, message, timestamp in rows:
+        entry = stats[session_id]
+        entry["count"] += 1
+        entry["tokens"] += count_tokens(json.loads(message)["data"]["content"])
+        entry["first"] = entry["first"] or timestamp
+        entry["last"] = timestamp
+
+    for session_id, entry in stats.items():
+        conn.execute(
+            text(
+                "INSERT OR REPLACE INTO sessions "
+                "(session_id, message_count, token_total, created_at, last_activity) "
+                "VALUES (:session_id, :count, :tokens, :first, :last)"
+            ),
+            {"session_id": session_id, **entry},
+        )
+
+
+MESSAGE_STORE_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_message_store_session_id_id
+ON message_store (session_id, id)
+"""
+
+# Keep message_fts in sync with message_store
+MESSAGE_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS message_store_fts_insert
+    AFTER INSERT ON message_store BEGIN
+        INSERT INTO message_fts (rowid, content, session_id)
+        VALUES (new.id, json_extract(new.message, '$.data.content'), new.session_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_store_fts_delete
+    AFTER DELETE ON message_store BEGIN
+        DELETE FROM message_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS message_store_fts_update
+    AFTER UPDATE OF message ON message_store BEGIN
+        UPDATE message_fts
+        SET content = json_extract(new.message, '$.data.content')
+        WHERE rowid = old.id;
+    END
+    """,
+]
+
+
+def _backfill_message_fts(conn: Connection) -> None:
+    """Indexes messages that are not in the full-text index yet."""
+    conn.execute(
+        text(
+            "INSERT INTO message_fts (rowid, content, session_id) "
+            "SELECT id, json_extract(message, '$.data.content'), session_id FROM message_store "
+            "WHERE id NOT IN (SELECT rowid FROM message_fts)"
+        )
+    )
+
+
+def _add_archived_column(conn: Connection) -> None:
+    """Adds the sessions.archived flag unless it already exists."""
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(sessions)"))}
+    if "archived" not in columns:
+        conn.execute(text("ALTER TABLE sessions ADD COLUMN archived INTEGER NOT NULL DEFAULT 0"))
+
+
+def _autoincrement_message_ids(conn: Connection) -> None:
+    """Rebuilds a message_store created without AUTOINCREMENT, so message IDs are never reused.
+
+    Without it, SQLite hands out max(id) + 1, so IDs freed when the newest
+    session is archived would be reused and collide when it is restored.
+    The ID sequence starts past every archived ID as well.
+    """
+    table_sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'message_store'")
+    ).scalar()
+    if "AUTOINCREMENT" in table_sql.upper():
+        return
+
+    columns = {row[1] for row in conn.execute(text("PRAGMA table_info(message_store)"))}
+    created_at = "created_at" if "created_at" in columns else "CURRENT_TIMESTAMP"
+    conn.execute(
+        text(
+            """
+            CREATE TABLE message_store_autoincrement (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+    )
+    conn.execute(
+        text(
+            "INSERT INTO message_store_autoincrement (id, session_id, message, created_at) "
+            f"SELECT id, session_id, message, {created_at} FROM message_store"
+        )
+    )
+    # Dropping the table drops its index and triggers; message_fts rows keep their rowids
+    conn.execute(text("DROP TABLE message_store"))
+    conn.execute(text("ALTER TABLE message_store_autoincrement RENAME TO message_store"))
+    for statement in [MESSAGE_STORE_INDEX, *MESSAGE_FTS_TRIGGERS]:
+        conn.execute(text(statement))
+
+    max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM message_store")).scalar()
+    for (payload,) in conn.execute(text("SELECT payload FROM session_archive")):
+        max_id = max([max_id] + [row[0] for row in json.loads(zlib.decompress(payload))])
+    if not conn.execute(
+        text("UPDATE sqlite_sequence SET seq = MAX(seq, :max_id) WHERE name = 'message_store'"),
+        {"max_id": max_id},
+    ).rowcount:
+        conn.execute(
+            text("INSERT INTO sqlite_sequence (name, seq) VALUES ('message_store', :max_id)"),
+            {"max_id": max_id},
+        )
+
+
+# Each migration upgrades the schema by one version, tracked in PRAGMA user_version.
+# Steps are idempotent, so re-running a migration after a partial failure is safe
+MIGRATIONS = [
+    # 1: message table used by SQLChatMessageHistory, plus a per-session lookup index
+    [
+        """
+        CREATE TABLE IF NOT EXISTS message_store (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        MESSAGE_STORE_INDEX,
+    ],
+    # 2: per-session catalog maintained on every write, backfilled from existing messages
+    [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            token_total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_activity TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_sessions_last_activity
+        ON sessions (last_activity)
+        """,
+        _backfill_sessions,
+    ],
+    # 3: rolling summary checkpoints for long sessions
+    [
+        """
+        CREATE TABLE IF NOT EXISTS session_checkpoints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            upto_message_id INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_session_checkpoints_session_id
+        ON session_checkpoints (session_id, upto_message_id)
+        """,
+    ],
+    # 4: full-text index over message content, kept in sync by triggers
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(
+            content, session_id UNINDEXED, tokenize = 'porter unicode61'
+        )
+        """,
+        *MESSAGE_FTS_TRIGGERS,
+        _backfill_message_fts,
+    ],
+    # 5: compressed archive of cold sessions
+    [
+        """
+        CREATE TABLE IF NOT EXISTS session_archive (
+            session_id TEXT PRIMARY KEY,
+            codec TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            message_count INTEGER NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        _add_archived_column,
+    ],
+    # 6: never reuse message IDs, which archived sessions keep and restore
+    [_autoincrement_message_ids],
+]
+
+
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """Applies per-connection SQLite settings when the pool opens a connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+
+@contextmanager
+def _immediate_transaction(engine: Engine) -> Iterator[Connection]:
+    """Runs a transaction that takes the database write lock at BEGIN.
+
+    The driver's default deferred BEGIN only locks on the first write, so
+    rows read before it can change underneath the transaction. The driver
+    also commits implicitly before DDL; here every statement, DDL included,
+    is part of the one transaction.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+
+def migrate_chat_schema(engine: Engine) -> None:
+    """Brings the chat database schema up to the latest version.
+
+    Runs under the database write lock, so concurrent openers apply each
+    migration once, and a failed migration leaves the schema unchanged.
+
+    Args:
+        engine: Engine bound to the chat history database.
+    """
+    with _immediate_transaction(engine) as conn:
+        # Read under the lock: another process may have migrated while we waited
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        for target_version in range(version + 1, len(MIGRATIONS) + 1):
+            for step in MIGRATIONS[target_version - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(text(f"PRAGMA user_version = {target_version}"))
+
+
+class ChatStore:
+    """Pooled access to the chat history database."""
+
+    def __init__(self, db_fpath: str = CHAT_HISTORY_DB_FPATH):
+        """Create the shared engine for a database file and migrate its schema.
+
+        Args:
+            db_fpath: Path to the SQLite chat history database.
+        """
+        os.makedirs(os.path.dirname(db_fpath), exist_ok=True)
+        self.db_fpath = db_fpath
+        self.engine = create_engine(
+            f"sqlite:///{db_fpath}", connect_args={"check_same_thread": False}
+        )
+        event.listen(self.engine, "connect", _configure_sqlite_connection)
+        migrate_chat_schema(self.engine)
+
+    def connect(self) -> Connection:
+        """Checks out a pooled connection (use as a context manager)."""
+        return self.engine.connect()
+
+    def get_history(self, session_id: str) -> SQLChatMessageHistory:
+        """Returns a LangChain message history for a session backed by the shared engine."""
+        return SQLChatMessageHistory(connection=self.engine, session_id=session_id)
+
+    def append_messages(self, session_id: str, messages: Sequence[BaseMessage]) -> List[int]:
+        """Stores messages and updates the session catalog in one transaction.
+
+        Args:
+            session_id: Session the messages belong to.
+            messages: Messages to append, in order.
+
+        Returns:
+            The IDs assigned to the stored messages.
+        """
+        with self.engine.begin() as conn:
+            return self._append_messages(conn, session_id, messages)
+
+    def _append_messages(
+        self, conn: Connection, session_id: str, messages: Sequence[BaseMessage]
+    ) -> List[int]:
+        """Writes messages and their catalog update using an open transaction."""
+        self._restore_session(conn, session_id)
+        message_ids = []
+        for msg in messages:
+            result = conn.execute(
+                text(
+                    "INSERT INTO message_store (session_id, message) "
+                    "VALUES (:session_id, :message)"
+                ),
+                {"session_id": session_id, "message": json.dumps(message_to_dict(msg))},
+            )
+            message_ids.append(result.lastrowid)
+        conn.execute(
+            text(
+                "INSERT INTO sessions (session_id, message_count, token_total) "
+                "VALUES (:session_id, :count, :tokens) "
+                "ON CONFLICT(session_id) DO UPDATE SET "
+                "message_count = message_count + excluded.message_count, "
+                "token_total = token_total + excluded.token_total, "
+                "last_activity = CURRENT_TIMESTAMP"
+            ),
+            {
+                "session_id": session_id,
+                "count": len(messages),
+                "tokens": sum(count_tokens(msg.content) for msg in messages),
+            },
+        )
+        return message_ids
+
+    def list_session_ids(self) -> List[str]:
+        """Returns all session IDs, most recently active first."""
+        return [info["session_id"] for info in self.list_session_info()]
+
+    def list_session_info(self) -> List[Dict[str, Any]]:
+        """Returns catalog entries for all sessions, most recently active first."""
+        with self.connect() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT session_id, message_count, token_total, created_at, last_activity, archived "
+                    "FROM sessions ORDER BY last_activity DESC, session_id"
+                )
+            )
+            return [dict(row._mapping) for row in rows]
+
+    def get_session_info(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the catalog entry for a session, or None if it has no messages."""
+        with self.connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT session_id, message_count, token_total, created_at, last_activity, archived "
+                    "FROM sessions WHERE session_id = :session_id"
+                ),
+                {"session_id": session_id},
+            ).first()
+            return dict(row._mapping) if row else None
+
+    def get_messages(self, session_id: str) -> List[BaseMessage]:
+        """Returns every message in a session, oldest first."""
+        return [msg for _, msg in self.get_messages_after(session_id, 0)]
+
+    def get_message_page(
+        self, session_id: str, limit: int, before_id: Optional[int] = None
+    ) -> List[Tuple[int, BaseMessage]]:
+        """Returns up to `limit` messages older than `before_id` (or the latest ones).
+
+        Uses keyset pagination on the (session_id, id) index, so the cost
+        depends on the page size rather than on the session length.
+
+        Args:
+            session_id: Session to read from.
+            limit: Maximum number of messages to return.
+            before_id: Only return messages with an ID lower than this one.
+
+        Returns:
+            List of (message ID, message) tuples, oldest first.
+        """
+        query = "SELECT id, message FROM message_store WHERE session_id = :session_id"
+        params = {"session_id": session_id, "limit": limit}
+        if before_id is not None:
+            query += " AND id < :before_id"
+            params["before_id"] = before_id
+        query += " ORDER BY id DESC LIMIT :limit"
+
+        with self.connect() as conn:
+            archived_rows = self._get_archived_rows(conn, session_id)
+            if archived_rows is not None:
+                rows = [
+                    row for row in archived_rows if before_id is None or row[0] < before_id
+                ][-limit:]
+            else:
+                rows = conn.execute(text(query), params).fetchall()
+                rows.reverse()
+
+        return _decode_rows(rows)
+
+    def get_tail_messages(
+        self,
+        session_id: str,
+        max_messages: int,
+        max_tokens: Optional[int] = None,
+        before_id: Optional[int] = None,
+        page_size: int = 50,
+    ) -> List[Tuple[int, BaseMessage]]:
+        """Returns the newest messages of a session that fit a message and token budget.
+
+        Pages backwards from the newest message (or from `before_id`) and stops
+        as soon as either budget is reached, so only the tail is read and
+        deserialized. The result never starts with an AI message, to keep
+        question/answer pairs intact.
+
+        Args:
+            session_id: Session to read from.
+            max_messages: Maximum number of messages to return.
+            max_tokens: Optional token budget for the returned messages.
+            before_id: Only return messages with an ID lower than this one.
+            page_size: Number of messages read per query.
+
+        Returns:
+            List of (message ID, message) tuples, oldest first.
+        """
+        tail, used_tokens = [], 0
+        while len(tail) < max_messages:
+            page = self.get_message_page(
+                session_id, min(page_size, max_messages - len(tail)), before_id
+            )
+            if not page:
+                break
+            for message_id, msg in reversed(page):
+                tokens = count_tokens(msg.content)
+                if max_tokens is not None and used_tokens + tokens > max_tokens:
+                    page = None
+                    break
+                tail.append((message_id, msg))
+                used_tokens += tokens
+            if page is None:
+                break
+            before_id = page[0][0]
+
+        tail.reverse()
+        while tail and tail[0][1].type == "ai":
+            tail.pop(0)
+        return tail
+
+    def get_messages_after(
+        self, session_id: str, after_id: int = 0
+    ) -> List[Tuple[int, BaseMessage]]:
+        """Returns all messages of a session with an ID greater than `after_id`.
+
+        Returns:
+            List of (message ID, message) tuples, oldest first.
+        """
+        with self.connect() as conn:
+            archived_rows = self._get_archived_rows(conn, session_id)
+            if archived_rows is not None:
+                rows = [row for row in archived_rows if row[0] > after_id]
+            else:
+                rows = conn.execute(
+                    text(
+                        "SELECT id, message FROM message_store "
+                        "WHERE session_id = :session_id AND id > :after_id ORDER BY id"
+                    ),
+                    {"session_id": session_id, "after_id": after_id},
+                ).fetchall()
+        return _decode_rows(rows)
+
+    def save_checkpoint(self, session_id: str, upto_message_id: int, summary: str) -> None:
+        """Stores a summary of a session covering every message up to `upto_message_id`."""
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO session_checkpoints "
+                    "(session_id, upto_message_id, summary, token_count) "
+                    "VALUES (:session_id, :upto_message_id, :summary, :token_count)"
+                ),
+                {
+                    "session_id": session_id,
+                    "upto_message_id": upto_message_id,
+                    "summary": summary,
+                    "token_count": count_tokens(summary),
+                },
+            )
+
+    def get_latest_checkpoint(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the most recent summary checkpoint of a session, or None."""
+        with self.connect() as conn:
+            row = conn.execute(
+                text(
+                    "SELECT upto_message_id, summary, token_count, created_at "
+                    "FROM session_checkpoints WHERE session_id = :session_id "
+                    "ORDER BY upto_message_id DESC LIMIT 1"
+                ),
+                {"session_id": session_id},
+            ).first()
+            return dict(row._mapping) if row else None
+
+    def search_messages(
+        self, terms: str, limit: int = 10, session_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Full-text searches message content across sessions.
+
+        Each whitespace-separated term is matched as a quoted FTS5 token, so
+        user input cannot inject query syntax; all terms must match.
+
+        Args:
+            terms: Search terms.
+            limit: Maximum number of hits to return.
+            session_id: Optionally restrict the search to one session.
+
+        Returns:
+            Hits ordered by BM25 rank, each with the message ID, session ID,
+            message type and a highlighted snippet.
+        """
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+        if not match:
+            return []
+
+        query = (
+            "SELECT message_fts.rowid AS message_id, message_fts.session_id AS session_id, "
+            "json_extract(message_store.message, '$.type') AS type, "
+            "snippet(message_fts, 0, '[', ']', '...', 12) AS snippet, "
+            "bm25(message_fts) AS score "
+            "FROM message_fts JOIN message_store ON message_store.id = message_fts.rowid "
+            "WHERE message_fts MATCH :match"
+        )
+        params = {"match": match, "limit": limit}
+        if session_id is not None:
+            query += " AND message_fts.session_id = :session_id"
+            params["session_id"] = session_id
+        query += " ORDER BY score LIMIT :limit"
+
+        with self.connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(text(query), params)]
+
+    def count_messages(self, session_id: str) -> int:
+        """Returns the number of messages stored for a session."""
+        info = self.get_session_info(session_id)
+        return info["message_count"] if info else 0
+
+    def _get_archived_rows(
+        self, conn: Connection, session_id: str
+    ) -> Optional[List[Tuple[int, str]]]:
+        """Returns the (ID, message JSON) rows of an archived session, or None if it is not archived."""
+        row = conn.execute(
+            text("SELECT codec, payload FROM session_archive WHERE session_id = :session_id"),
+            {"session_id": session_id},
+        ).first()
+        if row is None:
+            return None
+        if row[0] != "zlib":
+            raise ValueError(f"Unsupported archive codec: {row[0]}")
+        return [tuple(item) for item in json.loads(zlib.decompress(row[1]))]
+
+    def _restore_session(self, conn: Connection, session_id: str) -> bool:
+        """Moves an archived session back into message_store using an open transaction.
+
+        Returns:
+            True if the session was archived and has been restored.
+        """
+        archived_rows = self._get_archived_rows(conn, session_id)
+        if archived_rows is None:
+            return False
+
+        conn.execute(
+            text(
+                "INSERT INTO message_store (id, session_id, message) "
+                "VALUES (:id, :session_id, :message)"
+            ),
+            [
+                {"id": message_id, "session_id": session_id, "message": message}
+                for message_id, message in archived_rows
+            ],
+        )
+        conn.execute(
+            text("DELETE FROM session_archive WHERE session_id = :session_id"),
+            {"session_id": session_id},
+        )
+        conn.execute(
+            text("UPDATE sessions SET archived = 0 WHERE session_id = :session_id"),
+            {"session_id": session_id},
+        )
+        return True
+
+    def restore_session(self, session_id: str) -> bool:
+        """Moves an archived session back into the hot message table.
+
+        Returns:
+            True if the session was archived and has been restored.
+        """
+        with self.engine.begin() as conn:
+            return self._restore_session(conn, session_id)
+
+    def compact_sessions(self, idle_days: float, vacuum: bool = True) -> Dict[str, int]:
+        """Archives sessions idle for more than `idle_days` and reclaims their space.
+
+        Each session's messages are packed into a single zlib-compressed blob
+        and removed from message_store in one write-locked transaction, which
+        first re-checks that the session is still idle.
+
+        Args:
+            idle_days: Minimum days since a session's last activity.
+            vacuum: Whether to VACUUM the database afterwards.
+
+        Returns:
+            Counts of archived sessions and messages, and the database size in
+            bytes (including the WAL file) before and after compaction.
+        """
+        size_before = self._database_size()
+        cutoff = f"-{idle_days} days"
+        with self.connect() as conn:
+            session_ids = [
+                row[0]
+                for row in conn.execute(
+                    text(
+                        "SELECT session_id FROM sessions WHERE archived = 0 "
+                        "AND last_activity < datetime('now', :cutoff)"
+                    ),
+                    {"cutoff": cutoff},
+                )
+            ]
+
+        archived_sessions = archived_messages = 0
+        for session_id in session_ids:
+            with _immediate_transaction(self.engine) as conn:
+                # The write lock is held from here on; skip sessions that became active since the scan
+                claimed = conn.execute(
+                    text(
+                        "UPDATE sessions SET archived = 1 WHERE session_id = :session_id "
+                        "AND archived = 0 AND last_activity < datetime('now', :cutoff)"
+                    ),
+                    {"session_id": session_id, "cutoff": cutoff},
+                ).rowcount
+                if not claimed:
+                    continue
+                rows = conn.execute(
+                    text(
+                        "SELECT id, message FROM message_store "
+                        "WHERE session_id = :session_id ORDER BY id"
+                    ),
+                    {"session_id": session_id},
+                ).fetchall()
+                payload = zlib.compress(
+                    json.dumps([list(row) for row in rows]).encode("utf-8"), 9
+                )
+                conn.execute(
+                    text(
+                        "INSERT INTO session_archive (session_id, codec, payload, message_count) "
+                        "VALUES (:session_id, 'zlib', :payload, :count)"
+                    ),
+                    {"session_id": session_id, "payload": payload, "count": len(rows)},
+                )
+                conn.execute(
+                    text("DELETE FROM message_store WHERE session_id = :session_id"),
+                    {"session_id": session_id},
+                )
+            archived_sessions += 1
+            archived_messages += len(rows)
+
+        if vacuum and archived_sessions:
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("VACUUM")
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        return {
+            "sessions": archived_sessions,
+            "messages": archived_messages,
+            "bytes_before": size_before,
+            "bytes_after": self._database_size(),
+        }
+
+    def _database_size(self) -> int:
+        """Returns the on-disk size of the database, including its write-ahead log."""
+        size = os.path.getsize(self.db_fpath)
+        wal_fpath = f"{self.db_fpath}-wal"
+        if os.path.exists(wal_fpath):
+            size += os.path.getsize(wal_fpath)
+        return size
+
+
+class WriteBehindWriter:
+    """Background writer that commits queued chat turns in batched transactions.
+
+    Turns are flushed when `batch_size` turns are pending, when
+    `flush_interval` seconds have passed since the oldest pending turn, on
+    `flush()`, and on `close()` (also registered to run at interpreter exit).
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, store: ChatStore, batch_size: int = 20, flush_interval: float = 1.0):
+        """Start the writer thread.
+
+        Args:
+            store: Store the turns are written to.
+            batch_size: Number of pending turns that triggers a flush.
+            flush_interval: Max seconds a turn waits before being flushed.
+        """
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="chat-write-behind", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, session_id: str, messages: Sequence[BaseMessage]) -> List[Future]:
+        """Queue messages for writing.
+
+        Returns:
+            One future per message, resolved with its database ID once committed.
+        """
+        if self._closed:
+            raise RuntimeError("WriteBehindWriter is closed")
+        futures = [Future() for _ in messages]
+        self._queue.put((session_id, list(messages), futures))
+        return futures
+
+    def flush(self) -> None:
+        """Block until every turn queued so far has been committed."""
+        if self._closed:
+            return
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done))
+        done.wait()
+
+    def close(self) -> None:
+        """Flush pending turns and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((self._STOP, None))
+        self._thread.join()
+
+    def _run(self) -> None:
+        pending, deadline = [], None
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if pending else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._commit(pending)
+                pending = []
+                continue
+
+            if item[0] is self._FLUSH or item[0] is self._STOP:
+                self._commit(pending)
+                pending = []
+                if item[0] is self._STOP:
+                    return
+                item[1].set()
+                continue
+
+            if not pending:
+                deadline = time.monotonic() + self.flush_interval
+            pending.append(item)
+            if len(pending) >= self.batch_size:
+                self._commit(pending)
+                pending = []
+
+    def _commit(self, pending: list) -> None:
+        """Write a batch of turns in a single transaction."""
+        if not pending:
+            return
+        try:
+            with self.store.engine.begin() as conn:
+                batch_ids = [
+                    self.store._append_messages(conn, session_id, messages)
+                    for session_id, messages, _ in pending
+                ]
+        except Exception as e:
+            print(f"Error writing {len(pending)} chat turns: {e}")
+            for _, _, futures in pending:
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        for (_, _, futures), message_ids in zip(pending, batch_ids):
+            for future, message_id in zip(futures, message_ids):
+                future.set_result(message_id)
+
+
+def _decode_rows(rows: Sequence[Tuple[int, str]]) -> List[Tuple[int, BaseMessage]]:
+    """Deserializes (ID, message JSON) rows into (ID, message) tuples."""
+    messages = messages_from_dict([json.loads(row[1]) for row in rows])
+    return [(row[0], msg) for row, msg in zip(rows, messages)]
+
+
+@lru_cache(maxsize=None)
+def get_chat_store(db_fpath: str = CHAT_HISTORY_DB_FPATH) -> ChatStore:
+    """Returns the process-wide ChatStore for a database file.
+
+    Args:
+        db_fpath: Path to the SQLite chat history database.
+
+    Returns:
+        The shared ChatStore instance.
+    """
+    return ChatStore(db_fpath)
@@ -0,0 +1,324 @@
+"""
+Shared embedding service over a Unix domain socket.
+
+One long-lived daemon (run_wk3_l4_embedding_server.py) holds the embedding
+model. Clients such as the ingest job, RAG workers and the retrieval memory
+strategy send texts over a local socket instead of loading torch and the
+model themselves. The daemon micro-batches concurrent requests: requests that
+arrive within `max_wait_ms` of each other are embedded together in one forward
+pass, up to `max_batch_size` texts.
+
+Wire format (both directions): an 8-byte header with the JSON length and the
+payload length (network byte order), then the JSON, then the payload.
+Requests are {"texts": [...]} with no payload. Responses are
+{"count": n, "dim": d} followed by n * d little-endian float32 values, or
+{"error": "..."}.
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import EMBEDDING_BATCH_TEXTS
+from paths import APP_CONFIG_FPATH, EMBEDDING_SOCKET_FPATH
+from utils import load_yaml_config
+
+FRAME_HEADER = struct.Struct("!II")
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+
+class EmbeddingServiceUnavailable(ConnectionError):
+    """The embedding daemon could not be reached."""
+
+
+class EmbeddingServiceError(RuntimeError):
+    """The embedding daemon failed to embed a request."""
+
+
+class EmbeddingServiceTimeout(EmbeddingServiceError):
+    """The embedding daemon did not answer within the client timeout.
+
+    The daemon is alive but busy, so callers should not load a model of their own.
+    """
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """Read exactly `size` bytes, raising ConnectionError if the peer closes first."""
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def send_frame(sock: socket.socket, header: Dict[str, Any], payload: bytes = b""):
+    """Send one frame: JSON header plus optional binary payload."""
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(data), len(payload)) + data + payload)
+
+
+def recv_frame(sock: socket.socket) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    """Receive one frame; returns None if the peer closed the connection between frames."""
+    first = sock.recv(FRAME_HEADER.size)
+    if not first:
+        return None
+    if len(first) < FRAME_HEADER.size:
+        first += _recv_exact(sock, FRAME_HEADER.size - len(first))
+    header_len, payload_len = FRAME_HEADER.unpack(first)
+    if header_len + payload_len > MAX_FRAME_BYTES:
+        raise ConnectionError(f"Frame of {header_len + payload_len} bytes exceeds the limit")
+    header = json.loads(_recv_exact(sock, header_len))
+    payload = _recv_exact(sock, payload_len) if payload_len else b""
+    return header, payload
+
+
+class MicroBatcher:
+    """Collects concurrent embedding requests into batched calls on one thread."""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+    ):
+        """Initialize the batcher and start its worker thread.
+
+        Args:
+            embed_fn: Embeds a list of texts in one call.
+            max_batch_size: Texts per call before a batch is sent without waiting.
+            max_wait_ms: How long the first request of a batch waits for others.
+        """
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """Queue texts for embedding; the future resolves to one vector per text."""
+        future = Future()
+        self._queue.put((texts, future))
+        return future
+
+    def close(self):
+        """Embed what is queued, then stop the worker thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, count = [item], len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                count += len(item[0])
+            self._embed_batch(batch)
+
+    def _embed_batch(self, batch: List[Tuple[List[str], Future]]):
+        # Texts requested by several clients are embedded once
+        unique = list(dict.fromkeys(text for texts, _ in batch for text in texts))
+        EMBEDDING_BATCH_TEXTS.observe(len(unique))
+        try:
+            vectors = dict(zip(unique, self.embed_fn(unique))) if unique else {}
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for texts, future in batch:
+            future.set_result([vectors[text] for text in texts])
+
+
+class _EmbeddingRequestHandler(socketserver.BaseRequestHandler):
+    """Serves embedding requests on one client connection until it closes."""
+
+    def handle(self):
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (ConnectionError, ValueError):
+                return
+            if frame is None:
+                return
+            header, _ = frame
+            texts = header.get("texts")
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                reply, payload = {"error": "Expected {'texts': [str, ...]}"}, b""
+            else:
+                try:
+                    vectors = self.server.batcher.submit(texts).result()
+                    block = np.asarray(vectors, dtype="<f4").reshape(len(texts), -1 if texts else 0)
+                    reply, payload = {"count": block.shape[0], "dim": block.shape[1]}, block.tobytes()
+                except Exception as e:
+                    reply, payload = {"error": f"{type(e).__name__}: {e}"}, b""
+            try:
+                send_frame(self.request, reply, payload)
+            except OSError:
+                # The client gave up (e.g. timed out) and closed the connection
+                return
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server answering embedding requests through a MicroBatcher."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+    ):
+        """Bind the socket, replacing a stale one left by a daemon that is no longer running.
+
+        Raises:
+            RuntimeError: If another daemon is already serving the socket.
+        """
+        if os.path.exists(socket_path):
+            if is_service_running(socket_path):
+                raise RuntimeError(f"An embedding service is already listening on {socket_path}")
+            os.unlink(socket_path)
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        self.socket_path = socket_path
+        self.batcher = MicroBatcher(embed_fn, max_batch_size, max_wait_ms)
+        super().__init__(socket_path, _EmbeddingRequestHandler)
+        # Only the current user may talk to the daemon
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class EmbeddingClient:
+    """Client of the embedding daemon, with one persistent connection per thread."""
+
+    def __init__(self, socket_path: str = EMBEDDING_SOCKET_FPATH, timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """Embed texts through the daemon.
+
+        Raises:
+            EmbeddingServiceUnavailable: If the daemon cannot be reached.
+            EmbeddingServiceTimeout: If the daemon did not answer within the timeout.
+            EmbeddingServiceError: If the daemon could not embed the texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        # A kept-alive connection may have been closed by a daemon restart; retry once on a fresh one
+        for attempt in range(2):
+            reused = getattr(self._local, "sock", None) is not None
+            try:
+                if not reused:
+                    self._local.sock = self._connect()
+                send_frame(self._local.sock, {"texts": texts})
+                frame = recv_frame(self._local.sock)
+                if frame is None:
+                    raise ConnectionError("Embedding service closed the connection")
+            except socket.timeout as e:
+                # The reply may still arrive on this connection, so it cannot be reused.
+                # Resending would only wait out the timeout again
+                self._close()
+                raise EmbeddingServiceTimeout(
+                    f"Embedding service at {self.socket_path} did not answer within {self.timeout}s"
+                ) from e
+            except OSError as e:
+                self._close()
+                if reused and attempt == 0 and isinstance(e, ConnectionError):
+                    continue
+                raise EmbeddingServiceUnavailable(
+                    f"Embedding service at {self.socket_path} is unavailable: {e}"
+                ) from e
+            break
+
+        header, payload = frame
+        if "error" in header:
+            raise EmbeddingServiceError(header["error"])
+        block = np.frombuffer(payload, dtype="<f4").reshape(header["count"], header["dim"])
+        return block.tolist()
+
+
+def is_service_running(socket_path: str = EMBEDDING_SOCKET_FPATH) -> bool:
+    """Returns True if a daemon accepts connections on the socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def get_service_config(app_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Returns the `embedding_service` section of the app config, with the socket path resolved."""
+    if app_config is None:
+        app_config = load_yaml_config(APP_CONFIG_FPATH)
+    config = dict(app_config.get("embedding_service", {}))
+    config["socket_path"] = config.get("socket_path") or EMBEDDING_SOCKET_FPATH
+    return config
+
+
+@lru_cache(maxsize=None)
+def get_embedding_client() -> Optional[EmbeddingClient]:
+    """Returns the process-wide client for the configured daemon, or None if it is disabled.
+
+    The config is read once. Whether the daemon is running is found out per
+    call: `embed` raises EmbeddingServiceUnavailable if the socket is gone.
+    """
+    config = get_service_config()
+    if not config.get("enabled", True):
+        return None
+    return EmbeddingClient(config["socket_path"], float(config.get("timeout_seconds", 30.0)))
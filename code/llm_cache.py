@@ -0,0 +1,135 @@
+"""
+Persistent exact-match cache for deterministic LLM responses.
+
+Responses are stored in SQLite, keyed by a hash of the model name, the
+temperature, any extra call arguments and the serialized messages. Only calls
+at temperature 0 are cached; sampled responses are meant to differ between
+calls. When the stored responses exceed the size limit, the least recently
+used ones are evicted.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from paths import LLM_CACHE_DB_FPATH
+
+
+def serialize_messages(messages) -> Any:
+    """Returns a JSON-serializable form of a prompt string or list of messages."""
+    if isinstance(messages, str):
+        return messages
+    return [message_to_dict(msg) if isinstance(msg, BaseMessage) else msg for msg in messages]
+
+
+def make_request_key(model: str, temperature: float, messages, kwargs: Dict[str, Any]) -> str:
+    """Returns a hash identifying an LLM call by model, temperature, arguments and messages."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "temperature": temperature,
+            "kwargs": kwargs,
+            "messages": serialize_messages(messages),
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LLM response cache with size-based LRU eviction."""
+
+    def __init__(self, db_fpath: str = LLM_CACHE_DB_FPATH, max_bytes: int = 100 * 1024 * 1024):
+        """Initialize the cache, creating its table if needed.
+
+        Args:
+            db_fpath: Path to the SQLite database.
+            max_bytes: Total size of stored responses before the least recently used are evicted.
+        """
+        os.makedirs(os.path.dirname(db_fpath), exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_fpath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses ("
+            "key TEXT PRIMARY KEY, "
+            "model TEXT NOT NULL, "
+            "response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_llm_responses_last_access "
+            "ON llm_responses (last_access)"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[BaseMessage]:
+        """Returns the cached response for a key, or None on a miss."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM llm_responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def put(self, key: str, model: str, response: BaseMessage):
+        """Stores a response, evicting the least recently used ones if over the size limit."""
+        data = json.dumps(message_to_dict(response))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_responses "
+                "(key, model, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, data, len(data), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Delete least recently used responses until the total size is within the limit."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        doomed, freed = [], 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM llm_responses ORDER BY last_access"
+        ):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM llm_responses WHERE key = ?", doomed)
+
+    def clear(self):
+        """Delete every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_responses")
+
+
+@lru_cache(maxsize=None)
+def get_response_cache(
+    db_fpath: str = LLM_CACHE_DB_FPATH, max_bytes: int = 100 * 1024 * 1024
+) -> ResponseCache:
+    """Returns the shared response cache for a database file."""
+    return ResponseCache(db_fpath, max_bytes)
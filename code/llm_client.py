@@ -0,0 +1,435 @@
+"""
+Shared, rate-limited access to the Groq chat models.
+
+Every LLM call in the lessons goes through a `ScheduledLLM`, which wraps the
+LangChain chat model with a per-model `CallScheduler`. The scheduler keeps
+token buckets for requests per minute and tokens per minute, serves the
+"interactive" lane before the "batch" lane, and retries rate-limited or
+transient failures with jittered exponential backoff that honors the server's
+Retry-After header. Deterministic calls can also be answered from the
+opt-in response cache in `llm_cache`, and identical concurrent calls are
+coalesced into one request.
+"""
+
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+import groq
+from langchain_groq import ChatGroq
+
+from llm_cache import ResponseCache, get_response_cache, make_request_key
+from metrics import (
+    LLM_COMPLETION_TOKENS,
+    LLM_LATENCY,
+    LLM_PROMPT_TOKENS,
+    LLM_PROMPT_TOKENS_PER_CALL,
+    LLM_REQUESTS,
+    LLM_RETRIES,
+)
+from paths import APP_CONFIG_FPATH
+from single_flight import SingleFlight
+from utils import count_tokens, load_yaml_config
+
+PRIORITIES = ("interactive", "batch")
+
+# Task types that can be routed to their own model in `model_routing`
+MODEL_TASKS = ("answer", "summarize", "checkpoint", "rerank")
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Temperatures at or below this are treated as 0 (greedy decoding), so responses can be cached
+DETERMINISTIC_TEMPERATURE = 1e-6
+
+# Identical concurrent calls across all wrappers in the process share one request
+_llm_flights = SingleFlight()
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity."""
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """Initialize a full bucket.
+
+        Args:
+            capacity: Maximum number of tokens the bucket holds.
+            refill_per_second: Tokens added per second.
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.level = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Returns the seconds until `amount` tokens are available (0 if they are now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.refill_per_second
+
+    def take(self, amount: float):
+        """Remove tokens; the level may go negative to record a debt."""
+        self.level -= min(amount, self.capacity)
+
+
+class CallScheduler:
+    """Admits LLM calls within rate limits and retries the ones that fail transiently."""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: int = 5,
+        backoff_base_seconds: float = 1.0,
+        backoff_max_seconds: float = 60.0,
+        name: str = "",
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            requests_per_minute: Request limit, or None for no limit.
+            tokens_per_minute: Token limit (prompt plus completion), or None for no limit.
+            max_retries: Retries after the first attempt before the error is raised.
+            backoff_base_seconds: Backoff ceiling for the first retry; doubles on each retry.
+            backoff_max_seconds: Upper bound on the backoff ceiling.
+            name: Model name used to label retry metrics.
+        """
+        self.request_bucket = (
+            TokenBucket(requests_per_minute, requests_per_minute / 60) if requests_per_minute else None
+        )
+        self.token_bucket = (
+            TokenBucket(tokens_per_minute, tokens_per_minute / 60) if tokens_per_minute else None
+        )
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.name = name
+        self._condition = threading.Condition()
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        self._paused_until = 0.0
+
+    def acquire(self, tokens: float, priority: str = "interactive"):
+        """Block until a call of `tokens` estimated tokens may start.
+
+        Batch callers wait while any interactive caller is waiting.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {PRIORITIES}")
+
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    if priority == "batch" and self._waiting["interactive"]:
+                        self._condition.wait()
+                        continue
+
+                    now = time.monotonic()
+                    wait = self._paused_until - now
+                    if self.request_bucket:
+                        wait = max(wait, self.request_bucket.wait_time(1, now))
+                    if self.token_bucket:
+                        wait = max(wait, self.token_bucket.wait_time(tokens, now))
+                    if wait <= 0:
+                        if self.request_bucket:
+                            self.request_bucket.take(1)
+                        if self.token_bucket:
+                            self.token_bucket.take(tokens)
+                        return
+                    self._condition.wait(wait)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+    def settle(self, estimated_tokens: float, actual_tokens: Optional[float]):
+        """Correct the token bucket once a call's actual usage is known."""
+        if self.token_bucket and actual_tokens is not None:
+            with self._condition:
+                self.token_bucket.take(actual_tokens - estimated_tokens)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Returns a full-jitter exponential backoff delay, never shorter than Retry-After."""
+        ceiling = min(self.backoff_max_seconds, self.backoff_base_seconds * 2**attempt)
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(self, fn: Callable[[], Any], tokens: float, priority: str = "interactive") -> Any:
+        """Run `fn` within the rate limits, retrying transient failures.
+
+        Args:
+            fn: The call to make.
+            tokens: Estimated tokens the call will use.
+            priority: "interactive" or "batch".
+
+        Returns:
+            The result of `fn`.
+
+        Raises:
+            Exception: The last error once retries are exhausted, or any non-retryable error.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens, priority)
+            try:
+                return fn()
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, get_retry_after(e))
+                attempt += 1
+                LLM_RETRIES.inc(model=self.name, reason="rate_limit" if is_rate_limit(e) else "transient")
+                if is_rate_limit(e):
+                    # The server says the whole budget is spent: pause every caller
+                    with self._condition:
+                        self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                        self._condition.notify_all()
+                else:
+                    time.sleep(delay)
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Returns True for HTTP 429 responses."""
+    return isinstance(error, groq.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    """Returns True for rate limiting, timeouts, connection errors and transient server errors."""
+    if isinstance(error, groq.APIConnectionError):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Returns the Retry-After delay in seconds from an API error, if the server sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages) -> int:
+    """Estimates the prompt tokens of a string or list of messages."""
+    if isinstance(messages, str):
+        return count_tokens(messages)
+    return sum(count_tokens(getattr(msg, "content", str(msg))) for msg in messages)
+
+
+class ScheduledLLM:
+    """Chat model wrapper that routes every `invoke` through a CallScheduler.
+
+    With a response cache, calls at temperature 0 are answered from the cache
+    when an identical call was made before, without using any rate limit.
+    Other attributes (e.g. `model_name`, `temperature`) are read from the
+    wrapped model.
+    """
+
+    def __init__(
+        self,
+        llm,
+        scheduler: CallScheduler,
+        priority: str = "interactive",
+        expected_output_tokens: int = 400,
+        cache: Optional[ResponseCache] = None,
+        coalesce: bool = True,
+    ):
+        """Initialize the wrapper.
+
+        Args:
+            llm: The LangChain chat model to call.
+            scheduler: Scheduler shared by every wrapper of the same model.
+            priority: Default lane for this wrapper's calls.
+            expected_output_tokens: Completion tokens reserved per call until actual usage is known.
+            cache: Optional response cache for deterministic calls.
+            coalesce: Whether identical concurrent calls share one request.
+        """
+        self.llm = llm
+        self.scheduler = scheduler
+        self.priority = priority
+        self.expected_output_tokens = expected_output_tokens
+        self.cache = cache
+        self.coalesce = coalesce
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    def with_priority(self, priority: str) -> "ScheduledLLM":
+        """Returns a wrapper of the same model and scheduler in another lane."""
+        return ScheduledLLM(
+            self.llm, self.scheduler, priority, self.expected_output_tokens, self.cache, self.coalesce
+        )
+
+    def invoke(self, messages, priority: Optional[str] = None, **kwargs):
+        """Invoke the model once the scheduler admits the call, or answer from the cache.
+
+        Unless coalescing is off, identical concurrent calls (same model,
+        temperature, arguments and messages) share a single request.
+        """
+        model_name = getattr(self.llm, "model_name", "")
+        temperature = getattr(self.llm, "temperature", None)
+        # ChatGroq stores a requested temperature of 0 as 1e-08, so compare with a tolerance
+        deterministic = temperature is not None and temperature <= DETERMINISTIC_TEMPERATURE
+        request_key = make_request_key(
+            model_name, 0.0 if deterministic else temperature, messages, kwargs
+        )
+
+        # Sampled responses (temperature > 0) are expected to vary, so they bypass the cache
+        use_cache = self.cache is not None and deterministic
+        if use_cache and (cached := self.cache.get(request_key)) is not None:
+            LLM_REQUESTS.inc(model=model_name, outcome="cache_hit")
+            return cached
+
+        led = False
+
+        def call():
+            nonlocal led
+            led = True
+            prompt_tokens = estimate_tokens(messages)
+            estimated = prompt_tokens + self.expected_output_tokens
+            response = self.scheduler.call(
+                lambda: self.llm.invoke(messages, **kwargs), estimated, priority or self.priority
+            )
+            usage = getattr(response, "usage_metadata", None) or {}
+            self.scheduler.settle(estimated, usage.get("total_tokens"))
+            if use_cache:
+                self.cache.put(request_key, model_name, response)
+
+            # Prefer the provider's usage report; fall back to local estimates
+            prompt_tokens = usage.get("input_tokens", prompt_tokens)
+            LLM_PROMPT_TOKENS.inc(prompt_tokens, model=model_name)
+            LLM_PROMPT_TOKENS_PER_CALL.observe(prompt_tokens, model=model_name)
+            LLM_COMPLETION_TOKENS.inc(
+                usage.get("output_tokens", count_tokens(str(response.content))), model=model_name
+            )
+            return response
+
+        try:
+            with LLM_LATENCY.time(model=model_name):
+                response = _llm_flights.do(request_key, call) if self.coalesce else call()
+        except Exception:
+            LLM_REQUESTS.inc(model=model_name, outcome="error")
+            raise
+        LLM_REQUESTS.inc(model=model_name, outcome="ok" if led else "coalesced")
+        # Each caller gets its own copy of a shared response
+        return response.model_copy() if hasattr(response, "model_copy") else response
+
+
+def get_rate_limit_config(app_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Returns the `llm_rate_limits` section of the app config."""
+    if app_config is None:
+        app_config = load_yaml_config(APP_CONFIG_FPATH)
+    return app_config.get("llm_rate_limits", {})
+
+
+def get_configured_cache(app_config: Optional[Dict[str, Any]] = None) -> Optional[ResponseCache]:
+    """Returns the shared response cache if `llm_cache.enabled` is set, otherwise None."""
+    if app_config is None:
+        app_config = load_yaml_config(APP_CONFIG_FPATH)
+    cache_config = app_config.get("llm_cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    return get_response_cache(
+        max_bytes=int(cache_config.get("max_size_mb", 100) * 1024 * 1024)
+    )
+
+
+@lru_cache(maxsize=None)
+def get_call_scheduler(model_name: str) -> CallScheduler:
+    """Returns the process-wide scheduler for a model (Groq limits are per model)."""
+    config = get_rate_limit_config()
+    return CallScheduler(
+        requests_per_minute=config.get("requests_per_minute"),
+        tokens_per_minute=config.get("tokens_per_minute"),
+        max_retries=config.get("max_retries", 5),
+        backoff_base_seconds=config.get("backoff_base_seconds", 1.0),
+        backoff_max_seconds=config.get("backoff_max_seconds", 60.0),
+        name=model_name,
+    )
+
+
+def create_llm(
+    model_name: str = "llama-3.1-8b-instant",
+    temperature: float = 0.7,
+    priority: str = "interactive",
+) -> ScheduledLLM:
+    """Creates a Groq chat model whose calls go through the shared scheduler.
+
+    Args:
+        model_name: Groq model name.
+        temperature: Sampling temperature.
+        priority: Default lane, "interactive" for user-facing calls or "batch" for bulk runs.
+
+    Returns:
+        The scheduled chat model.
+    """
+    # Retries are handled by the scheduler, so the client must not retry on its own
+    llm = ChatGroq(
+        model=model_name,
+        temperature=temperature,
+        api_key=os.getenv("GROQ_API_KEY"),
+        max_retries=0,
+    )
+    return ScheduledLLM(
+        llm,
+        get_call_scheduler(model_name),
+        priority=priority,
+        expected_output_tokens=get_rate_limit_config().get("expected_output_tokens", 400),
+        cache=get_configured_cache(),
+    )
+
+
+def get_model_route(task: str, app_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Returns the `model_routing` entry for a task, with `model` falling back to `llm`.
+
+    Args:
+        task: One of MODEL_TASKS.
+        app_config: App config; loaded from config.yaml if not given.
+
+    Returns:
+        Dictionary with `model` and any configured `temperature` and `priority`.
+    """
+    if task not in MODEL_TASKS:
+        raise ValueError(f"Unknown task: {task}. Expected one of {MODEL_TASKS}")
+    if app_config is None:
+        app_config = load_yaml_config(APP_CONFIG_FPATH)
+    route = dict(app_config.get("model_routing", {}).get(task) or {})
+    if not route.get("model"):
+        route["model"] = app_config.get("llm", "llama-3.1-8b-instant")
+    return route
+
+
+def get_llm(
+    task: str,
+    temperature: float = 0.7,
+    priority: str = "interactive",
+    app_config: Optional[Dict[str, Any]] = None,
+) -> ScheduledLLM:
+    """Creates the chat model routed to a task type.
+
+    Args:
+        task: One of MODEL_TASKS.
+        temperature: Temperature used unless the route sets one.
+        priority: Lane used unless the route sets one.
+        app_config: App config; loaded from config.yaml if not given.
+
+    Returns:
+        The scheduled chat model for the task.
+    """
+    route = get_model_route(task, app_config)
+    return create_llm(
+        route["model"],
+        temperature=route.get("temperature", temperature),
+        priority=route.get("priority", priority),
+    )
@@ -0,0 +1,62 @@
+"""
+Local stand-in for the Groq chat model, used for offline benchmarks and load tests.
+"""
+
+import time
+from typing import List
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+
+class LocalStandInLLM:
+    """Deterministic, network-free replacement for ChatGroq.
+
+    Exposes the same `invoke` call shape as the LangChain chat models used in
+    the lessons, so strategy and persistence code can be exercised without an
+    API key or rate limits.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "local-stand-in",
+        temperature: float = 0.0,
+        response_words: int = 120,
+        latency_seconds: float = 0.0,
+    ):
+        """Initialize the stand-in.
+
+        Args:
+            model_name: Name reported by the stand-in.
+            temperature: Reported sampling temperature (responses are always deterministic).
+            response_words: Approximate number of words in each response.
+            latency_seconds: Artificial delay added to every call to mimic network time.
+        """
+        self.model_name = model_name
+        self.temperature = temperature
+        self.response_words = response_words
+        self.latency_seconds = latency_seconds
+
+    def invoke(self, messages, **kwargs) -> AIMessage:
+        """Returns a canned response derived from the last user message.
+
+        Extra keyword arguments (such as a scheduler priority) are accepted and ignored.
+        """
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        if isinstance(messages, str):
+            question = messages
+        else:
+            question = _last_human_content(messages)
+
+        words = question.split() or ["response"]
+        body = " ".join(words[i % len(words)] for i in range(self.response_words))
+        return AIMessage(content=f"Answer about '{question[:60]}': {body}")
+
+
+def _last_human_content(messages: List[BaseMessage]) -> str:
+    """Returns the content of the last HumanMessage in a message list."""
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage):
+            return msg.content
+    return ""
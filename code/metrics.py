@@ -0,0 +1,330 @@
+"""
+Lightweight in-process metrics: counters and histograms with labels.
+
+LLM calls, embedding calls and vector DB queries record their latency, token
+counts, errors and cache hits in the process-wide `REGISTRY`. The registry can
+be served in the Prometheus text format from a local HTTP endpoint and/or
+dumped to a JSON file periodically (and once more at exit). Each script dumps
+to its own file, outputs/metrics_<script>.json; when several processes run the
+same script, the last writer wins.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from paths import METRICS_FPATH
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _label_key(label_names: Sequence[str], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    """Returns label values in declaration order, checking that all labels are given."""
+    if set(labels) != set(label_names):
+        raise ValueError(f"Expected labels {list(label_names)}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in label_names)
+
+
+def _format_labels(label_names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Formats Prometheus labels, e.g. {model="x",le="0.5"}."""
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Add `amount` to the counter for the given labels."""
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [{"labels": dict(zip(self.label_names, k)), "value": v} for k, v in items]
+
+
+class Histogram:
+    """Distribution of observed values per label set, in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [bucket counts..., +Inf count], sum
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Record one observation for the given labels."""
+        key = _label_key(self.label_names, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Context manager observing the wall-clock duration of its block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted((k, list(counts), total[0]) for k, (counts, total) in self._series.items())
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, counts, total in self._snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.label_names, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        series = []
+        for key, counts, total in self._snapshot():
+            count = sum(counts)
+            series.append({
+                "labels": dict(zip(self.label_names, key)),
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else 0.0,
+                "buckets": dict(zip([repr(b) for b in self.buckets] + ["+Inf"], counts)),
+            })
+        return series
+
+
+class MetricsRegistry:
+    """Named collection of metrics with Prometheus text and JSON views."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        """Returns the counter with this name, creating it on first use."""
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Returns the histogram with this name, creating it on first use."""
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def render_prometheus(self) -> str:
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns all metrics as a JSON-serializable dictionary."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            "timestamp": time.time(),
+            "metrics": {
+                m.name: {"type": m.kind, "help": m.help_text, "series": m.to_dict()} for m in metrics
+            },
+        }
+
+    def dump_json(self, fpath: Optional[str] = None):
+        """Write the metrics to a JSON file atomically (defaults to `get_metrics_fpath()`)."""
+        fpath = fpath or get_metrics_fpath()
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        # A unique temp name, so processes dumping to the same file don't collide
+        fd, tmp_fpath = tempfile.mkstemp(
+            dir=os.path.dirname(fpath), prefix=f"{os.path.basename(fpath)}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            os.replace(tmp_fpath, fpath)
+        except BaseException:
+            try:
+                os.unlink(tmp_fpath)
+            except FileNotFoundError:
+                pass
+            raise
+
+
+def get_metrics_fpath() -> str:
+    """Returns the metrics file of this process, named after the running script.
+
+    Falls back to METRICS_FPATH when there is no script (e.g. an interactive session).
+    """
+    script = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0]
+    if not script or script == "-c":
+        return METRICS_FPATH
+    base, ext = os.path.splitext(METRICS_FPATH)
+    return f"{base}_{script}{ext}"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests_total", "LLM invocations by outcome (ok, error, cache_hit, coalesced).", ["model", "outcome"]
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "llm_request_latency_seconds", "Latency of LLM invocations, including rate-limit waits and retries.", ["model"]
+)
+LLM_PROMPT_TOKENS = REGISTRY.counter("llm_prompt_tokens_total", "Prompt tokens sent to the LLM.", ["model"])
+LLM_COMPLETION_TOKENS = REGISTRY.counter(
+    "llm_completion_tokens_total", "Completion tokens returned by the LLM.", ["model"]
+)
+LLM_PROMPT_TOKENS_PER_CALL = REGISTRY.histogram(
+    "llm_prompt_tokens", "Prompt tokens per LLM call.", ["model"], buckets=TOKEN_BUCKETS
+)
+LLM_RETRIES = REGISTRY.counter("llm_retries_total", "LLM call retries by reason.", ["model", "reason"])
+
+EMBEDDING_REQUESTS = REGISTRY.counter("embedding_requests_total", "Embedding calls by outcome.", ["outcome"])
+EMBEDDING_TEXTS = REGISTRY.counter("embedding_texts_total", "Texts passed to embedding calls.")
+EMBEDDING_LATENCY = REGISTRY.histogram("embedding_latency_seconds", "Latency of embedding calls.")
+EMBEDDING_BATCH_TEXTS = REGISTRY.histogram(
+    "embedding_batch_texts",
+    "Texts per forward pass in the embedding service.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+VECTORDB_QUERIES = REGISTRY.counter("vectordb_queries_total", "Vector DB queries by outcome.", ["outcome"])
+VECTORDB_LATENCY = REGISTRY.histogram("vectordb_query_latency_seconds", "Latency of vector DB queries.")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry at /metrics (Prometheus text) and /metrics.json."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = REGISTRY.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps(REGISTRY.to_dict()).encode("utf-8"), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise be logged to stderr every few seconds
+        pass
+
+
+def start_http_exporter(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the metrics on http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def start_json_dumper(interval: float, fpath: Optional[str] = None) -> threading.Event:
+    """Dump the metrics to `fpath` every `interval` seconds and once at exit.
+
+    A failed dump is reported and retried at the next interval.
+
+    Args:
+        interval: Seconds between dumps.
+        fpath: Output file; defaults to `get_metrics_fpath()`.
+
+    Returns:
+        Event that stops the periodic dumps when set.
+    """
+    fpath = fpath or get_metrics_fpath()
+    stop = threading.Event()
+
+    def dump():
+        try:
+            REGISTRY.dump_json(fpath)
+        except Exception as e:
+            print(f"Could not dump metrics to {fpath}: {type(e).__name__}: {e}")
+
+    def run():
+        while not stop.wait(interval):
+            dump()
+
+    threading.Thread(target=run, name="metrics-json", daemon=True).start()
+    atexit.register(dump)
+    return stop
+
+
+def start_metrics_exporters(app_config: Optional[Dict[str, Any]] = None):
+    """Start the exporters enabled in the `metrics` section of the app config."""
+    metrics_config = (app_config or {}).get("metrics", {})
+    if port := metrics_config.get("prometheus_port"):
+        try:
+            start_http_exporter(port, metrics_config.get("prometheus_host", "127.0.0.1"))
+            print(f"📈 Metrics at http://{metrics_config.get('prometheus_host', '127.0.0.1')}:{port}/metrics")
+        except OSError as e:
+            print(f"Could not start metrics endpoint on port {port}: {e}")
+    if interval := metrics_config.get("json_dump_interval"):
+        start_json_dumper(interval)
@@ -18,4 +18,18 @@ PUBLICATION_FPATH = os.path.join(DATA_DIR, "publication.md")
 
 VECTOR_DB_DIR = os.path.join(OUTPUTS_DIR, "vector_db")
 
+VECTOR_SNAPSHOT_FPATH = os.path.join(OUTPUTS_DIR, "vector_db.snapshot")
+
+PUBLICATION_CACHE_DIR = os.path.join(OUTPUTS_DIR, "publication_cache")
+
+PUBLICATION_STORE_DIR = os.path.join(OUTPUTS_DIR, "publication_store")
+
 CHAT_HISTORY_DB_FPATH = os.path.join(OUTPUTS_DIR, "chat_history.db")
+
+LLM_CACHE_DB_FPATH = os.path.join(OUTPUTS_DIR, "llm_cache.db")
+
+METRICS_FPATH = os.path.join(OUTPUTS_DIR, "metrics.json")
+
+EMBEDDING_SOCKET_FPATH = os.path.join(OUTPUTS_DIR, "embedding.sock")
+
+PROFILES_DIR = os.path.join(OUTPUTS_DIR, "profiles")
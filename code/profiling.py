@@ -0,0 +1,265 @@
+"""
+Opt-in profiling for the run_wk3_* entry points.
+
+Every script's `main` runs through `run_main`. It turns on the profilers named
+by the `--profile` flag or, if the flag is absent, by the `WK3_PROFILE`
+environment variable. Several can be combined with commas:
+
+    cprofile     Deterministic profile of the main thread: a pstats dump plus a
+                 text summary sorted by cumulative time.
+    sample       Wall-clock sampling of every thread's stack: collapsed stacks
+                 (flame graph input) plus the hottest functions.
+    tracemalloc  The top allocation sites still alive at exit.
+
+Results are written to OUTPUTS_DIR/profiles/<script>_<timestamp>.* when the
+script exits, including on Ctrl+C or exit().
+
+Examples:
+    python run_wk3_l3a_memory_strategies.py --profile cprofile,tracemalloc
+    WK3_PROFILE=sample python run_wk3_l4_vector_db_rag.py
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from paths import PROFILES_DIR
+
+PROFILE_ENV_VAR = "WK3_PROFILE"
+PROFILERS = ("cprofile", "sample", "tracemalloc")
+
+# Seconds between stack samples, rows in the text summaries and frames kept per allocation
+SAMPLE_INTERVAL = float(os.getenv("WK3_PROFILE_INTERVAL", "0.005"))
+TOP_N = int(os.getenv("WK3_PROFILE_TOP", "30"))
+TRACEMALLOC_FRAMES = int(os.getenv("WK3_TRACEMALLOC_FRAMES", "5"))
+
+
+def parse_profile_args(argv: Sequence[str]) -> Tuple[List[str], List[str]]:
+    """Split `--profile MODES` / `--profile=MODES` out of the command line.
+
+    Args:
+        argv: Command-line arguments, without the program name.
+
+    Returns:
+        The requested profilers (falling back to WK3_PROFILE) and the remaining arguments.
+    """
+    value, remaining = None, []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--profile":
+            value = next(args, "")
+        elif arg.startswith("--profile="):
+            value = arg.split("=", 1)[1]
+        else:
+            remaining.append(arg)
+
+    if value is None:
+        value = os.getenv(PROFILE_ENV_VAR, "")
+    modes = [mode.strip().lower() for mode in value.split(",") if mode.strip()]
+    if "all" in modes:
+        modes = list(PROFILERS)
+    unknown = [mode for mode in modes if mode not in PROFILERS]
+    if unknown:
+        raise ValueError(f"Unknown profiler(s): {unknown}. Expected one of {PROFILERS} or 'all'")
+    return modes, remaining
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed wall-clock interval.
+
+    Waiting threads are sampled too, so time blocked on the network or locks
+    shows up alongside CPU time.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()  # (thread name, frames root first) -> samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[(names.get(thread_id, str(thread_id)), tuple(reversed(stack)))] += 1
+            self.samples += 1
+
+    def write(self, fpath_prefix: str) -> List[str]:
+        """Write collapsed stacks and a summary of the hottest functions; returns the files."""
+        collapsed_fpath = f"{fpath_prefix}.sample.collapsed"
+        with open(collapsed_fpath, "w", encoding="utf-8") as f:
+            for (thread_name, stack), count in self.stacks.most_common():
+                f.write(";".join((thread_name,) + stack) + f" {count}\n")
+
+        own, total = Counter(), Counter()
+        for (_, stack), count in self.stacks.items():
+            if stack:
+                own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+
+        lines = [
+            f"Samples: {self.samples} every {self.interval * 1000:.1f} ms "
+            f"({sum(self.stacks.values())} thread stacks)",
+            "",
+            f"Top {TOP_N} by own samples (function on top of the stack):",
+        ]
+        lines += [f"{count:8d}  {label}" for label, count in own.most_common(TOP_N)]
+        lines += ["", f"Top {TOP_N} by total samples (function anywhere on the stack):"]
+        lines += [f"{count:8d}  {label}" for label, count in total.most_common(TOP_N)]
+
+        summary_fpath = f"{fpath_prefix}.sample.txt"
+        with open(summary_fpath, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return [collapsed_fpath, summary_fpath]
+
+
+class ProfileSession:
+    """Runs the selected profilers between `start` and `stop`."""
+
+    def __init__(self, modes: Sequence[str], name: str, output_dir: str = PROFILES_DIR):
+        """Initialize the session.
+
+        Args:
+            modes: Profilers to run, from PROFILERS.
+            name: Script name used in the output file names.
+            output_dir: Directory for the profile files.
+        """
+        self.modes = list(modes)
+        self.fpath_prefix = os.path.join(
+            output_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        )
+        self.profile: Optional[cProfile.Profile] = None
+        self.sampler: Optional[SamplingProfiler] = None
+
+    def start(self):
+        if "tracemalloc" in self.modes and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if "sample" in self.modes:
+            self.sampler = SamplingProfiler()
+            self.sampler.start()
+        if "cprofile" in self.modes:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stop(self) -> List[str]:
+        """Stop the profilers and write their results; returns the files written."""
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+
+        os.makedirs(os.path.dirname(self.fpath_prefix), exist_ok=True)
+        written = []
+        # Snapshot first, before writing the other profiles allocates
+        if "tracemalloc" in self.modes:
+            written += self._write_tracemalloc()
+        if self.profile is not None:
+            written += self._write_cprofile()
+        if self.sampler is not None:
+            written += self.sampler.write(self.fpath_prefix)
+        return written
+
+    def _write_cprofile(self) -> List[str]:
+        prof_fpath = f"{self.fpath_prefix}.prof"
+        self.profile.dump_stats(prof_fpath)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=summary).strip_dirs()
+        stats.sort_stats("cumulative").print_stats(TOP_N)
+        stats.sort_stats("tottime").print_stats(TOP_N)
+        summary_fpath = f"{self.fpath_prefix}.cprofile.txt"
+        with open(summary_fpath, "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+        return [prof_fpath, summary_fpath]
+
+    def _write_tracemalloc(self) -> List[str]:
+        fpath = f"{self.fpath_prefix}.tracemalloc.txt"
+        if not tracemalloc.is_tracing():
+            lines = ["tracemalloc was stopped by the program before exit; no snapshot taken."]
+        else:
+            current, peak = tracemalloc.get_traced_memory()
+            # Leave out the profilers' own bookkeeping and the import machinery
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, path)
+                    for path in (
+                        __file__,
+                        tracemalloc.__file__,
+                        cProfile.__file__,
+                        "<frozen importlib._bootstrap>",
+                        "<frozen importlib._bootstrap_external>",
+                    )
+                ]
+            )
+            tracemalloc.stop()
+            lines = [
+                f"Traced memory at exit: {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB",
+                "",
+                f"Top {TOP_N} allocation sites still alive at exit:",
+            ]
+            lines += [str(stat) for stat in snapshot.statistics("lineno")[:TOP_N]]
+        with open(fpath, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return [fpath]
+
+
+def run_main(main: Callable[[], Any], argv: Optional[List[str]] = None) -> Any:
+    """Run a script's main under the profilers requested on the command line or in WK3_PROFILE.
+
+    The `--profile` argument is removed from sys.argv before `main` runs, so
+    scripts with their own argument parsing are unaffected.
+
+    Args:
+        main: The script's entry point.
+        argv: Arguments without the program name; defaults to sys.argv[1:].
+
+    Returns:
+        Whatever `main` returns.
+    """
+    modes, remaining = parse_profile_args(sys.argv[1:] if argv is None else argv)
+    if argv is None:
+        sys.argv[1:] = remaining
+    if not modes:
+        return main()
+
+    session = ProfileSession(modes, Path(sys.argv[0]).stem or "main")
+    print(f"⏱️  Profiling with {', '.join(modes)}")
+    session.start()
+    try:
+        return main()
+    finally:
+        written = session.stop()
+        print("✓ Profiles saved:")
+        for fpath in written:
+            print(f"  {fpath}")
@@ -2,7 +2,12 @@
 Prompt template construction functions for building modular prompts.
 """
 
-from typing import Union, List, Optional, Dict, Any
+import copy
+import hashlib
+import json
+from typing import Union, List, Optional, Dict, Any, Tuple
+
+from utils import count_tokens
 
 
 def lowercase_first_char(text: str) -> str:
@@ -34,82 +39,389 @@ def format_prompt_section(lead_in: str, value: Union[str, List[str]]) -> str:
     return f"{lead_in}\n{formatted_value}"
 
 
-def build_prompt_from_config(
+# Optional sections that a token budget may drop, in the order they are dropped
+OPTIONAL_SECTIONS = ("examples", "context", "reasoning_strategy", "goal", "style_or_tone")
+
+# Approximate token cost of the blank line joining two prompt parts
+SEPARATOR_TOKENS = 1
+
+
+class CompiledPrompt:
+    """A prompt config compiled into static text around one dynamic content slot.
+
+    Everything derived from the config is joined once at compile time, so
+    rendering only concatenates the prebuilt prefix, the content block and
+    the suffix. The named sections are kept so a token budget can drop
+    optional ones.
+    """
+
+    __slots__ = (
+        "prefix_sections",
+        "suffix_sections",
+        "prefix",
+        "suffix",
+        "content_header",
+        "content_footer",
+        "_section_tokens",
+        "_last_render",
+    )
+
+    def __init__(
+        self,
+        prefix_sections: List[Tuple[str, str]],
+        suffix_sections: List[Tuple[str, str]],
+        content_header: str,
+        content_footer: str,
+    ):
+        """Initialize the compiled prompt.
+
+        Args:
+            prefix_sections: (name, text) sections placed before the content block.
+            suffix_sections: (name, text) sections placed after the content block.
+            content_header: Text opening the content block.
+            content_footer: Text closing the content block.
+        """
+        self.prefix_sections = prefix_sections
+        self.suffix_sections = suffix_sections
+        self.prefix = "\n\n".join(text for _, text in prefix_sections)
+        self.suffix = "\n\n".join(text for _, text in suffix_sections)
+        self.content_header = content_header
+        self.content_footer = content_footer
+        self._section_tokens = None
+        self._last_render = (None, None)
+
+    def render(self, content: str = "") -> str:
+        """Renders the prompt around the given content.
+
+        Args:
+            content: Dynamic content for the prompt; omitted from the prompt if empty.
+
+        Returns:
+            The full prompt string.
+        """
+        # Repeated renders with the same content object (e.g. the publication
+        # on every turn) reuse the previous string instead of copying it again
+        last_content, last_prompt = self._last_render
+        if content is last_content:
+            return last_prompt
+
+        parts = [self.prefix]
+        if content:
+            parts.append(self.content_header + content.strip() + self.content_footer)
+        if self.suffix:
+            parts.append(self.suffix)
+        prompt = "\n\n".join(parts)
+        self._last_render = (content, prompt)
+        return prompt
+
+    def render_within_budget(
+        self, content: str, max_tokens: int
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Renders the prompt, trimming it to fit a token budget.
+
+        The content is trimmed first, keeping whole paragraphs from the start.
+        Optional sections are dropped (in `OPTIONAL_SECTIONS` order) only when
+        not even the first paragraph of the content would fit otherwise.
+
+        Args:
+            content: Dynamic content for the prompt.
+            max_tokens: Token budget for the whole prompt.
+
+        Returns:
+            Tuple of the prompt and a report of what was cut, with keys
+            `prompt_tokens`, `max_tokens`, `within_budget`, `dropped_sections`,
+            `content_tokens`, `content_tokens_removed` and
+            `content_paragraphs_removed`.
+        """
+        if self._section_tokens is None:
+            self._section_tokens = {
+                name: count_tokens(text) + SEPARATOR_TOKENS
+                for name, text in self.prefix_sections + self.suffix_sections
+            }
+
+        content = content.strip()
+        paragraphs = split_paragraphs(content)
+        paragraph_tokens = [count_tokens(p) + SEPARATOR_TOKENS for p in paragraphs]
+        wrapper_tokens = (
+            count_tokens(self.content_header + self.content_footer) + SEPARATOR_TOKENS
+            if content
+            else 0
+        )
+
+        names = [name for name, _ in self.prefix_sections + self.suffix_sections]
+        dropped = []
+        static_tokens = sum(self._section_tokens.values()) + wrapper_tokens
+
+        # Make room for at least the first paragraph by dropping optional sections
+        needed = paragraph_tokens[0] if paragraph_tokens else 0
+        for name in OPTIONAL_SECTIONS:
+            if static_tokens + needed <= max_tokens:
+                break
+            if name in names:
+                dropped.append(name)
+                static_tokens -= self._section_tokens[name]
+
+        # Keep whole paragraphs from the start while they fit
+        content_budget = max_tokens - static_tokens
+        kept, used = [], 0
+        for paragraph, tokens in zip(paragraphs, paragraph_tokens):
+            if used + tokens > content_budget:
+                break
+            kept.append(paragraph)
+            used += tokens
+        if not kept and paragraphs and content_budget > 0:
+            # The first paragraph alone is too long: cut it at a word boundary
+            kept = [truncate_to_tokens(paragraphs[0], content_budget - SEPARATOR_TOKENS)]
+        trimmed = "\n\n".join(kept)
+
+        parts = [text for name, text in self.prefix_sections if name not in dropped]
+        if trimmed:
+            parts.append(self.content_header + trimmed + self.content_footer)
+        parts.extend(text for name, text in self.suffix_sections if name not in dropped)
+        prompt = "\n\n".join(parts)
+
+        content_tokens = count_tokens(content) if content else 0
+        trimmed_tokens = count_tokens(trimmed) if trimmed else 0
+        prompt_tokens = count_tokens(prompt)
+        report = {
+            "prompt_tokens": prompt_tokens,
+            "max_tokens": max_tokens,
+            "within_budget": prompt_tokens <= max_tokens,
+            "dropped_sections": dropped,
+            "content_tokens": content_tokens,
+            "content_tokens_removed": content_tokens - trimmed_tokens,
+            "content_paragraphs_removed": len(paragraphs) - len(kept),
+        }
+        return prompt, report
+
+
+def split_paragraphs(text: str) -> List[str]:
+    """Splits text into paragraphs at blank lines.
+
+    Blank lines inside fenced code blocks do not split, so code stays whole.
+
+    Args:
+        text: Input text.
+
+    Returns:
+        List of non-empty paragraphs.
+    """
+    paragraphs, lines, in_code_block = [], [], False
+    for line in text.splitlines():
+        if line.strip().startswith("```"):
+            in_code_block = not in_code_block
+        if not line.strip() and not in_code_block:
+            if lines:
+                paragraphs.append("\n".join(lines))
+                lines = []
+            continue
+        lines.append(line)
+    if lines:
+        paragraphs.append("\n".join(lines))
+    return paragraphs
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Truncates text at a word boundary so it fits within a token budget.
+
+    Args:
+        text: Input text.
+        max_tokens: Token budget.
+
+    Returns:
+        The longest word prefix of `text` within the budget.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+
+_compiled_prompts: Dict[str, CompiledPrompt] = {}
+# Hot-path lookup by config object: id -> (snapshot of the config, cache key inputs, compiled)
+_compiled_by_id: Dict[int, Tuple[Any, Any, CompiledPrompt]] = {}
+
+
+def _config_hash(*parts: Any) -> str:
+    """Returns a stable hash of JSON-serializable config values."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _get_compiled(config: Dict[str, Any], kind: str, extra: Any) -> Optional[CompiledPrompt]:
+    """Looks up a compiled prompt, checking the config object before hashing it."""
+    entry = _compiled_by_id.get(id(config))
+    # The snapshot comparison guards against mutated configs and reused ids
+    if entry is not None and entry[1] == (kind, extra) and entry[0] == config:
+        return entry[2]
+
+    compiled = _compiled_prompts.get(_config_hash(kind, config, extra))
+    if compiled is not None:
+        _compiled_by_id[id(config)] = (copy.deepcopy(config), (kind, extra), compiled)
+    return compiled
+
+
+def _store_compiled(
+    config: Dict[str, Any], kind: str, extra: Any, compiled: CompiledPrompt
+) -> CompiledPrompt:
+    """Caches a compiled prompt by config hash and by config object."""
+    _compiled_prompts[_config_hash(kind, config, extra)] = compiled
+    _compiled_by_id[id(config)] = (copy.deepcopy(config), (kind, extra), compiled)
+    return compiled
+
+
+def compile_prompt(
     config: Dict[str, Any],
-    input_data: str = "",
     app_config: Optional[Dict[str, Any]] = None,
-) -> str:
-    """Builds a complete prompt string based on a config dictionary.
+) -> CompiledPrompt:
+    """Compiles a task prompt config, reusing a cached template for identical configs.
 
     Args:
         config: Dictionary specifying prompt components.
-        input_data: Content to be summarized or processed.
         app_config: Optional app-wide configuration (e.g., reasoning strategies).
 
     Returns:
-        A fully constructed prompt as a string.
+        The compiled prompt; render it with the content to process.
 
     Raises:
         ValueError: If the required 'instruction' field is missing.
     """
+    # Only the selected reasoning strategy affects the prompt, not the whole app config
+    strategy_text = None
+    reasoning_strategy = config.get("reasoning_strategy")
+    if reasoning_strategy and reasoning_strategy != "None" and app_config:
+        strategy_text = app_config.get("reasoning_strategies", {}).get(reasoning_strategy)
+
+    if compiled := _get_compiled(config, "prompt", strategy_text):
+        return compiled
+
     prompt_parts = []
 
     if role := config.get("role"):
-        prompt_parts.append(f"You are {lowercase_first_char(role.strip())}.")
+        prompt_parts.append(("role", f"You are {lowercase_first_char(role.strip())}."))
 
     instruction = config.get("instruction")
     if not instruction:
         raise ValueError("Missing required field: 'instruction'")
-    prompt_parts.append(format_prompt_section("Your task is as follows:", instruction))
+    prompt_parts.append(
+        ("instruction", format_prompt_section("Your task is as follows:", instruction))
+    )
 
     if context := config.get("context"):
-        prompt_parts.append(f"Here’s some background that may help you:\n{context}")
+        prompt_parts.append(("context", f"Here’s some background that may help you:\n{context}"))
 
     if constraints := config.get("output_constraints"):
-        prompt_parts.append(
+        prompt_parts.append((
+            "output_constraints",
             format_prompt_section(
                 "Ensure your response follows these rules:", constraints
-            )
-        )
+            ),
+        ))
 
     if tone := config.get("style_or_tone"):
-        prompt_parts.append(
+        prompt_parts.append((
+            "style_or_tone",
             format_prompt_section(
                 "Follow these style and tone guidelines in your response:", tone
-            )
-        )
+            ),
+        ))
 
     if format_ := config.get("output_format"):
-        prompt_parts.append(
-            format_prompt_section("Structure your response as follows:", format_)
-        )
+        prompt_parts.append((
+            "output_format",
+            format_prompt_section("Structure your response as follows:", format_),
+        ))
 
     if examples := config.get("examples"):
-        prompt_parts.append("Here are some examples to guide your response:")
+        example_parts = ["Here are some examples to guide your response:"]
         if isinstance(examples, list):
             for i, example in enumerate(examples, 1):
-                prompt_parts.append(f"Example {i}:\n{example}")
+                example_parts.append(f"Example {i}:\n{example}")
         else:
-            prompt_parts.append(str(examples))
+            example_parts.append(str(examples))
+        prompt_parts.append(("examples", "\n\n".join(example_parts)))
 
     if goal := config.get("goal"):
-        prompt_parts.append(f"Your goal is to achieve the following outcome:\n{goal}")
+        prompt_parts.append(("goal", f"Your goal is to achieve the following outcome:\n{goal}"))
 
-    if input_data:
-        prompt_parts.append(
+    suffix_parts = []
+    if strategy_text:
+        suffix_parts.append(("reasoning_strategy", strategy_text.strip()))
+    suffix_parts.append(("closing", "Now perform the task as instructed above."))
+
+    compiled = CompiledPrompt(
+        prefix_sections=prompt_parts,
+        suffix_sections=suffix_parts,
+        content_header=(
             "Here is the content you need to work with:\n"
             "<<<BEGIN CONTENT>>>\n"
-            "```\n" + input_data.strip() + "\n```\n<<<END CONTENT>>>"
-        )
+            "```\n"
+        ),
+        content_footer="\n```\n<<<END CONTENT>>>",
+    )
+    return _store_compiled(config, "prompt", strategy_text, compiled)
 
-    reasoning_strategy = config.get("reasoning_strategy")
-    if reasoning_strategy and reasoning_strategy != "None" and app_config:
-        strategies = app_config.get("reasoning_strategies", {})
-        if strategy_text := strategies.get(reasoning_strategy):
-            prompt_parts.append(strategy_text.strip())
 
-    prompt_parts.append("Now perform the task as instructed above.")
-    return "\n\n".join(prompt_parts)
+def build_prompt_from_config(
+    config: Dict[str, Any],
+    input_data: str = "",
+    app_config: Optional[Dict[str, Any]] = None,
+    max_tokens: Optional[int] = None,
+) -> str:
+    """Builds a complete prompt string based on a config dictionary.
+
+    Args:
+        config: Dictionary specifying prompt components.
+        input_data: Content to be summarized or processed.
+        app_config: Optional app-wide configuration (e.g., reasoning strategies).
+        max_tokens: Optional token budget for the prompt; see `build_prompt_with_budget`.
+
+    Returns:
+        A fully constructed prompt as a string.
+
+    Raises:
+        ValueError: If the required 'instruction' field is missing.
+    """
+    if max_tokens is not None:
+        return build_prompt_with_budget(config, input_data, max_tokens, app_config)[0]
+    return compile_prompt(config, app_config).render(input_data)
+
+
+def build_prompt_with_budget(
+    config: Dict[str, Any],
+    input_data: str,
+    max_tokens: int,
+    app_config: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Dict[str, Any]]:
+    """Builds a prompt that fits a token budget and reports what was cut.
+
+    The input data is trimmed first, dropping whole paragraphs from the end,
+    so callers should order it most important first. Optional sections
+    (examples, context, reasoning strategy, goal, style) are dropped only when
+    not even the first paragraph of the input would fit otherwise.
+
+    Args:
+        config: Dictionary specifying prompt components.
+        input_data: Content to be summarized or processed.
+        max_tokens: Token budget for the whole prompt.
+        app_config: Optional app-wide configuration (e.g., reasoning strategies).
+
+    Returns:
+        Tuple of the prompt and a report dictionary (see
+        `CompiledPrompt.render_within_budget`).
+
+    Raises:
+        ValueError: If the required 'instruction' field is missing.
+    """
+    return compile_prompt(config, app_config).render_within_budget(input_data, max_tokens)
 
 
 def print_prompt_preview(prompt: str, max_length: int = 500) -> None:
@@ -130,63 +442,84 @@ def print_prompt_preview(prompt: str, max_length: int = 500) -> None:
     print("=" * 60)
 
 
-def build_system_prompt_from_config(
-    config: Dict[str, Any],
-    publication_content: str = "",
-) -> str:
-    """Builds a system prompt string based on a config dictionary.
+def compile_system_prompt(config: Dict[str, Any]) -> CompiledPrompt:
+    """Compiles a system prompt config, reusing a cached template for identical configs.
 
     Args:
         config: Dictionary specifying system prompt components.
-        publication_content: The publication content to include in the system prompt.
 
     Returns:
-        A fully constructed system prompt as a string.
+        The compiled prompt; render it with the publication content.
 
     Raises:
         ValueError: If the required 'role' field is missing.
     """
+    if compiled := _get_compiled(config, "system", None):
+        return compiled
+
     prompt_parts = []
 
     # Role is required for system prompts
     role = config.get("role")
     if not role:
         raise ValueError("Missing required field: 'role'")
-    prompt_parts.append(f"You are {lowercase_first_char(role.strip())}.")
+    prompt_parts.append(("role", f"You are {lowercase_first_char(role.strip())}."))
 
     # Add behavioral constraints
     if constraints := config.get("output_constraints"):
-        prompt_parts.append(
+        prompt_parts.append((
+            "output_constraints",
             format_prompt_section(
                 "Follow these important guidelines:", constraints
-            )
-        )
+            ),
+        ))
 
     # Add style and tone guidelines
     if tone := config.get("style_or_tone"):
-        prompt_parts.append(
+        prompt_parts.append((
+            "style_or_tone",
             format_prompt_section(
                 "Communication style:", tone
-            )
-        )
+            ),
+        ))
 
     # Add output format requirements
     if format_ := config.get("output_format"):
-        prompt_parts.append(
-            format_prompt_section("Response formatting:", format_)
-        )
+        prompt_parts.append((
+            "output_format",
+            format_prompt_section("Response formatting:", format_),
+        ))
 
     # Add goal if specified
     if goal := config.get("goal"):
-        prompt_parts.append(f"Your primary objective: {goal}")
+        prompt_parts.append(("goal", f"Your primary objective: {goal}"))
 
-    # Include publication content if provided
-    if publication_content:
-        prompt_parts.append(
+    compiled = CompiledPrompt(
+        prefix_sections=prompt_parts,
+        suffix_sections=[],
+        content_header=(
             "Base your responses on this publication content:\n\n"
             "=== PUBLICATION CONTENT ===\n"
-            f"{publication_content.strip()}\n"
-            "=== END PUBLICATION CONTENT ==="
-        )
+        ),
+        content_footer="\n=== END PUBLICATION CONTENT ===",
+    )
+    return _store_compiled(config, "system", None, compiled)
+
 
-    return "\n\n".join(prompt_parts)
\ No newline at end of file
+def build_system_prompt_from_config(
+    config: Dict[str, Any],
+    publication_content: str = "",
+) -> str:
+    """Builds a system prompt string based on a config dictionary.
+
+    Args:
+        config: Dictionary specifying system prompt components.
+        publication_content: The publication content to include in the system prompt.
+
+    Returns:
+        A fully constructed system prompt as a string.
+
+    Raises:
+        ValueError: If the required 'role' field is missing.
+    """
+    return compile_system_prompt(config).render(publication_content)
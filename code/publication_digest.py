@@ -0,0 +1,291 @@
+"""
+Disk-cached publication digests for compact, turn-relevant system prompt context.
+
+A digest holds an extractive summary of the publication plus its markdown
+sections. Instead of sending the whole publication on every turn, callers send
+the summary and the sections most relevant to the current question, under a
+token budget.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from paths import PUBLICATION_CACHE_DIR
+from utils import count_tokens
+
+# Bump when the digest format or extraction logic changes to invalidate old caches
+DIGEST_VERSION = 1
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does",
+    "for", "from", "how", "i", "if", "in", "into", "is", "it", "its", "me", "of",
+    "on", "or", "so", "such", "that", "the", "their", "them", "there", "these",
+    "they", "this", "to", "was", "we", "what", "when", "which", "who", "why",
+    "will", "with", "you", "your",
+}
+
+_digest_memo: Dict[str, Dict[str, Any]] = {}
+_digest_memo_lock = threading.Lock()
+
+
+def tokenize_terms(text: str) -> List[str]:
+    """Splits text into lowercase content terms, dropping stopwords.
+
+    Args:
+        text: Input text.
+
+    Returns:
+        List of terms in order of appearance.
+    """
+    return [
+        term
+        for term in re.findall(r"[a-z0-9]+", text.lower())
+        if term not in STOPWORDS and len(term) > 1
+    ]
+
+
+def split_into_sections(publication_content: str) -> List[Dict[str, Any]]:
+    """Splits a markdown publication into sections at its headings.
+
+    Headings inside fenced code blocks are ignored.
+
+    Args:
+        publication_content: The publication markdown.
+
+    Returns:
+        List of sections, each with a title, text and token count.
+    """
+    sections = []
+    title, lines, in_code_block = "Preamble", [], False
+
+    def flush():
+        text = "\n".join(lines).strip()
+        if text:
+            sections.append(
+                {"title": title, "text": text, "tokens": count_tokens(text)}
+            )
+
+    for line in publication_content.splitlines():
+        if line.strip().startswith("```"):
+            in_code_block = not in_code_block
+        if not in_code_block and re.match(r"^#{1,6}\s", line):
+            flush()
+            title, lines = line.lstrip("#").strip(), []
+        lines.append(line)
+    flush()
+    return sections
+
+
+def extract_summary(sections: List[Dict[str, Any]], max_tokens: int) -> str:
+    """Builds an extractive summary from the highest-scoring sentences.
+
+    Sentences are scored by the average corpus frequency of their terms and
+    returned in their original order until the token budget is used.
+
+    Args:
+        sections: Publication sections from `split_into_sections`.
+        max_tokens: Token budget for the summary.
+
+    Returns:
+        The summary text.
+    """
+    sentences = []
+    for section in sections:
+        prose = re.sub(r"```.*?```", " ", section["text"], flags=re.DOTALL)
+        for line in prose.splitlines():
+            # Skip headings, tables, images and other non-prose lines
+            line = line.lstrip(" -*")
+            if not line.strip() or line.startswith(("#", "|", "!", "<", "$$")):
+                continue
+            sentences.extend(
+                s.strip() for s in re.split(r"(?<=[.!?])\s+", line) if len(s.split()) >= 6
+            )
+
+    term_freq = Counter(term for s in sentences for term in tokenize_terms(s))
+    scored = []
+    for position, sentence in enumerate(sentences):
+        terms = tokenize_terms(sentence)
+        if terms:
+            scored.append((sum(term_freq[t] for t in terms) / len(terms), position))
+
+    selected, used_tokens = [], 0
+    for _, position in sorted(scored, reverse=True):
+        sentence_tokens = count_tokens(sentences[position])
+        if used_tokens + sentence_tokens > max_tokens:
+            continue
+        selected.append(position)
+        used_tokens += sentence_tokens
+
+    return " ".join(sentences[position] for position in sorted(selected))
+
+
+def get_publication_hash(publication_content: str) -> str:
+    """Returns the SHA-256 hex digest of the publication content."""
+    return hashlib.sha256(publication_content.encode("utf-8")).hexdigest()
+
+
+def load_publication_digest(
+    publication_content: str,
+    summary_tokens: int = 400,
+    cache_dir: str = PUBLICATION_CACHE_DIR,
+) -> Dict[str, Any]:
+    """Loads the digest for a publication, building and caching it on first use.
+
+    Digests are cached in memory and on disk, keyed by the publication hash,
+    the summary budget and the digest version.
+
+    Args:
+        publication_content: The publication markdown.
+        summary_tokens: Token budget for the extractive summary.
+        cache_dir: Directory holding cached digests.
+
+    Returns:
+        Dictionary with the publication hash, summary and sections.
+    """
+    cache_key = f"{get_publication_hash(publication_content)}_v{DIGEST_VERSION}_s{summary_tokens}"
+    with _digest_memo_lock:
+        if cache_key in _digest_memo:
+            return _digest_memo[cache_key]
+
+    cache_fpath = os.path.join(cache_dir, f"{cache_key}.json")
+    if os.path.exists(cache_fpath):
+        with open(cache_fpath, "r", encoding="utf-8") as f:
+            digest = json.load(f)
+    else:
+        sections = split_into_sections(publication_content)
+        digest = {
+            "publication_hash": get_publication_hash(publication_content),
+            "summary": extract_summary(sections, summary_tokens),
+            "sections": sections,
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+        # A unique temp name, so concurrent writers never publish each other's partial files
+        fd, tmp_fpath = tempfile.mkstemp(dir=cache_dir, prefix=f"{cache_key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(digest, f)
+            os.replace(tmp_fpath, cache_fpath)
+        except BaseException:
+            try:
+                os.unlink(tmp_fpath)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # Derived fields used for ranking are kept in memory only
+    digest["summary_tokens"] = count_tokens(digest["summary"])
+    digest["section_terms"] = [
+        Counter(tokenize_terms(s["title"] + "\n" + s["text"])) for s in digest["sections"]
+    ]
+    # Threads that built the same digest concurrently all return the first one stored
+    with _digest_memo_lock:
+        return _digest_memo.setdefault(cache_key, digest)
+
+
+def rank_sections(digest: Dict[str, Any], query: str) -> List[int]:
+    """Ranks digest sections by BM25 relevance to a query.
+
+    Args:
+        digest: Publication digest from `load_publication_digest`.
+        query: The current user question.
+
+    Returns:
+        Section indices with a positive score, most relevant first.
+    """
+    query_terms = set(tokenize_terms(query))
+    if not query_terms:
+        return []
+
+    section_terms = digest["section_terms"]
+    avg_len = sum(sum(t.values()) for t in section_terms) / max(len(section_terms), 1)
+    k1, b = 1.5, 0.75
+
+    scores = []
+    for idx, terms in enumerate(section_terms):
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            doc_freq = sum(1 for t in section_terms if term in t)
+            if not terms[term]:
+                continue
+            idf = math.log(1 + (len(section_terms) - doc_freq + 0.5) / (doc_freq + 0.5))
+            tf = terms[term]
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / (avg_len or 1)))
+        if score > 0:
+            scores.append((score, idx))
+
+    return [idx for _, idx in sorted(scores, reverse=True)]
+
+
+def build_publication_context(
+    digest: Dict[str, Any], query: str = "", token_budget: int = 1500
+) -> str:
+    """Builds compact publication context for one turn.
+
+    The summary is always included; the most relevant sections are added in
+    document order while they fit within the remaining budget.
+
+    Args:
+        digest: Publication digest from `load_publication_digest`.
+        query: The current user question.
+        token_budget: Total token budget for the context.
+
+    Returns:
+        The publication context text.
+    """
+    remaining = token_budget - digest["summary_tokens"]
+    selected = []
+    for idx in rank_sections(digest, query):
+        section = digest["sections"][idx]
+        if section["tokens"] <= remaining:
+            selected.append(idx)
+            remaining -= section["tokens"]
+
+    parts = [f"Publication summary:\n{digest['summary']}"]
+    if selected:
+        parts.append("Sections relevant to the current question:")
+        parts.extend(digest["sections"][idx]["text"] for idx in sorted(selected))
+    return "\n\n".join(parts)
+
+
+def is_digest_mode(app_config: Optional[Dict[str, Any]] = None) -> bool:
+    """Returns True if the app config selects per-turn digest publication context."""
+    return (app_config or {}).get("publication_context", {}).get("mode", "full") == "digest"
+
+
+def get_publication_context(
+    publication_content: str,
+    app_config: Optional[Dict[str, Any]] = None,
+    query: str = "",
+) -> str:
+    """Returns the publication context to place in a system prompt.
+
+    In "full" mode (the default) this is the publication itself; in "digest"
+    mode it is the cached summary plus the sections relevant to `query`.
+
+    Args:
+        publication_content: The publication markdown.
+        app_config: App configuration with an optional `publication_context` section.
+        query: The current user question.
+
+    Returns:
+        The publication context text.
+    """
+    if not is_digest_mode(app_config):
+        return publication_content
+
+    context_config = app_config["publication_context"]
+
+    digest = load_publication_digest(
+        publication_content, summary_tokens=context_config.get("summary_tokens", 400)
+    )
+    return build_publication_context(
+        digest, query=query, token_budget=context_config.get("token_budget", 1500)
+    )
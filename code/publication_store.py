@@ -0,0 +1,258 @@
+"""
+Memory-mapped publication store for fast random access to the corpus.
+
+All publication markdown files in a data directory are packed into one UTF-8
+file (`corpus.bin`) plus a JSON index mapping each publication ID to its byte
+offset and length. The corpus is memory-mapped, so publications and
+character spans are sliced out of the page cache without re-reading files.
+
+The index also records a byte offset every `CHECKPOINT_CHARS` characters, so a
+character span only decodes the blocks it touches. The store is rebuilt
+automatically when a source file is added, removed or modified.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from paths import DATA_DIR, PUBLICATION_STORE_DIR
+
+# Bump when the pack format changes to force a rebuild
+STORE_VERSION = 1
+
+# Characters between byte-offset checkpoints in the index
+CHECKPOINT_CHARS = 4096
+
+
+def _scan_sources(data_dir: str) -> Dict[str, Tuple[int, int]]:
+    """Returns {publication ID: (mtime, size)} for the markdown files in a directory."""
+    sources = {}
+    for entry in os.scandir(data_dir):
+        if entry.name.endswith(".md") and entry.is_file():
+            stat = entry.stat()
+            sources[entry.name[: -len(".md")]] = (stat.st_mtime_ns, stat.st_size)
+    return sources
+
+
+def _char_checkpoints(text: str) -> List[int]:
+    """Returns the UTF-8 byte offset of every `CHECKPOINT_CHARS`-th character."""
+    checkpoints, byte_offset = [0], 0
+    for start in range(0, len(text), CHECKPOINT_CHARS):
+        byte_offset += len(text[start : start + CHECKPOINT_CHARS].encode("utf-8"))
+        checkpoints.append(byte_offset)
+    return checkpoints
+
+
+class PublicationStore:
+    """Packed, memory-mapped view of the publications in a data directory."""
+
+    def __init__(self, data_dir: str = DATA_DIR, store_dir: str = PUBLICATION_STORE_DIR):
+        """Initialize the store, building the pack if it is missing or stale.
+
+        Args:
+            data_dir: Directory holding the publication markdown files.
+            store_dir: Directory holding the packed corpus and its index.
+        """
+        self.data_dir = data_dir
+        self.store_dir = store_dir
+        self.corpus_fpath = os.path.join(store_dir, "corpus.bin")
+        self.index_fpath = os.path.join(store_dir, "index.json")
+        # Guards the index and mapping; reads hold it so a rebuild never closes the map under them
+        self._lock = threading.RLock()
+        self._mmap: Optional[mmap.mmap] = None
+        self._index: Dict = {}
+        self.refresh()
+
+    def refresh(self, sources: Optional[Dict[str, Tuple[int, int]]] = None) -> bool:
+        """Rebuild the pack if the source files changed since it was built.
+
+        Returns:
+            True if the pack was rebuilt.
+        """
+        if sources is None:
+            sources = _scan_sources(self.data_dir)
+        with self._lock:
+            if not self._index:
+                self._open()
+            if self._is_current(sources):
+                return False
+            self._build(sources)
+            self._open()
+            return True
+
+    def _is_current(self, sources: Dict[str, Tuple[int, int]]) -> bool:
+        """Returns True if the loaded index matches the given source files."""
+        return (
+            self._index.get("version") == STORE_VERSION
+            and self._index.get("data_dir") == os.path.abspath(self.data_dir)
+            and {k: tuple(v) for k, v in self._index.get("sources", {}).items()} == sources
+        )
+
+    def _build(self, sources: Dict[str, Tuple[int, int]]):
+        """Pack the source files into a new corpus and index, replacing the old ones."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        # Unique temp names, so processes rebuilding at the same time don't overwrite each other
+        corpus_fd, tmp_corpus = tempfile.mkstemp(
+            dir=self.store_dir, prefix="corpus.", suffix=".tmp"
+        )
+        index_fd, tmp_index = tempfile.mkstemp(dir=self.store_dir, prefix="index.", suffix=".tmp")
+        try:
+            entries, offset = {}, 0
+            with os.fdopen(corpus_fd, "wb") as corpus:
+                for pub_id in sorted(sources):
+                    with open(
+                        os.path.join(self.data_dir, f"{pub_id}.md"), "r", encoding="utf-8"
+                    ) as f:
+                        text = f.read()
+                    data = text.encode("utf-8")
+                    corpus.write(data)
+                    entries[pub_id] = {
+                        "offset": offset,
+                        "length": len(data),
+                        "chars": len(text),
+                        "checkpoints": _char_checkpoints(text),
+                    }
+                    offset += len(data)
+
+            index = {
+                "version": STORE_VERSION,
+                "data_dir": os.path.abspath(self.data_dir),
+                "sources": sources,
+                "entries": entries,
+            }
+            with os.fdopen(index_fd, "w", encoding="utf-8") as f:
+                json.dump(index, f)
+
+            # A crash between the two swaps leaves an index whose sources no longer
+            # match the files, so the next open rebuilds instead of misreading
+            self._close()
+            os.replace(tmp_corpus, self.corpus_fpath)
+            os.replace(tmp_index, self.index_fpath)
+        except BaseException:
+            for tmp_fpath in (tmp_corpus, tmp_index):
+                try:
+                    os.unlink(tmp_fpath)
+                except FileNotFoundError:
+                    pass
+            raise
+
+    def _open(self):
+        """Map the packed corpus and load its index, if they exist."""
+        self._close()
+        try:
+            with open(self.index_fpath, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            with open(self.corpus_fpath, "rb") as f:
+                # An empty corpus cannot be mapped
+                corpus_map = (
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    if os.fstat(f.fileno()).st_size
+                    else None
+                )
+        except (OSError, ValueError):
+            self._index = {}
+            return
+        self._index = index
+        self._mmap = corpus_map
+
+    def _close(self):
+        """Release the current mapping."""
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views from get_bytes are still alive; the map is freed once they are released
+                pass
+            self._mmap = None
+
+    def _entry(self, pub_id: str) -> Dict:
+        """Returns the index entry for a publication, rebuilding the pack if its source changed.
+
+        Callers that read the mapping hold the lock across this call and the read.
+        """
+        fpath = os.path.join(self.data_dir, f"{pub_id}.md")
+        try:
+            stat = os.stat(fpath)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Publication file not found: {fpath}")
+
+        recorded = self._index.get("sources", {}).get(pub_id)
+        if recorded is None or tuple(recorded) != (stat.st_mtime_ns, stat.st_size):
+            self.refresh()
+        return self._index["entries"][pub_id]
+
+    def ids(self) -> List[str]:
+        """Returns the IDs of all publications, rebuilding the pack if sources changed."""
+        with self._lock:
+            self.refresh()
+            return sorted(self._index["entries"])
+
+    def get_bytes(self, pub_id: str) -> memoryview:
+        """Returns a zero-copy view of a publication's UTF-8 bytes."""
+        with self._lock:
+            entry = self._entry(pub_id)
+            if not entry["length"]:
+                return memoryview(b"")
+            return memoryview(self._mmap)[entry["offset"] : entry["offset"] + entry["length"]]
+
+    def get_text(self, pub_id: str) -> str:
+        """Returns a publication's content."""
+        with self._lock:
+            entry = self._entry(pub_id)
+            if not entry["length"]:
+                return ""
+            data = self._mmap[entry["offset"] : entry["offset"] + entry["length"]]
+        return data.decode("utf-8")
+
+    def get_span(self, pub_id: str, start: int, end: Optional[int] = None) -> str:
+        """Returns characters [start, end) of a publication, decoding only the blocks it spans.
+
+        Args:
+            pub_id: Publication ID.
+            start: Start character offset.
+            end: End character offset (exclusive); defaults to the end of the publication.
+
+        Returns:
+            The requested span of the publication text.
+        """
+        with self._lock:
+            entry = self._entry(pub_id)
+            chars = entry["chars"]
+            end = chars if end is None else min(end, chars)
+            start = max(0, start)
+            if start >= end:
+                return ""
+
+            checkpoints = entry["checkpoints"]
+            first_block = start // CHECKPOINT_CHARS
+            last_block = min((end - 1) // CHECKPOINT_CHARS + 1, len(checkpoints) - 1)
+            block_start = entry["offset"] + checkpoints[first_block]
+            block_end = entry["offset"] + checkpoints[last_block]
+            data = self._mmap[block_start:block_end]
+        text = data.decode("utf-8")
+
+        skip = first_block * CHECKPOINT_CHARS
+        return text[start - skip : end - skip]
+
+    def get_length(self, pub_id: str) -> int:
+        """Returns the number of characters in a publication."""
+        with self._lock:
+            return self._entry(pub_id)["chars"]
+
+
+@lru_cache(maxsize=None)
+def get_publication_store(data_dir: str = DATA_DIR) -> PublicationStore:
+    """Returns the shared store for a data directory, creating it on first use."""
+    if os.path.abspath(data_dir) == os.path.abspath(DATA_DIR):
+        return PublicationStore(data_dir)
+    # Other directories get their own pack, named after the directory
+    dir_hash = hashlib.sha1(os.path.abspath(data_dir).encode("utf-8")).hexdigest()[:12]
+    store_dir = os.path.join(
+        os.path.dirname(PUBLICATION_STORE_DIR), f"publication_store_{dir_hash}"
+    )
+    return PublicationStore(data_dir, store_dir)
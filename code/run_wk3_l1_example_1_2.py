@@ -4,23 +4,21 @@ import sys
 from pathlib import Path
 import os
 from typing import Optional
-from langchain_groq import ChatGroq
 from langchain_core.messages import HumanMessage, SystemMessage
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from utils import load_publication, load_yaml_config, load_env, save_text_to_file
 from paths import OUTPUTS_DIR, APP_CONFIG_FPATH
+from llm_client import create_llm, get_model_route
+from metrics import start_metrics_exporters
+from profiling import run_main
 
 
 def invoke_llm(messages: list, model: str = "llama-3.1-8b-instant", temperature: float = 0.7) -> Optional[str]:
     """Calls the LLM with a list of messages and returns the response content."""
     try:
-        llm = ChatGroq(
-            model=model,
-            temperature=temperature,
-            api_key=os.getenv("GROQ_API_KEY")
-        )
+        llm = create_llm(model, temperature)
         response = llm.invoke(messages)
         return response.content
     except Exception as e:
@@ -85,7 +83,8 @@ def main() -> None:
 
         print("Loading application configuration...")
         app_config = load_yaml_config(APP_CONFIG_FPATH)
-        model_name = app_config.get("llm", "llama-3.1-8b-instant")
+        start_metrics_exporters(app_config)
+        model_name = get_model_route("answer", app_config)["model"]
         print(f"✓ Model set to: {model_name}")
 
         print("\nRunning Example 1: General knowledge response...")
@@ -104,4 +103,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
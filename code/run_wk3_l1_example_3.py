@@ -3,33 +3,35 @@
 import sys
 from pathlib import Path
 import os
-from langchain_groq import ChatGroq
+from llm_client import create_llm, get_model_route
+from metrics import start_metrics_exporters
+from profiling import run_main
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from utils import load_publication, load_yaml_config, load_env, save_text_to_file
 from paths import OUTPUTS_DIR, APP_CONFIG_FPATH
+from publication_digest import get_publication_context, is_digest_mode
 
 
-def run_interactive_conversation(publication_content: str, model_name: str) -> None:
-    """Runs an interactive terminal-based conversation with the LLM and saves it."""
-    # Initialize the LLM
-    llm = ChatGroq(
-        model=model_name,
-        temperature=0.7,
-        api_key=os.getenv("GROQ_API_KEY")
-    )
-
-    # Initialize conversation
-    conversation = [
-        SystemMessage(content=f"""
+def build_system_message(publication_content: str) -> SystemMessage:
+    """Builds the system message grounding the conversation in the publication."""
+    return SystemMessage(content=f"""
 You are a helpful AI assistant discussing a research publication.
 Base your answers only on this publication content:
 
 {publication_content}
 """)
-    ]
+
+
+def run_interactive_conversation(publication_content: str, model_name: str, app_config: dict = None) -> None:
+    """Runs an interactive terminal-based conversation with the LLM and saves it."""
+    # Initialize the LLM
+    llm = create_llm(model_name, temperature=0.7)
+
+    # Initialize conversation
+    conversation = [build_system_message(get_publication_context(publication_content, app_config))]
 
     print("\nInteractive Q&A Assistant — VAE Publication Chat 📝")
     print("Type your question and press Enter. Type 'q' to quit.\n")
@@ -43,6 +45,12 @@ Base your answers only on this publication content:
             print("Exiting. Goodbye!")
             break
 
+        # In digest mode, send only the publication sections relevant to this turn
+        if is_digest_mode(app_config):
+            conversation[0] = build_system_message(
+                get_publication_context(publication_content, app_config, query=user_input)
+            )
+
         # Append user's message
         conversation.append(HumanMessage(content=user_input))
         transcript_segments.append(
@@ -92,10 +100,11 @@ def main() -> None:
 
         print("Loading application configuration...")
         app_config = load_yaml_config(APP_CONFIG_FPATH)
-        model_name = app_config.get("llm", "llama-3.1-8b-instant")
+        start_metrics_exporters(app_config)
+        model_name = get_model_route("answer", app_config)["model"]
         print(f"✓ Model set to: {model_name}")
 
-        run_interactive_conversation(publication_content, model_name)
+        run_interactive_conversation(publication_content, model_name, app_config)
 
         print("\n" + "-"*80)
         print("TASK COMPLETE!")
@@ -107,4 +116,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
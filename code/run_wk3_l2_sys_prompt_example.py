@@ -1,7 +1,9 @@
 import sys
 from pathlib import Path
 import os
-from langchain_groq import ChatGroq
+from llm_client import create_llm, get_model_route
+from metrics import start_metrics_exporters
+from profiling import run_main
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 
 sys.path.append(str(Path(__file__).parent.parent))
@@ -9,6 +11,7 @@ sys.path.append(str(Path(__file__).parent.parent))
 from utils import load_publication, load_yaml_config, load_env, save_text_to_file
 from prompt_builder import build_system_prompt_from_config, print_prompt_preview
 from paths import OUTPUTS_DIR, APP_CONFIG_FPATH, PROMPT_CONFIG_FPATH
+from publication_digest import get_publication_context, is_digest_mode
 
 
 def clear_screen():
@@ -29,7 +32,8 @@ def print_instructions(config_name: str):
 def run_interactive_conversation_with_system_prompt(
     publication_content: str, 
     model_name: str,
-    system_prompt_config_name: str = "ai_assistant_system_prompt_professional"
+    system_prompt_config_name: str = "ai_assistant_system_prompt_professional",
+    app_config: dict = None
 ) -> None:
     """Runs an interactive terminal-based conversation using a configured system prompt."""
     
@@ -43,7 +47,7 @@ def run_interactive_conversation_with_system_prompt(
     # Build the system prompt
     system_prompt = build_system_prompt_from_config(
         system_prompt_config, 
-        publication_content
+        get_publication_context(publication_content, app_config)
     )
     
     print("\n" + "="*80)
@@ -53,11 +57,7 @@ def run_interactive_conversation_with_system_prompt(
     print("\n")
     
     # Initialize the LLM
-    llm = ChatGroq(
-        model=model_name,
-        temperature=0.0,
-        api_key=os.getenv("GROQ_API_KEY")
-    )
+    llm = create_llm(model_name, temperature=0.0)
 
     # Initialize conversation with the built system prompt
     conversation = [SystemMessage(content=system_prompt)]
@@ -92,6 +92,13 @@ def run_interactive_conversation_with_system_prompt(
             print("Exiting. Goodbye!")
             break
 
+        # In digest mode, send only the publication sections relevant to this turn
+        if is_digest_mode(app_config):
+            conversation[0] = SystemMessage(content=build_system_prompt_from_config(
+                system_prompt_config,
+                get_publication_context(publication_content, app_config, query=user_input)
+            ))
+
         # Append user's message
         conversation.append(HumanMessage(content=user_input))
         transcript_segments.append(
@@ -148,7 +155,8 @@ def main() -> None:
 
         print("Loading application configuration...")
         app_config = load_yaml_config(APP_CONFIG_FPATH)
-        model_name = app_config.get("llm", "llama-3.1-8b-instant")
+        start_metrics_exporters(app_config)
+        model_name = get_model_route("answer", app_config)["model"]
         print(f"✓ Model set to: {model_name}")
 
         # Ask user which system prompt config to use
@@ -166,7 +174,8 @@ def main() -> None:
         run_interactive_conversation_with_system_prompt(
             publication_content, 
             model_name,
-            config_name
+            config_name,
+            app_config
         )
 
         print("\n" + "-"*80)
@@ -179,4 +188,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -1,25 +1,26 @@
 import sys
 from pathlib import Path
 import os
-from langchain_groq import ChatGroq
+import json
+import time
+import tracemalloc
+from typing import Optional
+import numpy as np
+from llm_client import create_llm, get_llm, get_model_route
+from metrics import start_metrics_exporters
+from profiling import run_main
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
-import tiktoken
 
 sys.path.append(str(Path(__file__).parent.parent))
 
-from utils import load_publication, load_yaml_config, load_env, save_text_to_file
+from utils import load_publication, load_yaml_config, load_env, save_text_to_file, count_tokens, percentile
 from prompt_builder import build_system_prompt_from_config
 from paths import OUTPUTS_DIR, APP_CONFIG_FPATH, PROMPT_CONFIG_FPATH, DATA_DIR
+from local_llm import LocalStandInLLM
+from publication_digest import get_publication_context, is_digest_mode
+from run_wk3_l4_vector_db_ingest import embed_documents
 
-
-def count_tokens(text: str, model: str = "gpt-3.5-turbo"):
-    """Count tokens using tiktoken with fallback."""
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except:
-        # Fallback estimation
-        return int(len(text.split()) * 1.3)
+STRATEGIES = ["stuffing", "trimming", "summarization", "retrieval"]
 
 
 def messages_to_string(messages: list, include_publication: bool = False) -> str:
@@ -108,6 +109,114 @@ Focus on main topics and key information. Keep under 200 words."""
         return apply_trimming_strategy(conversation, system_prompt, 8)
 
 
+class ConversationTurnIndex:
+    """Small in-process vector index over past question/answer pairs.
+
+    Each pair is embedded once, with the same MiniLM model used for the
+    publication vector DB, and kept as a normalized row for cosine search.
+    """
+
+    def __init__(self, embed_fn=embed_documents):
+        self.embed_fn = embed_fn
+        self.pairs = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def retrieve(self, conversation: list, query: str, top_k: int, exclude_last_pairs: int = 0) -> list:
+        """Index any new pairs in the conversation and return the top-k most relevant ones.
+
+        Pairs among the last `exclude_last_pairs` are skipped since they are
+        already sent verbatim. Results are returned in conversation order.
+        """
+        new_pairs = []
+        for i in range(2 * len(self.pairs), len(conversation) - 1, 2):
+            question, answer = conversation[i], conversation[i + 1]
+            if isinstance(question, HumanMessage) and isinstance(answer, AIMessage):
+                new_pairs.append((question, answer))
+
+        # Embed the new pairs and the query in a single forward pass
+        texts = [f"User: {q.content}\nAssistant: {a.content}" for q, a in new_pairs] + [query]
+        embeddings = np.asarray(self.embed_fn(texts), dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+
+        if new_pairs:
+            new_vectors = embeddings[:-1]
+            self.vectors = new_vectors if not self.pairs else np.vstack([self.vectors, new_vectors])
+            self.pairs.extend(new_pairs)
+
+        searchable = len(self.pairs) - exclude_last_pairs
+        if searchable <= 0 or top_k <= 0:
+            return []
+
+        scores = self.vectors[:searchable] @ embeddings[-1]
+        top = np.argsort(-scores)[:top_k]
+        return [self.pairs[i] for i in sorted(top)]
+
+
+def apply_retrieval_strategy(
+    conversation: list,
+    system_prompt: str,
+    turn_index: ConversationTurnIndex,
+    user_input: str,
+    top_k: int = 3,
+    recent_window: int = 4
+) -> list:
+    """Strategy 4: Keep recent messages plus the top-k earlier turns relevant to the question."""
+    system_msg = [SystemMessage(content=system_prompt)]
+    if len(conversation) <= recent_window:
+        return system_msg + conversation
+
+    recent_messages = conversation[-recent_window:]
+    relevant_pairs = turn_index.retrieve(
+        conversation, user_input, top_k, exclude_last_pairs=recent_window // 2
+    )
+
+    retrieved_messages = []
+    for question, answer in relevant_pairs:
+        retrieved_messages.extend([question, answer])
+
+    return system_msg + retrieved_messages + recent_messages
+
+
+def apply_memory_strategy(
+    strategy_name: str,
+    conversation: list,
+    system_prompt: str,
+    llm,
+    memory_config: dict,
+    user_input: str = "",
+    turn_index: Optional[ConversationTurnIndex] = None
+) -> list:
+    """Build the prompt messages for a conversation using the named strategy."""
+    window_size = memory_config.get("trimming_window_size", 8)
+    max_tokens = memory_config.get("summarization_max_tokens", 1000)
+
+    if strategy_name == "stuffing":
+        return apply_stuffing_strategy(conversation, system_prompt)
+    elif strategy_name == "trimming":
+        return apply_trimming_strategy(conversation, system_prompt, window_size)
+    elif strategy_name == "summarization":
+        return apply_summarization_strategy(conversation, system_prompt, llm, max_tokens)
+    elif strategy_name == "retrieval":
+        return apply_retrieval_strategy(
+            conversation,
+            system_prompt,
+            turn_index,
+            user_input,
+            memory_config.get("retrieval_top_k", 3),
+            memory_config.get("retrieval_recent_window", 4)
+        )
+    else:
+        raise ValueError(f"Unknown strategy: {strategy_name}")
+
+
+def build_turn_system_prompt(system_prompt_config: dict, publication_content: str, app_config: dict, user_input: str = "") -> str:
+    """Build the system prompt for a turn, using the configured publication context mode."""
+    return build_system_prompt_from_config(
+        system_prompt_config,
+        get_publication_context(publication_content, app_config, query=user_input)
+    )
+
+
 def run_memory_strategy_conversation(
     publication_content: str, 
     model_name: str, 
@@ -126,19 +235,16 @@ def run_memory_strategy_conversation(
         raise ValueError(f"System prompt config '{system_prompt_config_name}' not found")
 
     # Build system prompt
-    system_prompt = build_system_prompt_from_config(system_prompt_config, publication_content)
+    system_prompt = build_turn_system_prompt(system_prompt_config, publication_content, app_config)
 
-    # Initialize LLM
-    llm = ChatGroq(
-        model=model_name,
-        temperature=0.0,
-        api_key=os.getenv("GROQ_API_KEY")
-    )
+    # Initialize LLMs (bulk runs yield to interactive calls under rate limits);
+    # summaries go to the model routed for background summarization
+    llm = create_llm(model_name, temperature=0.0, priority="batch")
+    summary_llm = get_llm("summarize", temperature=0.0, priority="batch", app_config=app_config)
 
     # Get memory config
     memory_config = app_config.get("memory_strategies", {})
-    window_size = memory_config.get("trimming_window_size", 8)
-    max_tokens = memory_config.get("summarization_max_tokens", 1000)
+    turn_index = ConversationTurnIndex() if strategy_name == "retrieval" else None
 
     print(f"\n🔧 Running Strategy: {strategy_name.upper()} | Questions: {len(user_questions)}")
     
@@ -150,19 +256,19 @@ def run_memory_strategy_conversation(
     # Process each question
     for idx, user_input in enumerate(user_questions, 1):
         print(f"  Processing question {idx}/{len(user_questions)}: {user_input[:50]}...")
+
+        # In digest mode, send only the publication sections relevant to this turn
+        if is_digest_mode(app_config):
+            system_prompt = build_turn_system_prompt(system_prompt_config, publication_content, app_config, user_input)
         
         # Add user message to history
         conversation_history.append(HumanMessage(content=user_input))
         
         # Apply memory strategy to build current prompt
-        if strategy_name == "stuffing":
-            current_messages = apply_stuffing_strategy(conversation_history[:-1], system_prompt)
-        elif strategy_name == "trimming":
-            current_messages = apply_trimming_strategy(conversation_history[:-1], system_prompt, window_size)
-        elif strategy_name == "summarization":
-            current_messages = apply_summarization_strategy(conversation_history[:-1], system_prompt, llm, max_tokens)
-        else:
-            raise ValueError(f"Unknown strategy: {strategy_name}")
+        current_messages = apply_memory_strategy(
+            strategy_name, conversation_history[:-1], system_prompt, summary_llm, memory_config,
+            user_input, turn_index
+        )
         
         # Add current question
         current_messages.append(HumanMessage(content=user_input))
@@ -201,13 +307,10 @@ def run_memory_strategy_conversation(
 
     # Generate final prompt for last question
     if user_questions:
-        if strategy_name == "stuffing":
-            final_messages = apply_stuffing_strategy(conversation_history[:-1], system_prompt)
-        elif strategy_name == "trimming":
-            final_messages = apply_trimming_strategy(conversation_history[:-1], system_prompt, window_size)
-        elif strategy_name == "summarization":
-            final_messages = apply_summarization_strategy(conversation_history[:-1], system_prompt, llm, max_tokens)
-        
+        final_messages = apply_memory_strategy(
+            strategy_name, conversation_history[:-1], system_prompt, summary_llm, memory_config,
+            user_questions[-1], turn_index
+        )
         final_messages.append(HumanMessage(content=user_questions[-1]))
         final_prompt = messages_to_string(final_messages, include_publication=False)  # Exclude publication for readability
         final_response = conversation_history[-1].content if conversation_history else "No response"
@@ -245,7 +348,8 @@ def save_strategy_results(strategy_name: str, qa_pairs: list, final_prompt: str,
     descriptions = {
         "stuffing": "Keeps ALL previous messages in conversation history.",
         "trimming": "Keeps only the most recent N messages in conversation history.",
-        "summarization": "Summarizes older messages and keeps recent messages for context."
+        "summarization": "Summarizes older messages and keeps recent messages for context.",
+        "retrieval": "Embeds past question/answer pairs and keeps only the most relevant ones plus recent messages."
     }
     content.append("## Strategy Description")
     content.append(descriptions.get(strategy_name, "Unknown strategy"))
@@ -333,6 +437,7 @@ def save_comparison_stats(all_stats: list):
     content.append("- **Stuffing**: Short conversations where complete context is crucial")
     content.append("- **Trimming**: When only recent context matters and costs need control")
     content.append("- **Summarization**: Balance between context preservation and efficiency")
+    content.append("- **Retrieval**: Long sessions where relevant early context must survive at a near-constant prompt size")
     
     # Save file
     save_text_to_file(
@@ -343,21 +448,278 @@ def save_comparison_stats(all_stats: list):
     print("✓ Comparison statistics saved to lesson3a_memory_comparison_stats.md")
 
 
+class ReplayLLM:
+    """Chat model wrapper that records another model's calls, then replays them in order.
+
+    Failed calls are recorded too and raise the same error on replay, so the
+    replay follows the recorded run call for call.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.outcomes = []  # (response, exception) per call
+        self.replaying = False
+        self._next = 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    def replay(self):
+        """Answer the following calls from the recorded outcomes, from the first one on."""
+        self.replaying = True
+        self._next = 0
+
+    def invoke(self, messages, **kwargs):
+        if self.replaying:
+            response, error = self.outcomes[self._next]
+            self._next += 1
+            if error is not None:
+                raise error
+            return response
+        try:
+            response = self.llm.invoke(messages, **kwargs)
+        except Exception as e:
+            self.outcomes.append((None, e))
+            raise
+        self.outcomes.append((response, None))
+        return response
+
+
+def benchmark_memory_strategy(
+    system_prompt_config: dict,
+    publication_content: str,
+    llm,
+    strategy_name: str,
+    user_questions: list,
+    checkpoints: list,
+    app_config: dict,
+    summary_llm=None
+) -> dict:
+    """Benchmark one strategy over a conversation of max(checkpoints) turns.
+
+    Every turn records prompt-build CPU time, tokens sent (publication included)
+    and end-to-end latency; the curve is sampled at each checkpoint turn count.
+    The summarization strategy uses `summary_llm` if given, otherwise `llm`.
+
+    Time and memory are measured in separate passes, since tracemalloc slows
+    prompt building several-fold. The memory pass replays the conversation
+    with tracing on, rebuilding each prompt from the first pass's responses
+    without calling the LLM again.
+    """
+    num_turns = max(checkpoints)
+    print(f"\n⏱️  Benchmarking {strategy_name.upper()} over {num_turns} turns...")
+
+    memory_config = app_config.get("memory_strategies", {})
+    replay_summary_llm = ReplayLLM(summary_llm or llm)
+    system_prompt = build_turn_system_prompt(system_prompt_config, publication_content, app_config)
+    turns = []
+    responses = []
+
+    def build_prompt(conversation_history: list, user_input: str, turn_index) -> list:
+        # Digest mode re-selects the publication sections for every question
+        turn_system_prompt = system_prompt
+        if is_digest_mode(app_config):
+            turn_system_prompt = build_turn_system_prompt(system_prompt_config, publication_content, app_config, user_input)
+        messages = apply_memory_strategy(
+            strategy_name, conversation_history, turn_system_prompt, replay_summary_llm, memory_config,
+            user_input, turn_index
+        )
+        messages.append(HumanMessage(content=user_input))
+        return messages
+
+    # Pass 1: time each turn (under --profile tracemalloc, tracing is on here too)
+    conversation_history = []
+    turn_index = ConversationTurnIndex() if strategy_name == "retrieval" else None
+    try:
+        for idx in range(1, num_turns + 1):
+            # Cycle through the sample questions to reach the target length
+            user_input = user_questions[(idx - 1) % len(user_questions)]
+
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            current_messages = build_prompt(conversation_history, user_input, turn_index)
+            build_cpu_ms = (time.process_time() - start_cpu) * 1000
+
+            response = llm.invoke(current_messages)
+            latency_ms = (time.perf_counter() - start_wall) * 1000
+
+            conversation_history.append(HumanMessage(content=user_input))
+            conversation_history.append(AIMessage(content=response.content))
+            responses.append(response.content)
+
+            turns.append({
+                'turn': idx,
+                'build_cpu_ms': build_cpu_ms,
+                'prompt_tokens': count_tokens(messages_to_string(current_messages, include_publication=True)),
+                'response_tokens': count_tokens(response.content),
+                'latency_ms': latency_ms
+            })
+
+            if idx in checkpoints:
+                print(f"    ✓ {idx} turns | prompt: {turns[-1]['prompt_tokens']:,} tokens | latency: {latency_ms:,.1f} ms")
+    except Exception as e:
+        print(f"    ❌ Error at turn {len(turns) + 1}: {e}")
+
+    # Pass 2: replay the completed turns with tracemalloc on to sample peak memory at each checkpoint
+    peak_memory = {}
+    replay_summary_llm.replay()
+    conversation_history = []
+    turn_index = ConversationTurnIndex() if strategy_name == "retrieval" else None
+    # Under --profile tracemalloc tracing is already on; measure from a fresh peak and leave it running
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        for idx, response_content in enumerate(responses, 1):
+            user_input = user_questions[(idx - 1) % len(user_questions)]
+            build_prompt(conversation_history, user_input, turn_index)
+            conversation_history.append(HumanMessage(content=user_input))
+            conversation_history.append(AIMessage(content=response_content))
+            if idx in checkpoints:
+                peak_memory[idx] = tracemalloc.get_traced_memory()[1]
+    except Exception as e:
+        print(f"    ❌ Error replaying turn {idx} for memory: {e}")
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    curve = [
+        summarize_benchmark_window(turns[:idx], peak_memory.get(idx))
+        for idx in checkpoints
+        if idx <= len(turns)
+    ]
+    return {
+        "strategy": strategy_name,
+        "turns_completed": len(turns),
+        "curve": curve,
+        "turns": turns
+    }
+
+
+def summarize_benchmark_window(turns: list, peak_memory_bytes: Optional[int]) -> dict:
+    """Summarize the benchmark measurements collected up to the current turn."""
+    build_cpu = [t['build_cpu_ms'] for t in turns]
+    latencies = [t['latency_ms'] for t in turns]
+    return {
+        'turns': len(turns),
+        'prompt_tokens_last_turn': turns[-1]['prompt_tokens'],
+        'cumulative_tokens': sum(t['prompt_tokens'] + t['response_tokens'] for t in turns),
+        'build_cpu_ms_last_turn': build_cpu[-1],
+        'build_cpu_ms_p95': percentile(build_cpu, 95),
+        'latency_ms_last_turn': latencies[-1],
+        'latency_ms_p50': percentile(latencies, 50),
+        'latency_ms_p95': percentile(latencies, 95),
+        'peak_memory_kb': peak_memory_bytes / 1024 if peak_memory_bytes is not None else None
+    }
+
+
+def save_benchmark_results(results: list, backend: str, checkpoints: list):
+    """Save benchmark results as JSON and as a markdown curve table."""
+    json_fpath = os.path.join(OUTPUTS_DIR, "lesson3a_memory_benchmark.json")
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    with open(json_fpath, "w", encoding="utf-8") as f:
+        json.dump({"backend": backend, "checkpoints": checkpoints, "results": results}, f, indent=2)
+
+    metrics = [
+        ("Tokens Sent at Turn N", 'prompt_tokens_last_turn', "{:,.0f}"),
+        ("Cumulative Tokens up to Turn N", 'cumulative_tokens', "{:,.0f}"),
+        ("Prompt-Build CPU at Turn N (ms)", 'build_cpu_ms_last_turn', "{:,.2f}"),
+        ("End-to-End Latency p95 up to Turn N (ms)", 'latency_ms_p95', "{:,.1f}"),
+        ("Peak Traced Memory of Prompt Building up to Turn N (KB)", 'peak_memory_kb', "{:,.0f}"),
+    ]
+
+    content = []
+    content.append("# Memory Strategy Benchmark - Cost Curves")
+    content.append("=" * 60)
+    content.append("")
+    content.append(f"Backend: `{backend}`")
+    content.append("")
+
+    for title, key, fmt in metrics:
+        content.append(f"## {title}")
+        content.append("")
+        content.append("| Turns | " + " | ".join(r['strategy'].title() for r in results) + " |")
+        content.append("|-------|" + "|".join("-" * (len(r['strategy']) + 2) for r in results) + "|")
+        for checkpoint in checkpoints:
+            row = []
+            for r in results:
+                point = next((p for p in r['curve'] if p['turns'] == checkpoint), None)
+                row.append(fmt.format(point[key]) if point and point[key] is not None else "n/a")
+            content.append(f"| {checkpoint} | " + " | ".join(row) + " |")
+        content.append("")
+
+    save_text_to_file(
+        "\n".join(content),
+        os.path.join(OUTPUTS_DIR, "lesson3a_memory_benchmark.md"),
+        header="Lesson 3A: Memory Strategy Benchmark"
+    )
+    print("✓ Benchmark results saved to lesson3a_memory_benchmark.json and lesson3a_memory_benchmark.md")
+
+
+def run_benchmark():
+    """Benchmark all memory strategies over conversations of increasing length."""
+    publication_content = load_publication(publication_external_id='yzN0OCQT7hUS')
+    app_config = load_yaml_config(APP_CONFIG_FPATH)
+    model_name = get_model_route("answer", app_config)["model"]
+    memory_config = app_config.get("memory_strategies", {})
+    checkpoints = memory_config.get("benchmark_turn_counts", [10, 25, 50, 100, 250, 500])
+
+    # The local stand-in isolates prompt-building cost from network time and rate limits
+    backend_choice = input("\nBackend: 1. local stand-in  2. live Groq model (default=1): ").strip()
+    if backend_choice == "2":
+        load_env()
+        llm = create_llm(model_name, temperature=0.0, priority="batch")
+        summary_llm = get_llm("summarize", temperature=0.0, priority="batch", app_config=app_config)
+        backend = model_name
+    else:
+        llm = summary_llm = LocalStandInLLM()
+        backend = llm.model_name
+
+    max_turns = input(f"Longest conversation to benchmark? (default={max(checkpoints)}): ").strip()
+    try:
+        max_turns = int(max_turns) if max_turns else max(checkpoints)
+    except ValueError:
+        max_turns = max(checkpoints)
+    checkpoints = sorted(c for c in checkpoints if c < max_turns) + [max_turns]
+
+    prompt_configs = load_yaml_config(PROMPT_CONFIG_FPATH)
+    system_prompt_config = prompt_configs["ai_assistant_system_prompt_advanced"]
+
+    questions_config = load_yaml_config(os.path.join(DATA_DIR, "yzN0OCQT7hUS-sample-questions.yaml"))
+    user_questions = questions_config.get("questions", [])
+
+    results = []
+    for strategy in STRATEGIES:
+        results.append(benchmark_memory_strategy(
+            system_prompt_config=system_prompt_config,
+            publication_content=publication_content,
+            llm=llm,
+            strategy_name=strategy,
+            user_questions=user_questions,
+            checkpoints=checkpoints,
+            app_config=app_config,
+            summary_llm=summary_llm
+        ))
+
+    save_benchmark_results(results, backend, checkpoints)
+
+
 def run_single_strategy():
     """Run a single memory strategy."""
     load_env()
     publication_content = load_publication(publication_external_id='yzN0OCQT7hUS')
     app_config = load_yaml_config(APP_CONFIG_FPATH)
-    model_name = app_config.get("llm", "llama-3.1-8b-instant")
+    model_name = get_model_route("answer", app_config)["model"]
 
     # Let user pick a strategy
-    strategies = ["stuffing", "trimming", "summarization"]
     print("\nAvailable strategies:")
-    for idx, s in enumerate(strategies, 1):
+    for idx, s in enumerate(STRATEGIES, 1):
         print(f"{idx}. {s}")
 
-    choice = input("\nSelect strategy (1-3, default=1): ").strip()
-    strategy_map = {"1": "stuffing", "2": "trimming", "3": "summarization"}
+    choice = input("\nSelect strategy (1-4, default=1): ").strip()
+    strategy_map = {"1": "stuffing", "2": "trimming", "3": "summarization", "4": "retrieval"}
     strategy = strategy_map.get(choice, "stuffing")
 
     # Load questions
@@ -397,7 +759,7 @@ def run_comparison():
     load_env()
     publication_content = load_publication(publication_external_id='yzN0OCQT7hUS')
     app_config = load_yaml_config(APP_CONFIG_FPATH)
-    model_name = app_config.get("llm", "llama-3.1-8b-instant")
+    model_name = get_model_route("answer", app_config)["model"]
 
     # Load questions
     questions_config = load_yaml_config(os.path.join(DATA_DIR, "yzN0OCQT7hUS-sample-questions.yaml"))
@@ -413,12 +775,11 @@ def run_comparison():
     
     selected_questions = user_questions[:num_questions]
 
-    strategies = ["stuffing", "trimming", "summarization"]
     all_stats = []
 
     print(f"\n🏁 Running comparison with {len(selected_questions)} questions...")
 
-    for strategy in strategies:
+    for strategy in STRATEGIES:
         stats = run_memory_strategy_conversation(
             publication_content=publication_content,
             model_name=model_name,
@@ -444,15 +805,19 @@ def main():
     print("=" * 80)
     print("LESSON 3A: MEMORY STRATEGY DEMONSTRATION")
     print("=" * 80)
+    start_metrics_exporters(load_yaml_config(APP_CONFIG_FPATH))
     
     print("Choose mode:")
     print("1. Run a single strategy")
     print("2. Run comparison of all strategies")
+    print("3. Benchmark all strategies over increasing conversation lengths")
     
-    choice = input("\nChoose mode (1 or 2, default=2): ").strip()
+    choice = input("\nChoose mode (1, 2 or 3, default=2): ").strip()
 
     if choice == "1":
         run_single_strategy()
+    elif choice == "3":
+        run_benchmark()
     else:
         run_comparison()
 
@@ -461,4 +826,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -0,0 +1,369 @@
+"""
+Asyncio HTTP server that serves many persistent chat sessions from one process.
+
+Each session is a lightweight ChatWithMemory that shares the process-wide LLM
+client, chat store, write-behind writer and checkpoint thread. Hot sessions are
+kept in an in-memory LRU; requests to the same session are serialized by a
+per-session lock, and requests beyond the in-flight limit are rejected with
+503 so callers back off instead of piling up.
+
+Endpoints:
+    GET  /health
+    GET  /metrics
+    GET  /sessions
+    GET  /sessions/<id>/messages?limit=20&before_id=<id>
+    POST /sessions/<id>/messages   {"message": "..."}
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from chat_store import WriteBehindWriter, get_chat_store
+from llm_client import CallScheduler, ScheduledLLM, get_llm
+from local_llm import LocalStandInLLM
+from metrics import REGISTRY, start_metrics_exporters
+from paths import APP_CONFIG_FPATH, CHAT_HISTORY_DB_FPATH
+from profiling import run_main
+from run_wk3_l3b_memory_persistence import ChatWithMemory
+from utils import load_env, load_yaml_config
+
+warnings.filterwarnings("ignore")
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class HTTPError(Exception):
+    """Error returned to the client as a JSON response."""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ChatServer:
+    """Routes HTTP requests to per-session ChatWithMemory instances."""
+
+    def __init__(
+        self,
+        app_config: Dict[str, Any],
+        llm,
+        max_sessions: int,
+        max_in_flight: int,
+        checkpoint_llm=None,
+        max_page_size: int = 200,
+    ):
+        """Initialize the server state.
+
+        Args:
+            app_config: Loaded app configuration.
+            llm: Chat model shared by all sessions.
+            max_sessions: Number of session histories kept in memory.
+            max_in_flight: Number of chat turns processed concurrently.
+            checkpoint_llm: Chat model for summary checkpoints; defaults to `llm`.
+            max_page_size: Largest `limit` accepted when reading a session's messages.
+        """
+        self.app_config = app_config
+        self.llm = llm
+        self.checkpoint_llm = checkpoint_llm or llm
+        self.max_sessions = max_sessions
+        self.max_in_flight = max_in_flight
+        self.max_page_size = max_page_size
+        self.in_flight = 0
+
+        persistence_config = app_config.get("chat_persistence", {})
+        self.store = get_chat_store(CHAT_HISTORY_DB_FPATH)
+        self.writer = None
+        if persistence_config.get("write_mode", "durable") == "write_behind":
+            self.writer = WriteBehindWriter(
+                self.store,
+                batch_size=persistence_config.get("write_behind_batch_size", 20),
+                flush_interval=persistence_config.get("write_behind_flush_interval", 1.0),
+            )
+        self.checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+
+        # Blocking work (LLM calls, SQLite) runs here, one thread per in-flight turn
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.sessions: "OrderedDict[str, ChatWithMemory]" = OrderedDict()
+        self.session_locks: Dict[str, asyncio.Lock] = {}
+
+    async def run_blocking(self, fn, *args):
+        """Run a blocking call on the server's worker threads."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _new_chat(self) -> ChatWithMemory:
+        """Create a session object that shares the server's resources."""
+        return ChatWithMemory(
+            llm=self.llm,
+            checkpoint_llm=self.checkpoint_llm,
+            writer=self.writer,
+            checkpoint_executor=self.checkpoint_executor,
+            app_config=self.app_config,
+        )
+
+    async def get_session(self, session_id: str) -> ChatWithMemory:
+        """Return the hot session, loading it (and evicting cold ones) if needed.
+
+        Must be called with the session's lock held.
+        """
+        chat = self.sessions.get(session_id)
+        if chat is not None:
+            self.sessions.move_to_end(session_id)
+            return chat
+
+        chat = self._new_chat()
+        await self.run_blocking(chat.start_session, session_id)
+        self.sessions[session_id] = chat
+        self._evict()
+        return chat
+
+    def _evict(self):
+        """Drop least recently used sessions that are not serving a request."""
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions:
+                break
+            lock = self.session_locks.get(session_id)
+            if lock is not None and lock.locked():
+                continue
+            # History is persisted, so the session reloads from the store on next use
+            del self.sessions[session_id]
+            self.session_locks.pop(session_id, None)
+
+    async def ask(self, session_id: str, message: str) -> Dict[str, Any]:
+        """Run one chat turn, rejecting it when the server is at capacity."""
+        if self.in_flight >= self.max_in_flight:
+            raise HTTPError(503, "Server is busy, retry later", {"Retry-After": "1"})
+
+        self.in_flight += 1
+        try:
+            lock = self.session_locks.setdefault(session_id, asyncio.Lock())
+            async with lock:
+                chat = await self.get_session(session_id)
+                try:
+                    response = await self.run_blocking(chat.ask, message)
+                except ValueError as e:
+                    raise HTTPError(400, str(e))
+        finally:
+            self.in_flight -= 1
+
+        return {"session_id": session_id, "response": response}
+
+    async def handle(self, method: str, target: str, body: bytes) -> Dict[str, Any]:
+        """Dispatch a request and return the JSON response payload."""
+        url = urlsplit(target)
+        parts = [unquote(p) for p in url.path.strip("/").split("/") if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if parts == ["health"]:
+            return {
+                "status": "ok",
+                "in_flight": self.in_flight,
+                "hot_sessions": len(self.sessions),
+            }
+
+        if parts == ["metrics"]:
+            return REGISTRY.to_dict()
+
+        if parts == ["sessions"]:
+            if method != "GET":
+                raise HTTPError(405, "Use GET")
+            if self.writer:
+                await self.run_blocking(self.writer.flush)
+            return {"sessions": await self.run_blocking(self.store.list_session_info)}
+
+        if len(parts) == 3 and parts[0] == "sessions" and parts[2] == "messages":
+            session_id = parts[1]
+            if method == "POST":
+                try:
+                    message = json.loads(body or b"{}").get("message", "").strip()
+                except (ValueError, AttributeError):
+                    raise HTTPError(400, "Body must be a JSON object")
+                if not message:
+                    raise HTTPError(400, "Missing 'message'")
+                return await self.ask(session_id, message)
+            if method == "GET":
+                try:
+                    limit = int(query.get("limit", 20))
+                    before_id = int(query["before_id"]) if "before_id" in query else None
+                except ValueError:
+                    raise HTTPError(400, "'limit' and 'before_id' must be integers")
+                if limit <= 0:
+                    raise HTTPError(400, "'limit' must be positive")
+                limit = min(limit, self.max_page_size)
+                if self.writer:
+                    await self.run_blocking(self.writer.flush)
+                page = await self.run_blocking(
+                    self.store.get_message_page, session_id, limit, before_id
+                )
+                return {
+                    "session_id": session_id,
+                    "messages": [
+                        {"id": message_id, "type": msg.type, "content": msg.content}
+                        for message_id, msg in page
+                    ],
+                }
+            raise HTTPError(405, "Use GET or POST")
+
+        raise HTTPError(404, f"No route for {url.path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve HTTP/1.1 requests on one connection until it is closed."""
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                status, extra_headers = 200, {}
+                try:
+                    payload = await self.handle(method, target, body)
+                except HTTPError as e:
+                    status, extra_headers, payload = e.status, e.headers, {"error": str(e)}
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, payload, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            write_response(writer, e.status, {"error": str(e)}, e.headers, keep_alive=False)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        """Flush pending writes and stop the worker threads."""
+        if self.writer:
+            self.writer.close()
+        self.checkpoint_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+
+
+async def read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Read one HTTP request; returns None when the client closed the connection."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    try:
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0) or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    payload: Dict[str, Any],
+    extra_headers: Dict[str, str],
+    keep_alive: bool,
+):
+    """Write a JSON HTTP response."""
+    body = json.dumps(payload).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "Content-Length": str(len(body)),
+        "Connection": "keep-alive" if keep_alive else "close",
+        **extra_headers,
+    }
+    head = f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+
+async def serve(server: ChatServer, host: str, port: int):
+    """Run the HTTP server until cancelled."""
+    http_server = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"🤖 Chat server listening on http://{host}:{port}")
+    async with http_server:
+        await http_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-session chat server")
+    parser.add_argument("--host", help="Bind address (defaults to chat_server.host)")
+    parser.add_argument("--port", type=int, help="Port (defaults to chat_server.port)")
+    parser.add_argument(
+        "--local", action="store_true", help="Use the local stand-in LLM instead of Groq"
+    )
+    args = parser.parse_args()
+
+    app_config = load_yaml_config(APP_CONFIG_FPATH)
+    server_config = app_config.get("chat_server", {})
+
+    start_metrics_exporters(app_config)
+
+    if args.local:
+        # Unlimited scheduler: no rate limits, but the same metrics and coalescing as Groq calls
+        stand_in = LocalStandInLLM()
+        llm = checkpoint_llm = ScheduledLLM(stand_in, CallScheduler(name=stand_in.model_name))
+    else:
+        load_env()
+        llm = get_llm("answer", temperature=0.7, app_config=app_config)
+        checkpoint_llm = get_llm("checkpoint", temperature=0.7, app_config=app_config)
+
+    os.makedirs(os.path.dirname(CHAT_HISTORY_DB_FPATH), exist_ok=True)
+    server = ChatServer(
+        app_config,
+        llm,
+        max_sessions=server_config.get("max_sessions_in_memory", 256),
+        max_in_flight=server_config.get("max_in_flight", 16),
+        checkpoint_llm=checkpoint_llm,
+        max_page_size=server_config.get("max_page_size", 200),
+    )
+    try:
+        asyncio.run(
+            serve(
+                server,
+                args.host or server_config.get("host", "127.0.0.1"),
+                args.port or server_config.get("port", 8000),
+            )
+        )
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -1,13 +1,15 @@
 import os
-import sqlite3
 import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from paths import CHAT_HISTORY_DB_FPATH, APP_CONFIG_FPATH
-from langchain_community.chat_message_histories.sql import SQLChatMessageHistory
+from chat_store import get_chat_store, WriteBehindWriter
 from langchain.memory import ConversationBufferMemory
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, SystemMessage
-from utils import load_env, load_yaml_config
+from llm_client import get_llm
+from metrics import start_metrics_exporters
+from profiling import run_main
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from utils import load_env, load_yaml_config, count_tokens
 
 warnings.filterwarnings("ignore")
 
@@ -15,21 +17,64 @@ warnings.filterwarnings("ignore")
 class ChatWithMemory:
     """Simple chat with persistent memory."""
 
-    def __init__(self):
-        """Initialize the chat."""
-        load_env()
-
-        # Load config and setup LLM
-        app_config = load_yaml_config(APP_CONFIG_FPATH)
-        model_name = app_config.get("llm", "llama-3.1-8b-instant")
+    def __init__(
+        self, llm=None, writer=None, checkpoint_executor=None, app_config=None, checkpoint_llm=None
+    ):
+        """Initialize the chat.
+
+        The LLMs, write-behind writer and checkpoint executor are created here
+        unless passed in, so a server can share one of each across many
+        sessions; shared resources are left open by `close()`. Checkpoints use
+        `checkpoint_llm`, defaulting to `llm` when only that is passed.
+        """
+        # Load config and setup the LLMs routed to answers and checkpoints
+        if app_config is None:
+            app_config = load_yaml_config(APP_CONFIG_FPATH)
+
+        if llm is None:
+            load_env()
+            llm = get_llm("answer", temperature=0.7, app_config=app_config)
+            if checkpoint_llm is None:
+                checkpoint_llm = get_llm("checkpoint", temperature=0.7, app_config=app_config)
+        self.llm = llm
+        self.checkpoint_llm = checkpoint_llm or llm
+
+        # Shared, pooled access to the chat history database
+        self.store = get_chat_store(CHAT_HISTORY_DB_FPATH)
+        self.persistence_config = app_config.get("chat_persistence", {})
+        self.lazy_history = self.persistence_config.get("history_mode", "full") == "tail"
+
+        # Optional write-behind mode takes the SQLite commit off the reply path
+        self._owns_writer = False
+        if writer is not None:
+            self.writer = writer
+        elif self.persistence_config.get("write_mode", "durable") == "write_behind":
+            self.writer = WriteBehindWriter(
+                self.store,
+                batch_size=self.persistence_config.get("write_behind_batch_size", 20),
+                flush_interval=self.persistence_config.get("write_behind_flush_interval", 1.0),
+            )
+            self._owns_writer = True
+        else:
+            self.writer = None
 
-        self.llm = ChatGroq(
-            model=model_name, temperature=0.7, api_key=os.getenv("GROQ_API_KEY")
-        )
+        # Optional summary checkpoints, generated in the background for long sessions
+        self.checkpoint_threshold = self.persistence_config.get("checkpoint_token_threshold")
+        self._owns_executor = bool(self.checkpoint_threshold) and checkpoint_executor is None
+        if self._owns_executor:
+            checkpoint_executor = ThreadPoolExecutor(max_workers=1)
+        self.checkpoint_executor = checkpoint_executor if self.checkpoint_threshold else None
+        self.checkpoint = None  # Latest checkpoint of the current session
+        self.checkpoint_job = None  # Future of the checkpoint being generated
 
         self.current_session = None
         self.memory = None
         self.chat_history = []  # Cache chat history in memory
+        # Database IDs (or pending write futures) of the cached messages, kept in tail or checkpoint mode
+        self.history_ids = []
+        self.track_ids = self.lazy_history or bool(self.checkpoint_threshold)
+        # Older messages at the front of the cached history loaded with load_older_messages
+        self.pinned_messages = 0
 
     def start_session(self, session_name: str = None):
         """Start or load a chat session."""
@@ -37,12 +82,19 @@ class ChatWithMemory:
             session_name = f"chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
         self.current_session = session_name
+        self.pinned_messages = 0
+        self.flush()
+
+        # Resuming an archived session moves it back into the hot table
+        if self.store.restore_session(session_name):
+            print(f"Restored archived session '{session_name}'")
+        self._apply_checkpoint_job(wait=True)
+        self.checkpoint = (
+            self.store.get_latest_checkpoint(session_name) if self.checkpoint_threshold else None
+        )
 
         # Setup memory
-        history = SQLChatMessageHistory(
-            connection=f"sqlite:///{CHAT_HISTORY_DB_FPATH}",
-            session_id=session_name,
-        )
+        history = self.store.get_history(session_name)
 
         # Or use PostgresChatMessageHistory
         # history = PostgresChatMessageHistory(
@@ -60,100 +112,327 @@ class ChatWithMemory:
             memory_key="chat_history", chat_memory=history, return_messages=True
         )
 
-        # Load chat history once when starting session
-        memory_vars = self.memory.load_memory_variables({})
-        self.chat_history = memory_vars.get("chat_history", [])
+        if self.lazy_history:
+            # Load only the recent messages the context window will actually use
+            tail = self.store.get_tail_messages(
+                session_name,
+                self.persistence_config.get("context_window_messages", 20),
+                self.persistence_config.get("context_token_budget"),
+            )
+            self.history_ids = [message_id for message_id, _ in tail]
+            self.chat_history = [msg for _, msg in tail]
+            existing_messages = self.store.count_messages(session_name)
+        elif self.checkpoint_threshold:
+            # Load only the messages the latest checkpoint does not summarize yet
+            after_id = self.checkpoint["upto_message_id"] if self.checkpoint else 0
+            rows = self.store.get_messages_after(session_name, after_id)
+            self.history_ids = [message_id for message_id, _ in rows]
+            self.chat_history = [msg for _, msg in rows]
+            existing_messages = self.store.count_messages(session_name)
+        else:
+            # Load chat history once when starting session
+            memory_vars = self.memory.load_memory_variables({})
+            self.chat_history = memory_vars.get("chat_history", [])
+            existing_messages = len(self.chat_history)
+
+        # Messages covered by the checkpoint are sent as its summary instead
+        if self.checkpoint:
+            self._drop_history_through(self.checkpoint["upto_message_id"])
 
         # Check if existing session
-        existing_messages = len(self.chat_history)
         if existing_messages > 0:
             print(
                 f"Loaded existing session '{session_name}' with {existing_messages} messages"
             )
+            if len(self.chat_history) < existing_messages:
+                print(f"Using the {len(self.chat_history)} most recent messages as context")
         else:
             print(f"Started new session '{session_name}'")
 
+    def load_older_messages(self, limit: int = 20) -> int:
+        """Fetch older messages of the current session into the context on demand (tail mode).
+
+        Loaded messages stay in the context on top of the message window until
+        the token budget forces them out, oldest first. Sessions with summary
+        checkpoints already carry their older messages in the summary.
+
+        Returns the number of messages added to the context.
+        """
+        # Full mode already holds the whole session; an empty tail has nothing older
+        if not self.lazy_history or self.checkpoint_threshold or not self.history_ids:
+            return 0
+
+        before_id = self.history_ids[0]
+        if isinstance(before_id, Future):
+            # The oldest cached message is still queued for writing
+            self.flush()
+            before_id = before_id.result()
+
+        page = self.store.get_message_page(self.current_session, limit, before_id)
+        cached = len(self.chat_history)
+        self.history_ids = [message_id for message_id, _ in page] + self.history_ids
+        self.chat_history = [msg for _, msg in page] + self.chat_history
+        self.pinned_messages += len(page)
+        self._trim_history()
+        return max(0, len(self.chat_history) - cached)
+
+    def _trim_history(self):
+        """Keep the cached history within the configured context window.
+
+        The message limit applies to the recent conversation; messages loaded
+        with `load_older_messages` are kept on top of it. The token budget
+        covers both and drops the oldest messages first.
+        """
+        max_messages = self.persistence_config.get("context_window_messages", 20)
+        max_tokens = self.persistence_config.get("context_token_budget")
+        pinned = min(self.pinned_messages, len(self.chat_history))
+
+        # Recent messages beyond the message limit, dropping whole question/answer pairs
+        start = pinned + max(0, len(self.chat_history) - pinned - max_messages)
+        while start < len(self.chat_history) and self.chat_history[start].type == "ai":
+            start += 1
+        keep = list(range(pinned)) + list(range(start, len(self.chat_history)))
+
+        if max_tokens is not None:
+            token_counts = [count_tokens(self.chat_history[i].content) for i in keep]
+            total_tokens = sum(token_counts)
+            drop = 0
+            while drop < len(keep) and total_tokens > max_tokens:
+                total_tokens -= token_counts[drop]
+                drop += 1
+            while drop < len(keep) and self.chat_history[keep[drop]].type == "ai":
+                drop += 1
+            pinned = max(0, pinned - drop)
+            keep = keep[drop:]
+
+        if len(keep) < len(self.chat_history):
+            self.chat_history = [self.chat_history[i] for i in keep]
+            self.history_ids = [self.history_ids[i] for i in keep]
+        self.pinned_messages = pinned
+
+    def _drop_history_through(self, upto_message_id: int):
+        """Drop cached messages whose ID is at or below `upto_message_id`."""
+        drop = 0
+        for entry in self.history_ids:
+            if isinstance(entry, Future):
+                if not entry.done():
+                    break
+                entry = entry.result()
+            if entry > upto_message_id:
+                break
+            drop += 1
+        self.chat_history = self.chat_history[drop:]
+        self.history_ids = self.history_ids[drop:]
+
+    def _maybe_start_checkpoint(self):
+        """Start a background checkpoint once the uncheckpointed history crosses the threshold."""
+        if not self.checkpoint_threshold or self.checkpoint_job is not None:
+            return
+
+        # Keep the most recent exchange verbatim; summarize everything before it
+        keep_recent = self.persistence_config.get("checkpoint_keep_recent_messages", 4)
+        fold_count = len(self.chat_history) - keep_recent
+        if fold_count <= 0:
+            return
+        if sum(count_tokens(msg.content) for msg in self.chat_history) < self.checkpoint_threshold:
+            return
+
+        self.checkpoint_job = self.checkpoint_executor.submit(
+            self._generate_checkpoint,
+            self.current_session,
+            self.checkpoint["summary"] if self.checkpoint else "",
+            list(self.chat_history[:fold_count]),
+            self.history_ids[fold_count - 1],
+        )
+
+    def _generate_checkpoint(
+        self, session_id: str, previous_summary: str, messages: list, last_id
+    ) -> dict:
+        """Summarize messages (on the checkpoint thread) and store the checkpoint."""
+        conversation = ""
+        for msg in messages:
+            speaker = "User" if msg.type == "human" else "Assistant"
+            conversation += f"{speaker}: {msg.content}\n"
+
+        summary_prompt = f"""Update the running summary of this conversation.
+
+Current summary:
+{previous_summary or "(none)"}
+
+New messages:
+{conversation}
+Focus on main topics, decisions and key facts. Keep under 300 words."""
+
+        # Background work yields to interactive turns under rate limits
+        summary = self.checkpoint_llm.invoke(
+            [HumanMessage(content=summary_prompt)], priority="batch"
+        ).content
+        upto_message_id = last_id.result() if isinstance(last_id, Future) else last_id
+        self.store.save_checkpoint(session_id, upto_message_id, summary)
+        return {"session_id": session_id, "upto_message_id": upto_message_id, "summary": summary}
+
+    def _apply_checkpoint_job(self, wait: bool = False):
+        """Swap a finished background checkpoint into the cached history."""
+        if self.checkpoint_job is None or not (wait or self.checkpoint_job.done()):
+            return
+
+        job, self.checkpoint_job = self.checkpoint_job, None
+        try:
+            checkpoint = job.result()
+        except Exception as e:
+            print(f"Checkpoint generation failed: {e}")
+            return
+
+        if checkpoint["session_id"] == self.current_session:
+            self.checkpoint = checkpoint
+            self._drop_history_through(checkpoint["upto_message_id"])
+
     def ask(self, user_input: str) -> str:
         """Send message and get response."""
         if not self.memory:
             raise ValueError("No active session. Call start_session() first.")
 
+        # Quota check reads the session catalog, not the stored messages
+        max_session_tokens = self.persistence_config.get("max_session_tokens")
+        if max_session_tokens:
+            info = self.store.get_session_info(self.current_session)
+            if info and info["token_total"] >= max_session_tokens:
+                raise ValueError(
+                    f"Session '{self.current_session}' has reached its quota of "
+                    f"{max_session_tokens:,} tokens. Start a new session to continue."
+                )
+
+        self._apply_checkpoint_job()
+
         # Build messages using cached chat history
         messages = [SystemMessage(content="You are a helpful AI assistant.")]
+        if self.checkpoint:
+            messages.append(
+                SystemMessage(content=f"Summary of earlier conversation: {self.checkpoint['summary']}")
+            )
         messages.extend(self.chat_history)
         messages.append(HumanMessage(content=user_input))
 
         response = self.llm.invoke(messages)
 
-        # Save to persistent memory
-        self.memory.save_context({"input": user_input}, {"output": response.content})
+        # Save to persistent memory (messages and session catalog in one transaction)
+        turn = [HumanMessage(content=user_input), AIMessage(content=response.content)]
+        if self.writer:
+            message_ids = self.writer.submit(self.current_session, turn)
+        else:
+            message_ids = self.store.append_messages(self.current_session, turn)
 
         # Update cached chat history
         self.chat_history.append(HumanMessage(content=user_input))
         self.chat_history.append(response)
+        if self.track_ids:
+            self.history_ids.extend(message_ids)
+        if self.lazy_history:
+            self._trim_history()
+        self._maybe_start_checkpoint()
 
         return response.content
 
+    def flush(self):
+        """Commit any turns still queued by the write-behind writer."""
+        if self.writer:
+            self.writer.flush()
+
+    def close(self):
+        """Flush pending writes and stop the background writer and checkpoint threads this chat created."""
+        if self._owns_writer:
+            self.writer.close()
+        else:
+            self.flush()
+        if self._owns_executor:
+            self.checkpoint_executor.shutdown(wait=True)
+
     def list_sessions(self):
         """List all sessions."""
+        self.flush()
         try:
-            conn = sqlite3.connect(CHAT_HISTORY_DB_FPATH)
-            cursor = conn.cursor()
-
-            # Create table if needed
-            cursor.execute(
-                """
-                CREATE TABLE IF NOT EXISTS message_store (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id TEXT NOT NULL,
-                    message TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """
-            )
+            return self.store.list_session_ids()
+        except:
+            return []
 
-            cursor.execute(
-                "SELECT DISTINCT session_id FROM message_store ORDER BY session_id"
-            )
-            sessions = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            return sessions
+    def list_session_info(self) -> list:
+        """List catalog entries (message count, tokens, activity times) for all sessions."""
+        self.flush()
+        try:
+            return self.store.list_session_info()
         except:
             return []
 
+    def compact_sessions(self, idle_days: float = None) -> dict:
+        """Archive sessions idle for longer than `idle_days` into compressed blobs and vacuum."""
+        self.flush()
+        if idle_days is None:
+            idle_days = self.persistence_config.get("archive_idle_days", 30)
+        return self.store.compact_sessions(idle_days)
+
+    def search_messages(self, terms: str, limit: int = 10) -> list:
+        """Search message content across all sessions, best matches first."""
+        self.flush()
+        try:
+            return self.store.search_messages(terms, limit)
+        except Exception as e:
+            print(f"Error searching messages: {e}")
+            return []
+
     def get_session_messages(self, session_id: str) -> list:
         """Get all messages from a specific session."""
+        self.flush()
         try:
-            # Create temporary history object for the session
-            temp_history = SQLChatMessageHistory(
-                connection=f"sqlite:///{CHAT_HISTORY_DB_FPATH}",
-                session_id=session_id,
-            )
-            return temp_history.messages
+            return self.store.get_messages(session_id)
+        except Exception as e:
+            print(f"Error getting messages for session {session_id}: {e}")
+            return []
+
+    def get_session_messages_page(
+        self, session_id: str, limit: int = 20, before_id: int = None
+    ) -> list:
+        """Get the last `limit` messages of a session, or the page before a message ID.
+
+        Returns a list of (message ID, message) tuples, oldest first.
+        """
+        self.flush()
+        try:
+            return self.store.get_message_page(session_id, limit, before_id)
         except Exception as e:
             print(f"Error getting messages for session {session_id}: {e}")
             return []
 
-    def display_session_messages(self, session_id: str, max_messages: int = None):
-        """Display messages from a session in a readable format."""
-        messages = self.get_session_messages(session_id)
+    def display_session_messages(
+        self, session_id: str, max_messages: int = 20, before_id: int = None
+    ):
+        """Display a page of messages from a session in a readable format.
+
+        Returns the ID of the oldest message shown if older messages remain,
+        so the caller can request the previous page, otherwise None.
+        """
+        # Fetch one extra message to know whether an older page exists
+        page = self.get_session_messages_page(session_id, max_messages + 1, before_id)
 
-        if not messages:
+        if not page:
             print(f"No messages found in session: {session_id}")
-            return
+            return None
+
+        has_older = len(page) > max_messages
+        page = page[-max_messages:]
+        oldest_id = page[0][0]
+        total = self.store.count_messages(session_id)
 
         print(f"\n Messages in session: {session_id}")
         print("=" * 50)
 
-        # Limit messages if specified
-        if max_messages and len(messages) > max_messages:
-            print(f"Showing last {max_messages} of {len(messages)} messages:")
-            messages = messages[-max_messages:]
+        if has_older or before_id is not None:
+            print(f"Showing {len(page)} of {total} messages:")
         else:
-            print(f"Total messages: {len(messages)}")
+            print(f"Total messages: {total}")
 
         print("-" * 50)
 
+        messages = [msg for _, msg in page]
         for i, msg in enumerate(messages, 1):
             # Determine message type
             if hasattr(msg, "type"):
@@ -172,6 +451,11 @@ class ChatWithMemory:
             if i < len(messages):
                 print()
 
+        if has_older:
+            print("\n(Type 'more' to see older messages)")
+            return oldest_id
+        return None
+
 
 def main():
     print("🤖 AI Chat with Persistent Memory")
@@ -179,6 +463,7 @@ def main():
 
     # Ensure output directory exists
     os.makedirs(os.path.dirname(CHAT_HISTORY_DB_FPATH), exist_ok=True)
+    start_metrics_exporters(load_yaml_config(APP_CONFIG_FPATH))
 
     chat = ChatWithMemory()
 
@@ -198,11 +483,18 @@ def main():
     print(f"\n💬 Chatting in session: {chat.current_session}")
     print("Commands:")
     print("  'quit' - exit")
-    print("  'sessions' - list all sessions")
+    print("  'sessions' - list all sessions, most recently active first")
     print("  'history' - show current session messages")
     print("  'view <session_name>' - show messages from specific session")
+    print("  'more' - show older messages from the last 'history' or 'view'")
+    print("  'older [n]' - add the n messages before the current context to it (tail mode)")
+    print("  'search <terms>' - search messages across all sessions")
+    print("  'compact [days]' - archive sessions idle for more than [days] days")
     print("-" * 40)
 
+    # Session and message ID to continue paging from with 'more'
+    paging_session, paging_before_id = None, None
+
     # Chat loop
     while True:
         try:
@@ -212,19 +504,75 @@ def main():
                 print("Goodbye! 👋")
                 break
             elif user_input.lower() == "sessions":
-                sessions = chat.list_sessions()
-                print(f"All sessions: {', '.join(sessions) if sessions else 'None'}")
+                sessions = chat.list_session_info()
+                if not sessions:
+                    print("All sessions: None")
+                for info in sessions:
+                    print(
+                        f"  {info['session_id']}: {info['message_count']} messages, "
+                        f"{info['token_total']:,} tokens, last active {info['last_activity']}"
+                        + (" (archived)" if info["archived"] else "")
+                    )
                 continue
             elif user_input.lower() == "history":
-                chat.display_session_messages(chat.current_session)
+                paging_session = chat.current_session
+                paging_before_id = chat.display_session_messages(paging_session)
                 continue
             elif user_input.lower().startswith("view "):
                 session_to_view = user_input[5:].strip()
                 if session_to_view:
-                    chat.display_session_messages(session_to_view, max_messages=10)
+                    paging_session = session_to_view
+                    paging_before_id = chat.display_session_messages(
+                        session_to_view, max_messages=10
+                    )
                 else:
                     print("Usage: view <session_name>")
                 continue
+            elif user_input.lower().startswith("search "):
+                terms = user_input[7:].strip()
+                hits = chat.search_messages(terms) if terms else []
+                if not terms:
+                    print("Usage: search <terms>")
+                elif not hits:
+                    print(f"No messages found matching: {terms}")
+                for hit in hits:
+                    speaker = "👤 You" if hit["type"] == "human" else "🤖 AI"
+                    print(f"  [{hit['session_id']}] {speaker}: {hit['snippet']}")
+                continue
+            elif user_input.lower() == "compact" or user_input.lower().startswith("compact "):
+                days = user_input[7:].strip()
+                try:
+                    stats = chat.compact_sessions(float(days) if days else None)
+                except ValueError:
+                    print("Usage: compact [days]")
+                    continue
+                print(
+                    f"Archived {stats['sessions']} sessions ({stats['messages']} messages); "
+                    f"database size {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes"
+                )
+                continue
+            elif user_input.lower() == "older" or user_input.lower().startswith("older "):
+                count = user_input[5:].strip()
+                try:
+                    added = chat.load_older_messages(int(count) if count else 20)
+                except ValueError:
+                    print("Usage: older [n]")
+                    continue
+                if added:
+                    print(f"Added {added} older messages to the context ({len(chat.chat_history)} in total)")
+                elif not chat.lazy_history or chat.checkpoint_threshold:
+                    print("'older' only applies in tail history mode without checkpoints.")
+                else:
+                    print("No older messages fit in the context.")
+                continue
+            elif user_input.lower() == "more":
+                if paging_before_id is None:
+                    print("No older messages to show.")
+                else:
+                    paging_before_id = chat.display_session_messages(
+                        paging_session, max_messages=10, before_id=paging_before_id
+                    )
+                continue
             elif user_input:
                 response = chat.ask(user_input)
                 print(f"AI: {response}")
@@ -235,6 +583,9 @@ def main():
         except Exception as e:
             print(f"Error: {e}")
 
+    # Flush any turns still queued in write-behind mode
+    chat.close()
+
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
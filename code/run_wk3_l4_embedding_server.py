@@ -0,0 +1,59 @@
+"""
+Long-lived embedding daemon for the lesson 4 scripts.
+
+Loads the embedding model once and serves it on a Unix domain socket (see
+embedding_service.py). While it runs, `embed_documents` in every other process
+sends its texts here instead of loading torch and the model itself.
+"""
+
+import argparse
+
+from embedding_service import EmbeddingServer, get_service_config
+from metrics import start_metrics_exporters
+from paths import APP_CONFIG_FPATH
+from profiling import run_main
+from run_wk3_l4_vector_db_ingest import get_embedding_model
+from utils import load_yaml_config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding service")
+    parser.add_argument("--socket", help="Socket path (defaults to embedding_service.socket_path)")
+    parser.add_argument("--max-batch-size", type=int, help="Texts per forward pass")
+    parser.add_argument("--max-wait-ms", type=float, help="How long a request waits to be batched")
+    args = parser.parse_args()
+
+    app_config = load_yaml_config(APP_CONFIG_FPATH)
+    service_config = get_service_config(app_config)
+    socket_path = args.socket or service_config["socket_path"]
+
+    start_metrics_exporters(app_config)
+
+    print("Loading embedding model...")
+    model = get_embedding_model()
+    # The first forward pass is slow; take it before accepting clients
+    model.embed_documents(["warm-up"])
+
+    server = EmbeddingServer(
+        socket_path,
+        model.embed_documents,
+        max_batch_size=(
+            args.max_batch_size
+            if args.max_batch_size is not None
+            else service_config.get("max_batch_size", 64)
+        ),
+        max_wait_ms=(
+            args.max_wait_ms if args.max_wait_ms is not None else service_config.get("max_wait_ms", 5.0)
+        ),
+    )
+    print(f"🧠 Embedding service listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    run_main(main)
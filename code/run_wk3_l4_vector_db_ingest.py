@@ -1,11 +1,15 @@
 import os
-import torch
+from functools import lru_cache
 import chromadb
 import shutil
-from paths import VECTOR_DB_DIR
-from langchain_huggingface import HuggingFaceEmbeddings
+from paths import APP_CONFIG_FPATH, VECTOR_DB_DIR
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from utils import load_all_publications
+from embedding_service import EmbeddingServiceUnavailable, get_embedding_client
+from metrics import EMBEDDING_LATENCY, EMBEDDING_REQUESTS, EMBEDDING_TEXTS, start_metrics_exporters
+from profiling import run_main
+from single_flight import SingleFlight
+from utils import load_all_publications, load_yaml_config
+from vector_snapshot import recover_vector_db
 
 
 def initialize_db(
@@ -66,6 +70,8 @@ def get_db_collection(
     Returns:
         chromadb.PersistentClient: The ChromaDB client instance
     """
+    # Finish or roll back a snapshot import interrupted mid-swap
+    recover_vector_db(persist_directory)
     return chromadb.PersistentClient(path=persist_directory).get_collection(
         name=collection_name
     )
@@ -84,21 +90,63 @@ def chunk_publication(
     return text_splitter.split_text(publication)
 
 
-def embed_documents(documents: list[str]) -> list[list[float]]:
+@lru_cache(maxsize=1)
+def get_embedding_model() -> "HuggingFaceEmbeddings":
     """
-    Embed documents using a model.
+    Load the embedding model once per process and reuse it for every call.
+
+    torch and the model are imported here, not at module level, so processes
+    served by the embedding daemon never load them.
     """
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
     device = (
         "cuda"
         if torch.cuda.is_available()
         else "mps" if torch.backends.mps.is_available() else "cpu"
     )
-    model = HuggingFaceEmbeddings(
+    return HuggingFaceEmbeddings(
         model_name="sentence-transformers/all-MiniLM-L6-v2",
         model_kwargs={"device": device},
     )
 
-    embeddings = model.embed_documents(documents)
+
+# Concurrent requests to embed the same text share one embedding pass
+_embedding_flights = SingleFlight()
+
+
+def _embed_batch(documents: list[str]) -> list[list[float]]:
+    """
+    Embed documents with the embedding daemon if it is running, else in-process.
+    """
+    client = get_embedding_client()
+    if client is not None:
+        try:
+            return client.embed(documents)
+        except EmbeddingServiceUnavailable:
+            # Stale socket or daemon shutting down: fall back to a local model
+            pass
+    return get_embedding_model().embed_documents(documents)
+
+
+def embed_documents(documents: list[str]) -> list[list[float]]:
+    """
+    Embed documents using a model.
+
+    Uses the shared embedding daemon when it is running, so the model is only
+    loaded in this process as a fallback. Texts that another thread is already
+    embedding are waited on instead of embedded again; the rest are embedded
+    together in one batch.
+    """
+    EMBEDDING_TEXTS.inc(len(documents))
+    try:
+        with EMBEDDING_LATENCY.time():
+            embeddings = _embedding_flights.do_many(documents, _embed_batch)
+    except Exception:
+        EMBEDDING_REQUESTS.inc(outcome="error")
+        raise
+    EMBEDDING_REQUESTS.inc(outcome="ok")
     return embeddings
 
 
@@ -129,6 +177,7 @@ def insert_publications(collection: chromadb.Collection, publications: list[str]
 
 
 def main():
+    start_metrics_exporters(load_yaml_config(APP_CONFIG_FPATH))
     collection = initialize_db(
         persist_directory=VECTOR_DB_DIR,
         collection_name="publications",
@@ -141,4 +190,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    run_main(main)
@@ -1,11 +1,15 @@
 import os
+import re
 import logging
 from dotenv import load_dotenv
-from utils import load_yaml_config
-from prompt_builder import build_prompt_from_config
-from langchain_groq import ChatGroq
+from utils import ConfigWatcher
+from prompt_builder import build_prompt_with_budget, build_prompt_from_config
+from llm_client import create_llm, get_model_route
+from metrics import VECTORDB_LATENCY, VECTORDB_QUERIES, start_metrics_exporters
+from profiling import run_main
 from paths import APP_CONFIG_FPATH, PROMPT_CONFIG_FPATH, OUTPUTS_DIR
-from run_wk3_l4_vector_db_ingest import get_db_collection, embed_documents
+from run_wk3_l4_vector_db_ingest import embed_documents
+from vector_snapshot import get_vector_index
 
 logger = logging.getLogger()
 
@@ -32,7 +36,8 @@ load_dotenv()
 # To avoid tokenizer parallelism warning from huggingface
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
-collection = get_db_collection(collection_name="publications")
+# Chroma, or a memory-mapped snapshot if vectordb.snapshot_path is set
+collection = get_vector_index(collection_name="publications")
 
 
 def retrieve_relevant_documents(
@@ -63,11 +68,17 @@ def retrieve_relevant_documents(
 
     logging.info("Querying collection...")
     # Query the collection
-    results = collection.query(
-        query_embeddings=[query_embedding],
-        n_results=n_results,
-        include=["documents", "distances"],
-    )
+    try:
+        with VECTORDB_LATENCY.time():
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_results,
+                include=["documents", "distances"],
+            )
+    except Exception:
+        VECTORDB_QUERIES.inc(outcome="error")
+        raise
+    VECTORDB_QUERIES.inc(outcome="ok")
 
     logging.info("Filtering results...")
     keep_item = [False] * len(results["ids"][0])
@@ -87,12 +98,17 @@ def retrieve_relevant_documents(
 def respond_to_query(
     prompt_config: dict,
     query: str,
-    llm: str,
+    llm,
     n_results: int = 5,
     threshold: float = 0.3,
+    max_prompt_tokens: int = None,
 ) -> str:
     """
     Respond to a query using the ChromaDB database.
+
+    llm is a model name or an already created chat model. If
+    max_prompt_tokens is set, the least relevant documents are trimmed
+    first to keep the prompt within that many tokens.
     """
 
     relevant_documents = retrieve_relevant_documents(
@@ -111,57 +127,88 @@ def respond_to_query(
     logging.info("")
     logging.info("-" * 100)
     logging.info("")
-    input_data = (
-        f"Relevant documents:\n\n{relevant_documents}\n\nUser's question:\n\n{query}"
+    # Question first, then one document per paragraph in relevance order, so a
+    # token budget trims the least relevant documents before anything else.
+    # Blank lines inside a chunk are collapsed so the trimmer never splits it.
+    input_data = f"User's question:\n\n{query}\n\nRelevant documents:\n\n" + "\n\n".join(
+        re.sub(r"\n\s*\n", "\n", doc.strip()) for doc in relevant_documents
     )
 
-    rag_assistant_prompt = build_prompt_from_config(
-        prompt_config, input_data=input_data
-    )
+    if max_prompt_tokens:
+        rag_assistant_prompt, report = build_prompt_with_budget(
+            prompt_config, input_data, max_prompt_tokens
+        )
+        if report["content_tokens_removed"] or report["dropped_sections"]:
+            logging.info(f"Prompt trimmed to fit {max_prompt_tokens} tokens: {report}")
+    else:
+        rag_assistant_prompt = build_prompt_from_config(
+            prompt_config, input_data=input_data
+        )
 
     logging.info(f"RAG assistant prompt: {rag_assistant_prompt}")
     logging.info("")
 
-    llm = ChatGroq(model=llm)
+    if isinstance(llm, str):
+        llm = create_llm(llm)
 
     response = llm.invoke(rag_assistant_prompt)
     return response.content
 
 
-if __name__ == "__main__":
+def main():
     setup_logging()
-    app_config = load_yaml_config(APP_CONFIG_FPATH)
-    prompt_config = load_yaml_config(PROMPT_CONFIG_FPATH)
 
-    rag_assistant_prompt = prompt_config["rag_assistant_prompt"]
+    # Edits to config.yaml and prompt_config.yaml apply without a restart
+    config_watcher = ConfigWatcher(
+        [APP_CONFIG_FPATH, PROMPT_CONFIG_FPATH],
+        on_change=lambda fpath, _: logging.info(f"Reloaded config: {fpath}"),
+    ).start()
+    start_metrics_exporters(config_watcher.get(APP_CONFIG_FPATH))
 
-    vectordb_params = app_config["vectordb"]
-    llm = app_config["llm"]
+    # Parameters set with 'config' apply until config.yaml changes again
+    vectordb_override, override_app_config = None, None
 
-    exit_app = False
-    while not exit_app:
+    while True:
         query = input(
             "Enter a question, 'config' to change the parameters, or 'exit' to quit: "
         )
         if query == "exit":
-            exit_app = True
-            exit()
+            break
 
-        elif query == "config":
+        app_config = config_watcher.get(APP_CONFIG_FPATH)
+        prompt_config = config_watcher.get(PROMPT_CONFIG_FPATH)
+
+        if query == "config":
             threshold = float(input("Enter the retrieval threshold: "))
             n_results = int(input("Enter the Top K value: "))
-            vectordb_params = {
+            vectordb_override = {
                 "threshold": threshold,
                 "n_results": n_results,
             }
+            override_app_config = app_config
             continue
 
+        if vectordb_override and override_app_config is app_config:
+            vectordb_params = vectordb_override
+        else:
+            vectordb_params = {
+                "threshold": app_config["vectordb"]["threshold"],
+                "n_results": app_config["vectordb"]["n_results"],
+            }
+
         response = respond_to_query(
-            prompt_config=rag_assistant_prompt,
+            prompt_config=prompt_config["rag_assistant_prompt"],
             query=query,
-            llm=llm,
+            llm=get_model_route("answer", app_config)["model"],
+            max_prompt_tokens=app_config.get("rag_prompt", {}).get("max_tokens"),
             **vectordb_params,
         )
         logging.info("-" * 100)
         logging.info("LLM response:")
         logging.info(response + "\n\n")
+
+    config_watcher.stop()
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,78 @@
+"""
+Export the vector DB to a single-file snapshot, import one back, or inspect one.
+
+    python run_wk3_l4_vector_db_snapshot.py export [--output PATH]
+    python run_wk3_l4_vector_db_snapshot.py import [--input PATH]
+    python run_wk3_l4_vector_db_snapshot.py info [PATH]
+
+To serve RAG queries straight from a snapshot, set `vectordb.snapshot_path`
+in config.yaml.
+"""
+
+import argparse
+import os
+
+from metrics import start_metrics_exporters
+from paths import APP_CONFIG_FPATH, VECTOR_DB_DIR, VECTOR_SNAPSHOT_FPATH
+from profiling import run_main
+from utils import load_yaml_config
+from vector_snapshot import VectorSnapshot, export_collection, import_snapshot
+
+
+def export_command(args):
+    from run_wk3_l4_vector_db_ingest import get_db_collection
+
+    collection = get_db_collection(persist_directory=args.db_dir, collection_name=args.collection)
+    size = export_collection(collection, args.output)
+    print(
+        f"✓ Exported {collection.count()} records from '{args.collection}' "
+        f"to {args.output} ({size / 1024 / 1024:.1f} MiB)"
+    )
+
+
+def import_command(args):
+    collection = import_snapshot(
+        args.input, persist_directory=args.db_dir, collection_name=args.collection
+    )
+    print(f"✓ Imported {collection.count()} records into '{collection.name}' at {args.db_dir}")
+
+
+def info_command(args):
+    snapshot = VectorSnapshot(args.path)
+    try:
+        print(f"Snapshot: {args.path} ({os.path.getsize(args.path) / 1024 / 1024:.1f} MiB)")
+        print(
+            f"Collection: {snapshot.name} | Records: {snapshot.count} | "
+            f"Dim: {snapshot.dim} | Space: {snapshot.space}"
+        )
+        print(f"Checksum: {'ok' if snapshot.verify() else 'MISMATCH'}")
+    finally:
+        snapshot.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single-file vector DB snapshots")
+    parser.add_argument("--db-dir", default=VECTOR_DB_DIR, help="Chroma persist directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write the collection to a snapshot file")
+    export_parser.add_argument("--output", default=VECTOR_SNAPSHOT_FPATH)
+    export_parser.add_argument("--collection", default="publications")
+    export_parser.set_defaults(handler=export_command)
+
+    import_parser = subparsers.add_parser("import", help="Replace the Chroma collection with a snapshot")
+    import_parser.add_argument("--input", default=VECTOR_SNAPSHOT_FPATH)
+    import_parser.add_argument("--collection", help="Collection name (defaults to the snapshot's)")
+    import_parser.set_defaults(handler=import_command)
+
+    info_parser = subparsers.add_parser("info", help="Describe a snapshot and verify its checksum")
+    info_parser.add_argument("path", nargs="?", default=VECTOR_SNAPSHOT_FPATH)
+    info_parser.set_defaults(handler=info_command)
+
+    args = parser.parse_args()
+    start_metrics_exporters(load_yaml_config(APP_CONFIG_FPATH))
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    run_main(main)
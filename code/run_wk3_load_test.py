@@ -0,0 +1,411 @@
+"""
+Concurrent multi-user load test for the persistent chat and the RAG assistant.
+
+Simulates N users, each running its own session in a thread. Every user draws
+questions from data/*-sample-questions.yaml and pauses for a randomized think
+time between turns. Users start evenly spread over a ramp-up period. The LLM is
+either the local stand-in, which has a configurable latency and no rate limits,
+or the real Groq backend.
+
+Per stage (session start, LLM call, the rest of the turn, end-to-end turn),
+the report gives throughput, latency percentiles and error rates. It is saved
+to OUTPUTS_DIR as JSON and markdown.
+
+Chat sessions are written to the chat history database as `loadtest_<run>_<n>`.
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from llm_client import CallScheduler, ScheduledLLM, get_llm
+from local_llm import LocalStandInLLM
+from metrics import start_metrics_exporters
+from paths import APP_CONFIG_FPATH, DATA_DIR, OUTPUTS_DIR, PROMPT_CONFIG_FPATH
+from profiling import run_main
+from utils import load_env, load_yaml_config, percentile, save_text_to_file
+
+TARGETS = ("chat", "rag")
+BACKENDS = ("local", "groq")
+
+# Time spent in a turn outside the LLM call, per target
+OVERHEAD_STAGES = {"chat": "history_and_persistence", "rag": "retrieval_and_prompt"}
+
+
+class StageRecorder:
+    """Thread-safe collection of latencies and errors per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def record_error(self, stage: str, error: Exception):
+        with self._lock:
+            self.errors[stage][type(error).__name__] += 1
+
+    def timed(self, stage: str, fn: Callable[[], Any]) -> Any:
+        """Call `fn`, recording its latency (or its error) under `stage`."""
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            self.record_error(stage, e)
+            raise
+        self.record(stage, time.perf_counter() - start)
+        return result
+
+
+class TimedLLM:
+    """Chat model wrapper recording each `invoke` under a stage.
+
+    The duration of the calling thread's most recent call is kept in
+    `last_seconds`, so a turn can subtract it from its own latency.
+    """
+
+    def __init__(self, llm, recorder: StageRecorder, stage: str = "llm"):
+        self.llm = llm
+        self.recorder = recorder
+        self.stage = stage
+        self._local = threading.local()
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    @property
+    def last_seconds(self) -> float:
+        return getattr(self._local, "seconds", 0.0)
+
+    def reset(self):
+        self._local.seconds = 0.0
+
+    def invoke(self, messages, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.recorder.timed(self.stage, lambda: self.llm.invoke(messages, **kwargs))
+        finally:
+            self._local.seconds = getattr(self._local, "seconds", 0.0) + time.perf_counter() - start
+
+
+def load_sample_questions(data_dir: str = DATA_DIR) -> List[str]:
+    """Returns the questions from every *-sample-questions.yaml file in a directory."""
+    questions = []
+    for fpath in sorted(glob.glob(os.path.join(data_dir, "*-sample-questions.yaml"))):
+        questions.extend(load_yaml_config(fpath).get("questions", []))
+    if not questions:
+        raise FileNotFoundError(f"No sample questions found in {data_dir}")
+    return questions
+
+
+def create_backend_llms(backend: str, app_config: dict, local_latency: float):
+    """Returns the (answer, checkpoint) chat models for a backend.
+
+    Coalescing is turned off: users who ask the same question at the same
+    time would otherwise share one backend call, overstating what the
+    backend sustains.
+    """
+    if backend == "local":
+        # Unlimited scheduler: no rate limits, but the same metrics as Groq calls
+        stand_in = LocalStandInLLM(latency_seconds=local_latency)
+        llm = ScheduledLLM(stand_in, CallScheduler(name=stand_in.model_name), coalesce=False)
+        return llm, llm
+    load_env()
+    return tuple(
+        ScheduledLLM(
+            llm.llm,
+            llm.scheduler,
+            llm.priority,
+            llm.expected_output_tokens,
+            llm.cache,
+            coalesce=False,
+        )
+        for llm in (
+            get_llm("answer", temperature=0.7, app_config=app_config),
+            get_llm("checkpoint", temperature=0.7, app_config=app_config),
+        )
+    )
+
+
+def make_chat_session(app_config: dict, llm: TimedLLM, checkpoint_llm: TimedLLM, recorder: StageRecorder):
+    """Returns a factory creating one persistent chat session per simulated user."""
+    from run_wk3_l3b_memory_persistence import ChatWithMemory
+
+    def create(session_id: str):
+        chat = ChatWithMemory(llm=llm, checkpoint_llm=checkpoint_llm, app_config=app_config)
+        recorder.timed("session_start", lambda: chat.start_session(session_id))
+        return chat.ask, chat.close
+
+    return create
+
+
+def make_rag_session(app_config: dict, llm: TimedLLM, checkpoint_llm: TimedLLM, recorder: StageRecorder):
+    """Returns a factory creating one RAG session per simulated user."""
+    # Imported here so the chat target runs without the embedding model dependencies
+    from run_wk3_l4_vector_db_rag import respond_to_query
+
+    prompt_config = load_yaml_config(PROMPT_CONFIG_FPATH)["rag_assistant_prompt"]
+    max_prompt_tokens = app_config.get("rag_prompt", {}).get("max_tokens")
+
+    def create(session_id: str):
+        def ask(question: str) -> str:
+            return respond_to_query(
+                prompt_config=prompt_config,
+                query=question,
+                llm=llm,
+                max_prompt_tokens=max_prompt_tokens,
+                n_results=app_config["vectordb"]["n_results"],
+                threshold=app_config["vectordb"]["threshold"],
+            )
+
+        return ask, lambda: None
+
+    return create
+
+
+SESSION_FACTORIES = {"chat": make_chat_session, "rag": make_rag_session}
+
+
+def run_user(
+    user_num: int,
+    session_id: str,
+    create_session: Callable,
+    llm: TimedLLM,
+    recorder: StageRecorder,
+    questions: List[str],
+    overhead_stage: str,
+    start_delay: float,
+    turns: int,
+    deadline: Optional[float],
+    think_time: float,
+    seed: int,
+) -> int:
+    """Run one simulated user's session; returns the number of completed turns."""
+    rng = random.Random(seed + user_num)
+    time.sleep(start_delay)
+    try:
+        ask, close = create_session(session_id)
+    except Exception as e:
+        print(f"  ❌ User {user_num}: could not start session: {e}")
+        return 0
+
+    completed = 0
+    try:
+        for turn in range(turns):
+            if deadline and time.perf_counter() >= deadline:
+                break
+            if turn:
+                # Uniform think time around the mean, so users drift out of lockstep
+                time.sleep(rng.uniform(0.5, 1.5) * think_time)
+
+            llm.reset()
+            start = time.perf_counter()
+            try:
+                recorder.timed("turn", lambda: ask(rng.choice(questions)))
+            except Exception as e:
+                print(f"  ⚠️ User {user_num}, turn {turn + 1}: {type(e).__name__}: {e}")
+                continue
+            recorder.record(overhead_stage, time.perf_counter() - start - llm.last_seconds)
+            completed += 1
+    finally:
+        close()
+    return completed
+
+
+def summarize_stages(recorder: StageRecorder, wall_seconds: float) -> Dict[str, Dict[str, Any]]:
+    """Returns throughput, latency percentiles (ms) and error rate per stage."""
+    stages = {}
+    for stage in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies_ms = [s * 1000 for s in recorder.latencies.get(stage, [])]
+        errors = dict(recorder.errors.get(stage, {}))
+        num_errors = sum(errors.values())
+        total = len(latencies_ms) + num_errors
+        stages[stage] = {
+            "count": len(latencies_ms),
+            "throughput_per_s": len(latencies_ms) / wall_seconds if wall_seconds else 0.0,
+            "errors": num_errors,
+            "error_rate": num_errors / total if total else 0.0,
+            "error_types": errors,
+            "mean_ms": sum(latencies_ms) / len(latencies_ms) if latencies_ms else 0.0,
+            "p50_ms": percentile(latencies_ms, 50),
+            "p90_ms": percentile(latencies_ms, 90),
+            "p95_ms": percentile(latencies_ms, 95),
+            "p99_ms": percentile(latencies_ms, 99),
+            "max_ms": max(latencies_ms, default=0.0),
+        }
+    return stages
+
+
+def save_load_test_report(report: Dict[str, Any]):
+    """Save the report as JSON and as a markdown table."""
+    base_name = f"load_test_{report['target']}_{report['backend']}"
+    os.makedirs(OUTPUTS_DIR, exist_ok=True)
+    with open(os.path.join(OUTPUTS_DIR, f"{base_name}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    content = [
+        f"Target: {report['target']}  ",
+        f"Backend: {report['backend']} ({report['model']})  ",
+        f"Users: {report['users']} | Turns per user: {report['turns_per_user']} | "
+        f"Think time: {report['think_time_seconds']}s | Ramp-up: {report['ramp_up_seconds']}s  ",
+        f"Wall time: {report['wall_seconds']:.1f}s | Completed turns: {report['completed_turns']} | "
+        f"Throughput: {report['turns_per_second']:.2f} turns/s",
+        "",
+        "| Stage | Count | Errors | Error rate | Mean ms | p50 ms | p90 ms | p95 ms | p99 ms | Max ms |",
+        "|-------|-------|--------|------------|---------|--------|--------|--------|--------|--------|",
+    ]
+    for stage, s in report["stages"].items():
+        content.append(
+            f"| {stage} | {s['count']} | {s['errors']} | {s['error_rate']:.1%} | {s['mean_ms']:.1f} | "
+            f"{s['p50_ms']:.1f} | {s['p90_ms']:.1f} | {s['p95_ms']:.1f} | {s['p99_ms']:.1f} | {s['max_ms']:.1f} |"
+        )
+    content.append("")
+
+    save_text_to_file(
+        "\n".join(content),
+        os.path.join(OUTPUTS_DIR, f"{base_name}.md"),
+        header=f"Load Test: {report['target']} ({report['backend']})",
+    )
+    print(f"✓ Report saved to {base_name}.json and {base_name}.md")
+
+
+def run_load_test(
+    target: str,
+    backend: str,
+    users: int,
+    turns: int,
+    duration: Optional[float],
+    think_time: float,
+    ramp_up: float,
+    local_latency: float,
+    seed: int,
+    app_config: dict,
+) -> Dict[str, Any]:
+    """Run the simulated users to completion and return the report."""
+    recorder = StageRecorder()
+    answer_llm, checkpoint_llm = create_backend_llms(backend, app_config, local_latency)
+    llm = TimedLLM(answer_llm, recorder, "llm")
+    create_session = SESSION_FACTORIES[target](
+        app_config, llm, TimedLLM(checkpoint_llm, recorder, "checkpoint_llm"), recorder
+    )
+    questions = load_sample_questions()
+    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    print(
+        f"\n🚦 Load test: {users} users x {turns} turns against {target} ({backend}), "
+        f"ramp-up {ramp_up}s, think time {think_time}s"
+    )
+    start = time.perf_counter()
+    deadline = start + duration if duration else None
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [
+            executor.submit(
+                run_user,
+                user_num,
+                f"loadtest_{run_id}_{user_num:03d}",
+                create_session,
+                llm,
+                recorder,
+                questions,
+                OVERHEAD_STAGES[target],
+                ramp_up * user_num / users,
+                turns,
+                deadline,
+                think_time,
+                seed,
+            )
+            for user_num in range(users)
+        ]
+        completed_turns = sum(future.result() for future in futures)
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "target": target,
+        "backend": backend,
+        "model": answer_llm.model_name,
+        "users": users,
+        "turns_per_user": turns,
+        "duration_seconds": duration,
+        "think_time_seconds": think_time,
+        "ramp_up_seconds": ramp_up,
+        "wall_seconds": wall_seconds,
+        "completed_turns": completed_turns,
+        "turns_per_second": completed_turns / wall_seconds if wall_seconds else 0.0,
+        "stages": summarize_stages(recorder, wall_seconds),
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    """Print the per-stage summary."""
+    print(
+        f"\n📊 {report['completed_turns']} turns in {report['wall_seconds']:.1f}s "
+        f"({report['turns_per_second']:.2f} turns/s)"
+    )
+    for stage, s in report["stages"].items():
+        print(
+            f"  {stage:<26} n={s['count']:<5} p50={s['p50_ms']:8.1f}ms p95={s['p95_ms']:8.1f}ms "
+            f"p99={s['p99_ms']:8.1f}ms errors={s['error_rate']:.1%}"
+        )
+
+
+def main():
+    app_config = load_yaml_config(APP_CONFIG_FPATH)
+    load_config = app_config.get("load_test", {})
+
+    parser = argparse.ArgumentParser(description="Multi-user load test for the chat and RAG assistants")
+    parser.add_argument("--target", choices=TARGETS, default="chat", help="System under test")
+    parser.add_argument(
+        "--backend", choices=BACKENDS, default="local", help="Local LLM stand-in or the Groq API"
+    )
+    parser.add_argument("--users", type=int, default=load_config.get("users", 10))
+    parser.add_argument("--turns", type=int, default=load_config.get("turns_per_user", 5))
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=load_config.get("duration_seconds"),
+        help="Stop starting new turns after this many seconds",
+    )
+    parser.add_argument("--think-time", type=float, default=load_config.get("think_time_seconds", 2.0))
+    parser.add_argument("--ramp-up", type=float, default=load_config.get("ramp_up_seconds", 10.0))
+    parser.add_argument(
+        "--local-latency", type=float, default=load_config.get("local_latency_seconds", 0.5)
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed for question and think-time choices")
+    args = parser.parse_args()
+    # Checked after parsing so defaults from config.yaml are validated too
+    if args.users < 1:
+        parser.error(f"--users must be at least 1, got {args.users}")
+    if args.turns < 1:
+        parser.error(f"--turns must be at least 1, got {args.turns}")
+
+    start_metrics_exporters(app_config)
+
+    report = run_load_test(
+        target=args.target,
+        backend=args.backend,
+        users=args.users,
+        turns=args.turns,
+        duration=args.duration,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        local_latency=args.local_latency,
+        seed=args.seed,
+        app_config=app_config,
+    )
+    print_report(report)
+    save_load_test_report(report)
+
+
+if __name__ == "__main__":
+    run_main(main)
@@ -0,0 +1,103 @@
+"""
+In-flight request coalescing ("single flight").
+
+When several threads make the same expensive call at the same time, only the
+first one (the leader) runs it; the others wait on the leader's future and get
+its result or exception. Nothing is cached: once the call finishes, the next
+identical request runs again.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List, Sequence
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome with concurrent callers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.coalesced = 0  # Requests answered by another caller's in-flight call
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run `fn`, or wait for the identical call already in flight under `key`.
+
+        Args:
+            key: Identity of the request.
+            fn: The call to make if no identical call is in flight.
+
+        Returns:
+            The result of `fn` (possibly from another caller's run).
+
+        Raises:
+            Exception: Whatever `fn` raised, for the leader and every waiter.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def do_many(
+        self, keys: Sequence[Hashable], fn: Callable[[List[Hashable]], List[Any]]
+    ) -> List[Any]:
+        """Batch form of `do`: one result per key, computing only keys nobody else is computing.
+
+        Keys already in flight are waited on. The remaining unique keys are
+        claimed and passed to `fn` in a single call, so batching is preserved.
+
+        Args:
+            keys: Identities of the requests.
+            fn: Called with the claimed keys; must return one result per key, in order.
+
+        Returns:
+            Results aligned with `keys`.
+        """
+        futures: Dict[Hashable, Future] = {}
+        claimed: List[Hashable] = []
+        with self._lock:
+            for key in keys:
+                if key in futures:
+                    continue
+                future = self._calls.get(key)
+                if future is None:
+                    future = self._calls[key] = Future()
+                    claimed.append(key)
+                else:
+                    self.coalesced += 1
+                futures[key] = future
+
+        if claimed:
+            try:
+                results = fn(claimed)
+            except BaseException as e:
+                for key in claimed:
+                    futures[key].set_exception(e)
+                raise
+            else:
+                for key, result in zip(claimed, results):
+                    futures[key].set_result(result)
+            finally:
+                with self._lock:
+                    for key in claimed:
+                        del self._calls[key]
+
+        return [futures[key].result() for key in keys]
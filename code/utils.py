@@ -1,15 +1,22 @@
 import os
+import threading
 import yaml
+import tiktoken
 from dotenv import load_dotenv
+from functools import lru_cache
 from pathlib import Path
-from typing import Union, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from paths import DATA_DIR, PUBLICATION_FPATH, ENV_FPATH
+from publication_store import get_publication_store
 
 
 def load_publication(publication_external_id="yzN0OCQT7hUS"):
     """Loads the publication markdown file.
 
+    Publications are served from the memory-mapped publication store, which
+    is rebuilt automatically when the markdown files change.
+
     Returns:
         Content of the publication as a string.
 
@@ -17,17 +24,11 @@ def load_publication(publication_external_id="yzN0OCQT7hUS"):
         FileNotFoundError: If the file does not exist.
         IOError: If there's an error reading the file.
     """
-    publication_fpath = Path(os.path.join(DATA_DIR, f"{publication_external_id}.md"))
-
-    # Check if file exists
-    if not publication_fpath.exists():
-        raise FileNotFoundError(f"Publication file not found: {publication_fpath}")
-
-    # Read and return the file content
     try:
-        with open(publication_fpath, "r", encoding="utf-8") as file:
-            return file.read()
-    except IOError as e:
+        return get_publication_store().get_text(publication_external_id)
+    except FileNotFoundError:
+        raise
+    except (IOError, UnicodeDecodeError) as e:
         raise IOError(f"Error reading publication file: {e}") from e
 
 
@@ -35,20 +36,26 @@ def load_all_publications(publication_dir: str = DATA_DIR) -> list[str]:
     """Loads all the publication markdown files in the given directory.
 
     Returns:
-        List of publication contents.
+        List of publication contents, ordered by publication ID.
     """
-    publications = []
-    for pub_id in os.listdir(publication_dir):
-        if pub_id.endswith(".md"):
-            publications.append(load_publication(pub_id.replace(".md", "")))
-    return publications
+    store = get_publication_store(publication_dir)
+    return [store.get_text(pub_id) for pub_id in store.ids()]
 
 
-def load_yaml_config(file_path: Union[str, Path]) -> dict:
+_yaml_cache: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+_yaml_cache_lock = threading.Lock()
+
+
+def load_yaml_config(file_path: Union[str, Path], use_cache: bool = True) -> dict:
     """Loads a YAML configuration file.
 
+    Parsed files are cached by path, modification time and size, so repeated
+    loads of an unchanged file only cost a `stat`. Cached configs are shared
+    between callers and must be treated as read-only.
+
     Args:
         file_path: Path to the YAML file.
+        use_cache: Whether to reuse a cached parse of an unchanged file.
 
     Returns:
         Parsed YAML content as a dictionary.
@@ -61,18 +68,113 @@ def load_yaml_config(file_path: Union[str, Path]) -> dict:
     file_path = Path(file_path)
 
     # Check if file exists
-    if not file_path.exists():
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
         raise FileNotFoundError(f"YAML config file not found: {file_path}")
 
+    cache_key = str(file_path.resolve())
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if use_cache:
+        cached = _yaml_cache.get(cache_key)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
     # Read and parse the YAML file
     try:
         with open(file_path, "r", encoding="utf-8") as file:
-            return yaml.safe_load(file)
+            config = yaml.safe_load(file)
     except yaml.YAMLError as e:
         raise yaml.YAMLError(f"Error parsing YAML file: {e}") from e
     except IOError as e:
         raise IOError(f"Error reading YAML file: {e}") from e
 
+    with _yaml_cache_lock:
+        _yaml_cache[cache_key] = (signature, config)
+    return config
+
+
+class ConfigWatcher:
+    """Hot-reloads YAML config files into a long-lived process.
+
+    A daemon thread polls the files' modification times and reloads any file
+    that changed. Readers call `get` to see the latest successfully parsed
+    version; a file that fails to parse (or is empty) keeps its previous version.
+    """
+
+    def __init__(
+        self,
+        file_paths: List[Union[str, Path]],
+        on_change: Optional[Callable[[str, dict], None]] = None,
+        interval: float = 1.0,
+    ):
+        """Initialize the watcher and load the files.
+
+        Args:
+            file_paths: YAML files to watch.
+            on_change: Optional callback called with (file path, new config) after a reload.
+            interval: Seconds between modification time checks.
+        """
+        self.on_change = on_change
+        self.interval = interval
+        self._configs = {str(path): load_yaml_config(path) for path in file_paths}
+        self._signatures = {path: self._signature(path) for path in self._configs}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+
+    @staticmethod
+    def _signature(file_path: str) -> Optional[Tuple[int, int]]:
+        """Returns the (mtime, size) of a file, or None if it is missing."""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, file_path: Union[str, Path]) -> dict:
+        """Returns the latest loaded config for a watched file."""
+        return self._configs[str(file_path)]
+
+    def start(self) -> "ConfigWatcher":
+        """Start polling in the background."""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop polling."""
+        self._stop.set()
+
+    def check(self) -> List[str]:
+        """Reload any watched file that changed since the last check.
+
+        Returns:
+            Paths of the files that were reloaded.
+        """
+        reloaded = []
+        for path in self._configs:
+            signature = self._signature(path)
+            if signature is None or signature == self._signatures[path]:
+                continue
+            self._signatures[path] = signature
+            try:
+                config = load_yaml_config(path)
+            except (yaml.YAMLError, IOError) as e:
+                print(f"Keeping previous config for {path}: {e}")
+                continue
+            if config is None:
+                # Empty file, typically caught mid-write by an editor
+                continue
+            self._configs[path] = config
+            reloaded.append(path)
+            if self.on_change:
+                self.on_change(path, config)
+        return reloaded
+
+    def _run(self):
+        """Poll the watched files until stopped."""
+        while not self._stop.wait(self.interval):
+            self.check()
+
 
 def load_env(api_key_type="GROQ_API_KEY") -> None:
     """Loads environment variables from a .env file and checks for required keys.
@@ -118,3 +220,42 @@ def save_text_to_file(
 
     except IOError as e:
         raise IOError(f"Error writing to file {filepath}: {e}") from e
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Returns the tiktoken encoding for a model, or None if it cannot be loaded.
+
+    The result (including a failure) is cached so the encoding is only looked
+    up once per process.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """Counts tokens using tiktoken, falling back to a word-based estimate.
+
+    Args:
+        text: The text to measure.
+        model: Model name used to select the tiktoken encoding.
+
+    Returns:
+        The (estimated) number of tokens in the text.
+    """
+    encoding = _get_encoding(model)
+    if encoding is None:
+        # Fallback estimation
+        return int(len(text.split()) * 1.3)
+    return len(encoding.encode(text, disallowed_special=()))
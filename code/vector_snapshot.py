@@ -0,0 +1,389 @@
+"""
+Single-file snapshots of a vector DB collection.
+
+A snapshot holds a collection's IDs, documents, metadata and embeddings in one
+versioned file, so an index can be shipped and swapped atomically instead of
+copying Chroma's persist directory. The embeddings are stored as an aligned
+float32 block. `VectorSnapshot` memory-maps that block and answers queries
+from it directly, with no Chroma client and no index build at startup.
+
+File layout (little-endian):
+    magic        8 bytes, b"WK3VSNAP"
+    version      uint32
+    header_len   uint32
+    header       UTF-8 JSON: collection name and metadata, count, dim, distance
+                 space, ids, documents, metadatas and a SHA-256 of the blocks
+    padding      zeros up to a 64-byte boundary
+    embeddings   count x dim float32
+    norms        count float32, the L2 norm of each embedding
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from paths import APP_CONFIG_FPATH, ROOT_DIR, VECTOR_DB_DIR
+from utils import load_yaml_config
+
+SNAPSHOT_MAGIC = b"WK3VSNAP"
+# Bump when the layout changes; readers reject other versions
+SNAPSHOT_VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+ALIGNMENT = 64
+DTYPE = np.dtype("<f4")
+SPACES = ("cosine", "l2", "ip")
+# Suffix of the per-process directories imports are built in, followed by "<pid>-<ns>"
+IMPORTING_SUFFIX = ".importing-"
+
+
+def _data_offset(header_len: int) -> int:
+    """Returns the aligned offset of the embeddings block."""
+    end = PREAMBLE.size + header_len
+    return (end + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_snapshot(
+    fpath: str,
+    ids: Sequence[str],
+    embeddings: np.ndarray,
+    documents: Sequence[Optional[str]],
+    metadatas: Sequence[Optional[Dict[str, Any]]],
+    collection_name: str,
+    collection_metadata: Optional[Dict[str, Any]] = None,
+) -> int:
+    """Write a snapshot file atomically.
+
+    Args:
+        fpath: Destination path; replaced only once the new file is complete.
+        ids: Record IDs.
+        embeddings: Array of shape (count, dim).
+        documents: Document text per record.
+        metadatas: Metadata per record.
+        collection_name: Name of the source collection.
+        collection_metadata: Metadata of the source collection (e.g. "hnsw:space").
+
+    Returns:
+        Size of the written file in bytes.
+    """
+    block = np.ascontiguousarray(embeddings, dtype=DTYPE)
+    if block.ndim != 2 or block.shape[0] != len(ids):
+        raise ValueError(f"Expected embeddings of shape ({len(ids)}, dim), got {block.shape}")
+    norms = np.linalg.norm(block, axis=1).astype(DTYPE) if len(block) else np.zeros(0, DTYPE)
+    data = block.tobytes() + norms.tobytes()
+
+    collection_metadata = collection_metadata or {}
+    header = json.dumps(
+        {
+            "collection": collection_name,
+            "collection_metadata": collection_metadata,
+            "space": collection_metadata.get("hnsw:space", "l2"),
+            "count": block.shape[0],
+            "dim": block.shape[1],
+            "dtype": DTYPE.str,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "ids": list(ids),
+            "documents": list(documents),
+            "metadatas": list(metadatas),
+        }
+    ).encode("utf-8")
+
+    offset = _data_offset(len(header))
+    fpath = os.path.abspath(fpath)
+    os.makedirs(os.path.dirname(fpath), exist_ok=True)
+    # A unique temp name, so concurrent exports to the same path don't overwrite each other
+    fd, tmp_fpath = tempfile.mkstemp(
+        dir=os.path.dirname(fpath), prefix=f"{os.path.basename(fpath)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+            f.write(header)
+            f.write(b"\0" * (offset - PREAMBLE.size - len(header)))
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fpath, fpath)
+    except BaseException:
+        try:
+            os.unlink(tmp_fpath)
+        except FileNotFoundError:
+            pass
+        raise
+    return offset + len(data)
+
+
+class VectorSnapshot:
+    """Read-only, memory-mapped view of a snapshot file with Chroma-style queries."""
+
+    def __init__(self, fpath: str):
+        """Map a snapshot file.
+
+        Raises:
+            ValueError: If the file is not a snapshot or has an unsupported version.
+        """
+        self.fpath = fpath
+        with open(fpath, "rb") as f:
+            magic, version, header_len = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"Not a vector snapshot: {fpath}")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(
+                    f"Unsupported snapshot version {version} (expected {SNAPSHOT_VERSION}): {fpath}"
+                )
+            header = json.loads(f.read(header_len))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.name: str = header["collection"]
+        self.metadata: Dict[str, Any] = header["collection_metadata"]
+        self.space: str = header["space"]
+        self.count: int = header["count"]
+        self.dim: int = header["dim"]
+        self.sha256: str = header["sha256"]
+        self.ids: List[str] = header["ids"]
+        self.documents: List[Optional[str]] = header["documents"]
+        self.metadatas: List[Optional[Dict[str, Any]]] = header["metadatas"]
+        if self.space not in SPACES:
+            raise ValueError(f"Unknown distance space: {self.space}")
+
+        self._offset = _data_offset(header_len)
+        self.embeddings = np.frombuffer(
+            self._mmap, dtype=DTYPE, count=self.count * self.dim, offset=self._offset
+        ).reshape(self.count, self.dim)
+        self.norms = np.frombuffer(
+            self._mmap,
+            dtype=DTYPE,
+            count=self.count,
+            offset=self._offset + self.count * self.dim * DTYPE.itemsize,
+        )
+
+    def verify(self) -> bool:
+        """Returns True if the embedding blocks match the checksum in the header."""
+        size = self.count * (self.dim + 1) * DTYPE.itemsize
+        digest = hashlib.sha256(self._mmap[self._offset : self._offset + size]).hexdigest()
+        return digest == self.sha256
+
+    def _distances(self, query: np.ndarray) -> np.ndarray:
+        """Returns the distance of every record to each query, shape (queries, count)."""
+        dots = query @ self.embeddings.T
+        if self.space == "ip":
+            return 1.0 - dots
+        query_norms = np.linalg.norm(query, axis=1, keepdims=True)
+        if self.space == "cosine":
+            denominators = np.maximum(query_norms * self.norms, np.finfo(DTYPE).tiny)
+            return 1.0 - dots / denominators
+        # Squared L2, as reported by Chroma
+        return np.maximum(query_norms**2 + self.norms**2 - 2.0 * dots, 0.0)
+
+    def query(
+        self,
+        query_embeddings: Sequence[Sequence[float]],
+        n_results: int = 10,
+        include: Sequence[str] = ("documents", "metadatas", "distances"),
+    ) -> Dict[str, Optional[List[List[Any]]]]:
+        """Find the nearest records by exact search, mirroring `chromadb.Collection.query`.
+
+        Args:
+            query_embeddings: One embedding per query.
+            n_results: Results per query.
+            include: Any of "documents", "metadatas", "distances" and "embeddings".
+
+        Returns:
+            Dictionary with "ids" and the included fields, each a list per query.
+        """
+        queries = np.asarray(query_embeddings, dtype=DTYPE).reshape(-1, self.dim)
+        k = min(n_results, self.count)
+        results: Dict[str, Optional[List[List[Any]]]] = {
+            field: [] if field == "ids" or field in include else None
+            for field in ("ids", "documents", "metadatas", "distances", "embeddings")
+        }
+        if not k:
+            for field, value in results.items():
+                if value is not None:
+                    value.extend([] for _ in range(len(queries)))
+            return results
+
+        distances = self._distances(queries)
+        for row in distances:
+            top = np.argpartition(row, k - 1)[:k]
+            top = top[np.argsort(row[top], kind="stable")]
+            results["ids"].append([self.ids[i] for i in top])
+            if "documents" in include:
+                results["documents"].append([self.documents[i] for i in top])
+            if "metadatas" in include:
+                results["metadatas"].append([self.metadatas[i] for i in top])
+            if "distances" in include:
+                results["distances"].append(row[top].tolist())
+            if "embeddings" in include:
+                results["embeddings"].append(self.embeddings[top].tolist())
+        return results
+
+    def close(self):
+        """Release the mapping."""
+        self.embeddings = self.norms = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays sliced from the snapshot are still alive; the map is freed once they are released
+            pass
+
+
+def export_collection(collection, fpath: str, page_size: int = 5000) -> int:
+    """Write every record of a Chroma collection to a snapshot file.
+
+    Returns:
+        Size of the written file in bytes.
+    """
+    ids, documents, metadatas, blocks = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(
+            include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset
+        )
+        ids.extend(page["ids"])
+        documents.extend(page["documents"])
+        metadatas.extend(page["metadatas"])
+        blocks.append(np.asarray(page["embeddings"], dtype=DTYPE))
+
+    dim = blocks[0].shape[1] if blocks else 0
+    embeddings = np.concatenate(blocks) if blocks else np.zeros((0, dim), DTYPE)
+    return write_snapshot(
+        fpath, ids, embeddings, documents, metadatas, collection.name, collection.metadata
+    )
+
+
+def import_snapshot(
+    fpath: str,
+    persist_directory: str = VECTOR_DB_DIR,
+    collection_name: Optional[str] = None,
+    batch_size: int = 5000,
+):
+    """Rebuild a persistent Chroma collection from a snapshot, replacing the existing directory.
+
+    The collection is built in a sibling directory and swapped in once
+    complete, so readers never see a half-imported index. The finished build
+    is first renamed to `<persist_directory>.staging` and the old directory
+    is kept as `.old` until the new one is in place, so an import interrupted
+    mid-swap is completed by `recover_vector_db` on the next start.
+
+    Returns:
+        The imported chromadb.Collection.
+    """
+    import chromadb
+
+    recover_vector_db(persist_directory)
+    snapshot = VectorSnapshot(fpath)
+    if not snapshot.verify():
+        snapshot.close()
+        raise ValueError(f"Snapshot checksum mismatch: {fpath}")
+
+    # Chroma caches clients per path in-process, so each import stages into a fresh directory
+    base_dir = persist_directory.rstrip(os.sep)
+    importing_dir = f"{base_dir}{IMPORTING_SUFFIX}{os.getpid()}-{time.time_ns()}"
+    try:
+        client = chromadb.PersistentClient(path=importing_dir)
+        collection = client.create_collection(
+            name=collection_name or snapshot.name, metadata=snapshot.metadata or None
+        )
+        batch_size = min(batch_size, client.get_max_batch_size())
+        for start in range(0, snapshot.count, batch_size):
+            end = start + batch_size
+            # Chroma rejects empty metadata, and collections ingested without any have none
+            metadatas = snapshot.metadatas[start:end]
+            collection.add(
+                ids=snapshot.ids[start:end],
+                embeddings=np.array(snapshot.embeddings[start:end]),
+                documents=snapshot.documents[start:end],
+                metadatas=metadatas if any(metadatas) else None,
+            )
+    except BaseException:
+        shutil.rmtree(importing_dir, ignore_errors=True)
+        raise
+    finally:
+        snapshot.close()
+
+    # The rename to .staging marks the build complete. From then on, the old
+    # directory survives as .old until the new one is in place
+    staging_dir, old_dir = f"{base_dir}.staging", f"{base_dir}.old"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.replace(importing_dir, staging_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(persist_directory):
+        os.replace(persist_directory, old_dir)
+    os.replace(staging_dir, persist_directory)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    # Drop cached clients still pointing at the replaced directory
+    client.clear_system_cache()
+    return chromadb.PersistentClient(path=persist_directory).get_collection(
+        name=collection_name or snapshot.name
+    )
+
+
+def recover_vector_db(persist_directory: str = VECTOR_DB_DIR) -> Optional[str]:
+    """Finish or roll back a snapshot import that was interrupted mid-swap.
+
+    If the persist directory is missing, a complete `.staging` build is
+    moved into place, or else the previous `.old` directory is restored.
+    Leftovers of finished swaps and builds of dead processes are removed.
+
+    Returns:
+        "staging" or "old" if a directory was moved into place, else None.
+    """
+    base_dir = persist_directory.rstrip(os.sep)
+    staging_dir, old_dir = f"{base_dir}.staging", f"{base_dir}.old"
+    recovered = None
+    if not os.path.exists(persist_directory):
+        if os.path.isdir(staging_dir):
+            os.replace(staging_dir, persist_directory)
+            recovered = "staging"
+        elif os.path.isdir(old_dir):
+            os.replace(old_dir, persist_directory)
+            recovered = "old"
+    if os.path.exists(persist_directory):
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    parent, prefix = os.path.split(os.path.abspath(base_dir) + IMPORTING_SUFFIX)
+    if os.path.isdir(parent):
+        for name in os.listdir(parent):
+            pid = name[len(prefix) :].split("-", 1)[0]
+            if name.startswith(prefix) and not _pid_alive(pid):
+                shutil.rmtree(os.path.join(parent, name), ignore_errors=True)
+    return recovered
+
+
+def _pid_alive(pid: str) -> bool:
+    """Returns True unless `pid` is a number naming a process that no longer exists."""
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, PermissionError):
+        return True
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def get_vector_index(
+    collection_name: str = "publications", app_config: Optional[Dict[str, Any]] = None
+):
+    """Returns the index to query: the configured snapshot if `vectordb.snapshot_path` is set, else Chroma.
+
+    A relative snapshot path is resolved against the repository root. Both expose `query(query_embeddings, n_results, include)` with the same result shape.
+    """
+    if app_config is None:
+        app_config = load_yaml_config(APP_CONFIG_FPATH)
+    snapshot_path = app_config.get("vectordb", {}).get("snapshot_path")
+    if snapshot_path:
+        return VectorSnapshot(os.path.join(ROOT_DIR, snapshot_path))
+
+    from run_wk3_l4_vector_db_ingest import get_db_collection
+
+    return get_db_collection(collection_name=collection_name)